@@ -0,0 +1,100 @@
+import datetime
+import json
+import pathlib
+import platform
+import subprocess
+from typing import Optional, Tuple
+
+import click
+import numpy as np
+
+from benchmarks.schemas import SHAPES
+from benchmarks.suite import run_suite
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option(
+    "--shape",
+    "shape_names",
+    multiple=True,
+    type=click.Choice(list(SHAPES)),
+    help="Synthetic schemas to run, all of them by default",
+)
+@click.option(
+    "--num-rows",
+    default=100000,
+    show_default=True,
+    help="Number of rows generated per table and per data type",
+)
+@click.option(
+    "--batch-size",
+    default=10000,
+    show_default=True,
+    help="Number of rows per batch",
+)
+@click.option(
+    "--repeat",
+    default=3,
+    show_default=True,
+    help="Number of runs of every benchmark, the fastest one is reported",
+)
+@click.option(
+    "--conninfo",
+    default=None,
+    help="libpq connection string of a throwaway database, for the introspection and load benchmarks",
+)
+@click.option(
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Write the JSON results to this file instead of stdout",
+)
+def main(
+    shape_names: Tuple[str, ...],
+    num_rows: int,
+    batch_size: int,
+    repeat: int,
+    conninfo: Optional[str],
+    output: Optional[pathlib.Path],
+):
+    shapes = [SHAPES[name] for name in (shape_names or SHAPES)]
+
+    results = run_suite(shapes, num_rows, batch_size, repeat, conninfo)
+
+    report = {
+        "commit": _get_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "parameters": {
+            "shapes": [shape.name for shape in shapes],
+            "num_rows": num_rows,
+            "batch_size": batch_size,
+            "repeat": repeat,
+            "postgres": conninfo is not None,
+        },
+        "results": results,
+    }
+
+    report_json = json.dumps(report, indent=2)
+    if output is None:
+        click.echo(report_json)
+    else:
+        output.write_text(report_json + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+
+class RecordingCopy:
+
+    def __init__(self, connection: "RecordingConnection"):
+        self._connection = connection
+
+    def write_row(self, row: Sequence[Any]):
+        self._connection.copied_rows += 1
+
+    def write(self, data: bytes):
+        self._connection.copied_bytes += len(data)
+
+
+class RecordingCursor:
+    # Queries return no rows, except for the aggregates which return 0 (e.g.
+    # the largest existing value of a unique column of an empty table)
+
+    def __init__(self, connection: "RecordingConnection"):
+        self._connection = connection
+        self._rows: List[Tuple[Any, ...]] = []
+
+    def execute(self, query: Any, params: Optional[Sequence[Any]] = None):
+        self._connection.statements.append(query)
+        self._rows = [(0,)]
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self) -> List[Tuple[Any, ...]]:
+        return []
+
+    def __iter__(self) -> Iterator[Tuple[Any, ...]]:
+        return iter([])
+
+    @contextmanager
+    def copy(self, statement: Any) -> Iterator[RecordingCopy]:
+        self._connection.statements.append(statement)
+        yield RecordingCopy(self._connection)
+
+
+class RecordingConnection:
+    # Stand-in for a psycopg connection that only counts what would be sent,
+    # so the pure Python stages can be measured without a database
+
+    def __init__(self):
+        self.statements: List[Any] = []
+        self.copied_rows = 0
+        self.copied_bytes = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self) -> RecordingCursor:
+        return RecordingCursor(self)
+
+    def execute(self, query: Any, params: Optional[Sequence[Any]] = None):
+        cursor = self.cursor()
+        cursor.execute(query, params)
+        return cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
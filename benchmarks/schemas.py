@@ -0,0 +1,195 @@
+from typing import Dict, List, Tuple
+
+from data_gen.depgraph import DepGraph
+from data_gen.table_node import TableNode, UniqueConstraint
+from data_gen.type_registry import TypeRegistry
+
+# Built-in types the generated columns cycle through, with the length of the
+# varchar columns
+COLUMN_TYPES: List[Tuple[str, str]] = [
+    ("bigint", "bigint"),
+    ("integer", "integer"),
+    ("text", "text"),
+    ("numeric", "numeric"),
+    ("double precision", "double precision"),
+    ("boolean", "boolean"),
+    ("date", "date"),
+    ("timestamp with time zone", "timestamp with time zone"),
+    ("character varying", "varchar(32)"),
+    ("uuid", "uuid"),
+    ("smallint", "smallint"),
+    ("real", "real"),
+    ("jsonb", "jsonb"),
+]
+
+VARCHAR_LENGTH = 32
+
+
+class SchemaShape:
+    # Layers of tables where every table of a layer references fan_out tables
+    # of the layer above it
+
+    def __init__(
+        self,
+        name: str,
+        width: int,
+        depth: int,
+        tables_per_level: int,
+        fan_out: int,
+    ):
+        if fan_out > tables_per_level:
+            raise ValueError(
+                f"Fan out {fan_out} can't be larger than the {tables_per_level} tables per level"
+            )
+
+        self._name = name
+        self._width = width
+        self._depth = depth
+        self._tables_per_level = tables_per_level
+        self._fan_out = fan_out
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def schema_name(self) -> str:
+        return f"bench_{self._name}"
+
+    @property
+    def width(self) -> int:
+        return self._width
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def tables_per_level(self) -> int:
+        return self._tables_per_level
+
+    @property
+    def fan_out(self) -> int:
+        return self._fan_out
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "width": self._width,
+            "depth": self._depth,
+            "tables_per_level": self._tables_per_level,
+            "fan_out": self._fan_out,
+        }
+
+    def table_name(self, level: int, index: int) -> str:
+        return f"t{level}_{index}"
+
+    def get_parents(self, level: int, index: int) -> List[int]:
+        # Indices of the tables in the level above
+        if level == 0:
+            return []
+        return [
+            (index + offset) % self._tables_per_level for offset in range(self._fan_out)
+        ]
+
+    def get_columns(self) -> List[Tuple[str, str, str]]:
+        # (column name, data type, DDL type) of the columns of every table
+        return [
+            (f"c{position}",) + COLUMN_TYPES[position % len(COLUMN_TYPES)]
+            for position in range(self._width)
+        ]
+
+
+SHAPES: Dict[str, SchemaShape] = {
+    shape.name: shape
+    for shape in (
+        SchemaShape("narrow", width=4, depth=3, tables_per_level=2, fan_out=1),
+        SchemaShape("wide", width=40, depth=2, tables_per_level=2, fan_out=1),
+        SchemaShape("deep", width=6, depth=8, tables_per_level=1, fan_out=1),
+        SchemaShape("fan_out", width=6, depth=3, tables_per_level=4, fan_out=4),
+    )
+}
+
+
+def build_ddl(shape: SchemaShape) -> str:
+    statements = [
+        f"DROP SCHEMA IF EXISTS {shape.schema_name} CASCADE;",
+        f"CREATE SCHEMA {shape.schema_name};",
+    ]
+
+    for level in range(shape.depth):
+        for index in range(shape.tables_per_level):
+            definitions = ["id bigint PRIMARY KEY"]
+            definitions += [
+                f"{column_name} {ddl_type}"
+                for column_name, _, ddl_type in shape.get_columns()
+            ]
+            definitions += [
+                f"parent_{parent} bigint NOT NULL REFERENCES "
+                f"{shape.schema_name}.{shape.table_name(level - 1, parent)}(id)"
+                for parent in shape.get_parents(level, index)
+            ]
+
+            statements.append(
+                f"CREATE TABLE {shape.schema_name}.{shape.table_name(level, index)} "
+                f"({', '.join(definitions)});"
+            )
+
+    return "\n".join(statements)
+
+
+def build_dep_graph(shape: SchemaShape) -> DepGraph:
+    # Same schema as build_ddl, without a database
+    dep_graph = DepGraph()
+    dep_graph.type_registry = TypeRegistry()
+
+    for level in range(shape.depth):
+        for index in range(shape.tables_per_level):
+            full_table_name = f"{shape.schema_name}.{shape.table_name(level, index)}"
+            table = TableNode(full_table_name=full_table_name)
+
+            table.add_column(
+                column_name="id",
+                data_type="bigint",
+                is_nullable=False,
+                udt_name="int8",
+            )
+            for column_name, data_type, _ in shape.get_columns():
+                table.add_column(
+                    column_name=column_name,
+                    data_type=data_type,
+                    is_nullable=True,
+                    udt_name=data_type,
+                    max_length=(
+                        VARCHAR_LENGTH if data_type == "character varying" else None
+                    ),
+                )
+            for parent in shape.get_parents(level, index):
+                table.add_column(
+                    column_name=f"parent_{parent}",
+                    data_type="bigint",
+                    is_nullable=False,
+                    udt_name="int8",
+                )
+
+            table.add_unique_constraint(
+                UniqueConstraint(
+                    constraint_name=f"{table.table_name}_pkey",
+                    column_names=["id"],
+                    is_primary_key=True,
+                )
+            )
+            dep_graph.add_table(table)
+
+            for parent in shape.get_parents(level, index):
+                parent_table_name = (
+                    f"{shape.schema_name}.{shape.table_name(level - 1, parent)}"
+                )
+                dep_graph.add_child(
+                    child=table,
+                    parent=dep_graph.get_table(parent_table_name),
+                    constraint_name=f"{table.table_name}_parent_{parent}_fkey",
+                    parent_columns=["id"],
+                    child_columns=[f"parent_{parent}"],
+                )
+
+    return dep_graph
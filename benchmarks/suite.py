@@ -0,0 +1,348 @@
+import pathlib
+import statistics
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import psycopg
+
+from benchmarks.fake_connection import RecordingConnection
+from benchmarks.schemas import SchemaShape, build_ddl, build_dep_graph
+from data_gen.data import fill_tables, write_tables
+from data_gen.depgraph import DepGraph
+from data_gen.generators import (
+    DEFAULT_TEXT_GENERATOR,
+    TEXT_GENERATORS,
+    TYPE_GENERATORS,
+    choose_values,
+)
+from data_gen.inspection import generate_dependency_graph
+from data_gen.key_pool import KeyPool
+from data_gen.plan import compile_table_plan
+from data_gen.sinks import create_file_sink
+from data_gen.value_pools import build_pool
+
+Result = Dict[str, Any]
+
+# Sizes of the parent tables the foreign keys are sampled from
+FOREIGN_KEY_PARENT_SIZES = (1000, 1000000)
+
+ENUM_LABELS = ["active", "inactive", "banned", "pending"]
+
+
+def measure(
+    run: Callable[[Any], Any],
+    repeat: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> List[float]:
+    # Seconds taken by every run, setup excluded
+    timings: List[float] = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def make_result(
+    benchmark: str,
+    case: str,
+    timings: List[float],
+    rows: Optional[int] = None,
+    **details: Any,
+) -> Result:
+    result: Result = {
+        "benchmark": benchmark,
+        "case": case,
+        "seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "repeat": len(timings),
+    }
+    if rows is not None:
+        result["rows"] = rows
+        result["rows_per_second"] = rows / min(timings) if min(timings) > 0 else None
+    result.update(details)
+    return result
+
+
+def _fill_key_pool(dep_graph: DepGraph, num_keys: int) -> KeyPool:
+    # Every referenced key gets num_keys keys, as if its table was filled
+    key_pool = KeyPool()
+    for table in dep_graph.get_all_tables():
+        for column_names in dep_graph.get_referenced_keys(table.full_table_name):
+            columns = [np.arange(num_keys, dtype=np.int64) for _ in column_names]
+            if len(column_names) == 1:
+                key_pool.add_column_keys(table.full_table_name, column_names[0], columns[0])
+            else:
+                key_pool.add_composite_keys(table.full_table_name, column_names, columns)
+    return key_pool
+
+
+def bench_value_pools(repeat: int) -> List[Result]:
+    providers = ["first_name", "last_name", "email", "phone_number", "word", "sentence"]
+    return [
+        make_result(
+            "value_pool_build",
+            provider,
+            measure(lambda _: build_pool(provider), repeat),
+        )
+        for provider in providers
+    ]
+
+
+def bench_type_generation(num_rows: int, repeat: int) -> List[Result]:
+    rng = np.random.default_rng(0)
+
+    generators: Dict[str, Callable[[np.random.Generator, int], np.ndarray]] = dict(
+        TYPE_GENERATORS
+    )
+    for column_name, generator in TEXT_GENERATORS.items():
+        generators[f"text:{column_name}"] = generator
+    generators["text:default"] = DEFAULT_TEXT_GENERATOR
+    generators["enum"] = lambda rng, n: choose_values(rng, ENUM_LABELS, n)
+
+    results: List[Result] = []
+    for case, generator in generators.items():
+        # The first call builds the value pools, which are measured on their own
+        generator(rng, 1)
+
+        timings = measure(lambda _: generator(rng, num_rows), repeat)
+        results.append(make_result("type_generation", case, timings, num_rows))
+
+    return results
+
+
+def bench_foreign_keys(num_rows: int, repeat: int) -> List[Result]:
+    rng = np.random.default_rng(0)
+    results: List[Result] = []
+
+    for parent_size in FOREIGN_KEY_PARENT_SIZES:
+        key_pool = KeyPool()
+        key_pool.add_column_keys(
+            "bench.parent", "id", np.arange(parent_size, dtype=np.int64)
+        )
+
+        timings = measure(
+            lambda _: key_pool.sample_many("bench.parent", "id", rng, num_rows),
+            repeat,
+        )
+        results.append(
+            make_result(
+                "foreign_key_sampling",
+                f"integer_keys_{parent_size}",
+                timings,
+                num_rows,
+                parent_rows=parent_size,
+            )
+        )
+
+        text_pool = KeyPool()
+        text_pool.add_keys(
+            "bench.parent", "code", (f"key-{index}" for index in range(parent_size))
+        )
+        timings = measure(
+            lambda _: text_pool.sample_many("bench.parent", "code", rng, num_rows),
+            repeat,
+        )
+        results.append(
+            make_result(
+                "foreign_key_sampling",
+                f"text_keys_{parent_size}",
+                timings,
+                num_rows,
+                parent_rows=parent_size,
+            )
+        )
+
+    # Recording the keys of a filled table for its children
+    keys = np.arange(num_rows, dtype=np.int64)
+    timings = measure(
+        lambda key_pool: key_pool.add_column_keys("bench.parent", "id", keys),
+        repeat,
+        setup=KeyPool,
+    )
+    results.append(make_result("foreign_key_capture", "integer_keys", timings, num_rows))
+
+    return results
+
+
+def bench_plan(shape: SchemaShape, repeat: int) -> List[Result]:
+    dep_graph = build_dep_graph(shape)
+    key_pool = _fill_key_pool(dep_graph, 1000)
+    tables = [dep_graph.get_table(name) for name in dep_graph.get_fill_order()]
+
+    def compile_plans(_):
+        for table in tables:
+            compile_table_plan(table, key_pool, dep_graph.type_registry)
+
+    return [
+        make_result(
+            "plan",
+            shape.name,
+            measure(compile_plans, repeat),
+            tables=len(tables),
+            shape=shape.to_dict(),
+        )
+    ]
+
+
+def bench_fill_tables_fake(
+    shape: SchemaShape, num_rows: int, batch_size: int, repeat: int
+) -> List[Result]:
+    dep_graph = build_dep_graph(shape)
+    num_tables = len(dep_graph.get_all_tables())
+
+    timings = measure(
+        lambda connection: fill_tables(
+            dep_graph, connection, num_rows=num_rows, batch_size=batch_size
+        ),
+        repeat,
+        setup=RecordingConnection,
+    )
+    return [
+        make_result(
+            "fill_tables_fake",
+            shape.name,
+            timings,
+            num_rows * num_tables,
+            tables=num_tables,
+            batch_size=batch_size,
+            shape=shape.to_dict(),
+        )
+    ]
+
+
+def bench_write_tables(
+    shape: SchemaShape, num_rows: int, batch_size: int, repeat: int
+) -> List[Result]:
+    dep_graph = build_dep_graph(shape)
+    num_tables = len(dep_graph.get_all_tables())
+    results: List[Result] = []
+
+    for output_format in ("copy", "binary", "csv"):
+        with tempfile.TemporaryDirectory() as output_dir:
+            timings = measure(
+                lambda _: write_tables(
+                    dep_graph,
+                    create_file_sink(output_format, pathlib.Path(output_dir)),
+                    num_rows=num_rows,
+                    batch_size=batch_size,
+                ),
+                repeat,
+            )
+
+        results.append(
+            make_result(
+                "write_tables",
+                f"{shape.name}:{output_format}",
+                timings,
+                num_rows * num_tables,
+                tables=num_tables,
+                batch_size=batch_size,
+                shape=shape.to_dict(),
+            )
+        )
+
+    return results
+
+
+def _truncate_shape(shape: SchemaShape, db_connection: psycopg.Connection):
+    table_names = ", ".join(
+        f"{shape.schema_name}.{shape.table_name(level, index)}"
+        for level in range(shape.depth)
+        for index in range(shape.tables_per_level)
+    )
+    db_connection.execute(f"TRUNCATE {table_names} CASCADE")
+    db_connection.commit()
+
+
+def bench_postgres(
+    shapes: List[SchemaShape],
+    conninfo: str,
+    num_rows: int,
+    batch_size: int,
+    repeat: int,
+) -> List[Result]:
+    # The benchmark schemas are created in the database and dropped at the
+    # end. Introspection reads the whole database, so use a throwaway one.
+    results: List[Result] = []
+
+    with psycopg.connect(conninfo) as db_connection:
+        try:
+            for shape in shapes:
+                db_connection.execute(build_ddl(shape))
+            db_connection.commit()
+
+            def introspect(_):
+                generate_dependency_graph(DepGraph(), db_connection)
+                db_connection.commit()
+
+            results.append(
+                make_result(
+                    "introspection",
+                    "+".join(shape.name for shape in shapes),
+                    measure(introspect, repeat),
+                    tables=sum(shape.depth * shape.tables_per_level for shape in shapes),
+                )
+            )
+
+            for shape in shapes:
+                # Only the tables of the shape are filled, never the rest of
+                # the database
+                dep_graph = build_dep_graph(shape)
+                num_tables = len(dep_graph.get_all_tables())
+
+                timings = measure(
+                    lambda _: fill_tables(
+                        dep_graph,
+                        db_connection,
+                        num_rows=num_rows,
+                        batch_size=batch_size,
+                    ),
+                    repeat,
+                    setup=lambda: _truncate_shape(shape, db_connection),
+                )
+                results.append(
+                    make_result(
+                        "fill_tables_postgres",
+                        shape.name,
+                        timings,
+                        num_rows * num_tables,
+                        tables=num_tables,
+                        batch_size=batch_size,
+                        shape=shape.to_dict(),
+                    )
+                )
+        finally:
+            db_connection.rollback()
+            for shape in shapes:
+                db_connection.execute(f"DROP SCHEMA IF EXISTS {shape.schema_name} CASCADE")
+            db_connection.commit()
+
+    return results
+
+
+def run_suite(
+    shapes: List[SchemaShape],
+    num_rows: int,
+    batch_size: int,
+    repeat: int,
+    conninfo: Optional[str] = None,
+) -> List[Result]:
+    results: List[Result] = []
+
+    results += bench_value_pools(repeat=1)
+    results += bench_type_generation(num_rows, repeat)
+    results += bench_foreign_keys(num_rows, repeat)
+
+    for shape in shapes:
+        results += bench_plan(shape, repeat)
+        results += bench_fill_tables_fake(shape, num_rows, batch_size, repeat)
+        results += bench_write_tables(shape, num_rows, batch_size, repeat)
+
+    if conninfo is not None:
+        results += bench_postgres(shapes, conninfo, num_rows, batch_size, repeat)
+
+    return results
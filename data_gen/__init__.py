@@ -0,0 +1,4 @@
+import logging
+
+# Silent unless the application configures logging
+logging.getLogger("data_gen").addHandler(logging.NullHandler())
@@ -1,53 +1,516 @@
-import psycopg
+import logging
+import pathlib
+from typing import Optional, Tuple
 
-from data_gen.data import fill_tables
-from data_gen.depgraph import DepGraph
-from data_gen.inspection import generate_dependency_graph
+import click
 
+from data_gen.metrics import get_metrics
+from data_gen.parameters import (
+    BATCH_SIZE_DEFAULT,
+    COMPRESSIONS,
+    CONNINFO_DEFAULT,
+    FAST_LOAD_MODES,
+    JOURNAL_FILE_DEFAULT,
+    JOURNAL_KINDS,
+    KEY_SAMPLE_METHOD_DEFAULT,
+    KEY_SAMPLE_METHODS,
+    MAX_PARENT_KEYS_DEFAULT,
+    NUM_ROWS_DEFAULT,
+    OUTPUT_FORMATS,
+    QUEUE_SIZE_DEFAULT,
+    REBUILD_WORKERS_DEFAULT,
+    SHARDS_DEFAULT,
+    SNAPSHOT_FILE_DEFAULT,
+    TOP_UP_EXACT_COUNT_MAX,
+    VALUE_POOL_FILE_DEFAULT,
+    WORKERS_DEFAULT,
+)
+from data_gen.subset import TableFilter
 
-def main():
+# The modules doing the work pull in numpy, networkx, psycopg and Faker, so
+# main imports them once the arguments are parsed and --help or bad
+# arguments return without loading them
 
-    # Make the postgres connection
-    connection = psycopg.connect(
-        "host=localhost dbname=postgres user=postgres password=postgres port=5432"
+logger = logging.getLogger("data_gen")
+
+
+@click.command()
+@click.option(
+    "--conninfo",
+    default=CONNINFO_DEFAULT,
+    show_default=True,
+    help="libpq connection string of the database to fill",
+)
+@click.option(
+    "--num-rows",
+    default=NUM_ROWS_DEFAULT,
+    show_default=True,
+    help="Number of rows to generate for each table",
+)
+@click.option(
+    "--scale",
+    default=None,
+    type=float,
+    help="Multiply the number of rows of every table, overriding the scale of --scale-file",
+)
+@click.option(
+    "--scale-file",
+    default=None,
+    type=click.Path(dir_okay=False, exists=True, path_type=pathlib.Path),
+    help="JSON file with the number of rows of every table, or per row of its parent, and the fan-out of every foreign key (uniform, zipf or fixed)",
+)
+@click.option(
+    "--include",
+    multiple=True,
+    help="Only fill the tables matching this schema.table glob (a bare name matches a schema), and the tables they reference; can be repeated",
+)
+@click.option(
+    "--exclude",
+    multiple=True,
+    help="Do not fill the tables matching this schema.table glob unless a selected table references them; can be repeated",
+)
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE_DEFAULT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of rows sent to the database in a single COPY",
+)
+@click.option(
+    "--commit-per-batch/--commit-per-table",
+    default=False,
+    show_default=True,
+    help="Commit after every batch instead of once per table",
+)
+@click.option(
+    "--snapshot-file",
+    default=SNAPSHOT_FILE_DEFAULT,
+    show_default=True,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Schema snapshot reused while the database schema is unchanged",
+)
+@click.option(
+    "--no-snapshot",
+    is_flag=True,
+    help="Always introspect the database and do not write a snapshot",
+)
+@click.option(
+    "--workers",
+    default=WORKERS_DEFAULT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of tables filled concurrently, each on its own connection",
+)
+@click.option(
+    "--shards",
+    default=SHARDS_DEFAULT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of processes generating and loading a single large table",
+)
+@click.option(
+    "--async",
+    "use_async",
+    is_flag=True,
+    help="Overlap generation and loading: --workers threads generate batches while as many connections COPY them",
+)
+@click.option(
+    "--queue-size",
+    default=QUEUE_SIZE_DEFAULT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of generated batches of a table waiting to be loaded in --async mode",
+)
+@click.option(
+    "--journal",
+    default="none",
+    show_default=True,
+    type=click.Choice(JOURNAL_KINDS),
+    help="Record the committed batches in a table of the database or in --journal-file, so that an interrupted fill can be resumed",
+)
+@click.option(
+    "--journal-file",
+    default=JOURNAL_FILE_DEFAULT,
+    show_default=True,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="File of --journal file",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the fill recorded in the journal, skipping the batches it already committed",
+)
+@click.option(
+    "--top-up",
+    is_flag=True,
+    help="Only add the rows every table is missing to reach its number of rows, skipping the tables that already have them",
+)
+@click.option(
+    "--exact-count-max",
+    default=TOP_UP_EXACT_COUNT_MAX,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="With --top-up, tables estimated by the statistics to have fewer rows than this are counted exactly",
+)
+@click.option(
+    "--fast-load",
+    default="none",
+    show_default=True,
+    type=click.Choice(FAST_LOAD_MODES),
+    help="Load every table without its secondary indexes, and without its foreign keys and triggers (drop) or as session_replication_role=replica (replica, superuser only), rebuilding them afterwards",
+)
+@click.option(
+    "--unlogged",
+    is_flag=True,
+    help="With --fast-load, load the tables that no foreign key links to other tables as UNLOGGED",
+)
+@click.option(
+    "--rebuild-workers",
+    default=REBUILD_WORKERS_DEFAULT,
+    show_default=True,
+    help="Number of connections rebuilding the indexes of a table at the same time with --fast-load",
+)
+@click.option(
+    "--max-parent-keys",
+    default=MAX_PARENT_KEYS_DEFAULT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Keys of a pre-existing parent kept in memory, larger parents are sampled",
+)
+@click.option(
+    "--key-sample-method",
+    default=KEY_SAMPLE_METHOD_DEFAULT,
+    show_default=True,
+    type=click.Choice(KEY_SAMPLE_METHODS),
+    help="How the keys of parents larger than --max-parent-keys are sampled: TABLESAMPLE SYSTEM, TABLESAMPLE BERNOULLI, or runs of the index of integer keys (range)",
+)
+@click.option(
+    "--server-side",
+    is_flag=True,
+    help="Generate the rows inside the database with INSERT ... SELECT FROM generate_series, only the columns it can't generate (e.g. fake text) are sent",
+)
+@click.option(
+    "--output-dir",
+    default=None,
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    help="Write the data to files in this directory instead of a database, using the schema snapshot",
+)
+@click.option(
+    "--output-format",
+    default="copy",
+    show_default=True,
+    type=click.Choice(OUTPUT_FORMATS),
+    help="Format of the files written to --output-dir",
+)
+@click.option(
+    "--compression",
+    default="none",
+    show_default=True,
+    type=click.Choice(COMPRESSIONS),
+    help="Compression of the files written to --output-dir",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Generate every value from this seed, so that runs are reproducible",
+)
+@click.option(
+    "--value-pool-file",
+    default=VALUE_POOL_FILE_DEFAULT,
+    show_default=True,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="File keeping the pools of fake names, emails and text between runs",
+)
+@click.option(
+    "--capture-profile",
+    "capture_file",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Save the column statistics (pg_stats) of the database to this profile file and exit",
+)
+@click.option(
+    "--profile-file",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+    help="Sample the values of the columns from the statistics of a captured profile",
+)
+@click.option(
+    "--draw-graph",
+    is_flag=True,
+    help="Write the dependency graph to depgraph.dot and render it to depgraph.pdf with Graphviz in the background",
+)
+@click.option(
+    "--log-level",
+    default="WARNING",
+    show_default=True,
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False),
+    help="Level of the messages written to stderr",
+)
+@click.option(
+    "--progress",
+    is_flag=True,
+    help="Report the rows done, rows/s and the remaining time while filling",
+)
+@click.option(
+    "--metrics-file",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Write the counters and timers of every table to this JSON file at the end",
+)
+def main(
+    conninfo: str,
+    num_rows: int,
+    scale: Optional[float],
+    scale_file: Optional[pathlib.Path],
+    include: Tuple[str, ...],
+    exclude: Tuple[str, ...],
+    batch_size: int,
+    commit_per_batch: bool,
+    snapshot_file: pathlib.Path,
+    no_snapshot: bool,
+    workers: int,
+    shards: int,
+    use_async: bool,
+    queue_size: int,
+    journal: str,
+    journal_file: pathlib.Path,
+    resume: bool,
+    top_up: bool,
+    exact_count_max: int,
+    fast_load: str,
+    unlogged: bool,
+    rebuild_workers: int,
+    max_parent_keys: int,
+    key_sample_method: str,
+    server_side: bool,
+    output_dir: Optional[pathlib.Path],
+    output_format: str,
+    compression: str,
+    seed: Optional[int],
+    value_pool_file: pathlib.Path,
+    capture_file: Optional[pathlib.Path],
+    profile_file: Optional[pathlib.Path],
+    draw_graph: bool,
+    log_level: str,
+    progress: bool,
+    metrics_file: Optional[pathlib.Path],
+):
+
+    logging.basicConfig(
+        level=log_level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
     )
+    if progress:
+        logging.getLogger("data_gen.progress").setLevel(logging.INFO)
+
+    # Written even when the run fails, to see how far it got
+    if metrics_file is not None:
+        click.get_current_context().call_on_close(
+            lambda: get_metrics().dump(metrics_file)
+        )
+
+    import psycopg
+
+    from data_gen.data import fill_tables, write_tables
+    from data_gen.fast_load import create_fast_load, with_replication_role
+    from data_gen.journal import create_journal
+    from data_gen.key_source import KeySource
+    from data_gen.profile import capture_profile, load_profile, save_profile, set_profile
+    from data_gen.scale import load_scale_spec
+    from data_gen.sinks import create_file_sink
+    from data_gen.snapshot import load_dependency_graph, load_snapshot
+    from data_gen.value_pools import set_pool_file
+
+    # Fake values are built once and then reused by every run
+    set_pool_file(value_pool_file)
 
-    # Ping the database
     try:
-        connection.cursor()
-    except psycopg.OperationalError:
-        print("Failed to connect to the database")
-        return 1
+        scale_spec = load_scale_spec(scale_file, scale)
+    except ValueError as error:
+        raise click.BadParameter(f"Invalid scale spec: {error}", param_hint="--scale-file")
+
+    try:
+        table_filter = TableFilter(include, exclude)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--include/--exclude")
+
+    if profile_file is not None:
+        try:
+            set_profile(load_profile(profile_file))
+        except (ValueError, KeyError, TypeError) as error:
+            raise click.BadParameter(
+                f"Invalid profile {profile_file}: {error}", param_hint="--profile-file"
+            )
+
+    # Generate files from the snapshot alone, without connecting to a database
+    if output_dir is not None:
+        if top_up:
+            raise click.UsageError("--top-up needs a database to count the rows of")
+
+        if not snapshot_file.exists():
+            raise click.UsageError(
+                f"Schema snapshot {snapshot_file} not found, run once against the database to create it"
+            )
+
+        dep_graph, _ = load_snapshot(snapshot_file)
+        if not table_filter.is_empty:
+            dep_graph = dep_graph.subset(
+                table_filter.select(table.full_table_name for table in dep_graph.get_all_tables())
+            )
+
+        write_tables(
+            dep_graph,
+            create_file_sink(output_format, output_dir, compression),
+            num_rows=num_rows,
+            batch_size=batch_size,
+            seed=seed,
+            scale_spec=scale_spec,
+        )
+        return
+
+    if use_async and shards > 1:
+        raise click.UsageError("--shards can't be combined with --async")
+
+    if use_async and journal != "none":
+        raise click.UsageError("--journal can't be combined with --async")
 
-    # Create DepGraph
-    dep_graph = DepGraph()
+    if resume and journal == "none":
+        raise click.UsageError("--resume needs the --journal of the interrupted fill")
 
-    # Generate the dependency graph
-    generate_dependency_graph(dep_graph, connection)
+    # A top-up is resumed by running it again
+    if resume and top_up:
+        raise click.UsageError("--resume can't be combined with --top-up")
 
-    # Print all the tables
-    print("Tables:")
-    all_tables = dep_graph.get_all_tables()
-    print(f"Number of tables: {len(all_tables)}")
-    for table in all_tables:
-        print(table)
+    if use_async and fast_load != "none":
+        raise click.UsageError("--fast-load can't be combined with --async")
 
-    print("\n\n")
+    if use_async and server_side:
+        raise click.UsageError("--server-side can't be combined with --async")
+
+    if unlogged and fast_load == "none":
+        raise click.UsageError("--unlogged needs --fast-load")
+
+    # Every connection of the fill skips the triggers and foreign key checks
+    if fast_load == "replica":
+        conninfo = with_replication_role(conninfo)
+
+    # Make the postgres connection
+    try:
+        connection = psycopg.connect(conninfo)
+    except psycopg.OperationalError as error:
+        raise click.ClickException(f"Failed to connect to the database: {error}")
+
+    # Save the statistics of the source database instead of filling it
+    if capture_file is not None:
+        profile = capture_profile(connection, table_filter)
+        save_profile(profile, capture_file)
+        logger.info(
+            "Saved the statistics of %d columns of %d tables to %s",
+            profile.num_columns,
+            len(profile.table_names),
+            capture_file,
+        )
+        return
+
+    # Generate the dependency graph, or reuse the snapshot of an unchanged schema
+    snapshot_path: Optional[pathlib.Path] = None if no_snapshot else snapshot_file
+    dep_graph = load_dependency_graph(connection, snapshot_path, table_filter)
+
+    # Log all the tables and the order they are filled in
+    for table in dep_graph.get_all_tables():
+        logger.debug("%s", table)
 
-    # Print the dependency graph
-    print("Dependency Graph:")
     order = dep_graph.get_fill_order()
-    print(f"Number of tables: {len(list(order))}")
-    for table in order:
-        print(table)
+    logger.info("Filling %d tables in order: %s", len(order), ", ".join(order))
+    for parent, child in dep_graph.edges():
+        logger.debug("%s -> %s", parent, child)
 
-    # Draw the graph
-    dep_graph.draw_graph()
+    # Render the graph in the background, dot takes long on large graphs
+    if draw_graph:
+        dep_graph.draw_graph()
 
-    dep_graph.print_graph()
+    # Read the progress of the interrupted fill, or start a new journal
+    fill_journal = create_journal(journal, journal_file)
+    if fill_journal is not None:
+        fill_journal.open(connection, resume)
+
+    # Put back whatever an interrupted fast load left suspended
+    fill_fast_load = create_fast_load(fast_load, unlogged, conninfo, rebuild_workers)
+    if fill_fast_load is not None:
+        fill_fast_load.open(connection)
+
+    # Keys of large pre-existing parents are sampled rather than all read
+    key_source = KeySource(max_parent_keys, key_sample_method, seed)
 
     # Fill the tables
-    fill_tables(dep_graph, connection)
+    if use_async:
+        import asyncio
+
+        from data_gen.pipeline import fill_tables_async
+
+        asyncio.run(
+            fill_tables_async(
+                dep_graph,
+                conninfo,
+                num_workers=workers,
+                num_rows=num_rows,
+                batch_size=batch_size,
+                commit_per_batch=commit_per_batch,
+                queue_size=queue_size,
+                seed=seed,
+                scale_spec=scale_spec,
+                key_source=key_source,
+                top_up=top_up,
+                exact_count_max=exact_count_max,
+            )
+        )
+        return
+
+    if workers == 1:
+        fill_tables(
+            dep_graph,
+            connection,
+            num_rows=num_rows,
+            batch_size=batch_size,
+            commit_per_batch=commit_per_batch,
+            num_shards=shards,
+            conninfo=conninfo,
+            seed=seed,
+            journal=fill_journal,
+            fast_load=fill_fast_load,
+            server_side=server_side,
+            scale_spec=scale_spec,
+            key_source=key_source,
+            top_up=top_up,
+            exact_count_max=exact_count_max,
+        )
+        return
+
+    # Fill independent tables concurrently over a pool of connections
+    from psycopg_pool import ConnectionPool
+
+    from data_gen.scheduler import fill_tables_parallel
+
+    with ConnectionPool(conninfo, min_size=workers, max_size=workers) as pool:
+        fill_tables_parallel(
+            dep_graph,
+            pool,
+            num_workers=workers,
+            num_rows=num_rows,
+            batch_size=batch_size,
+            commit_per_batch=commit_per_batch,
+            num_shards=shards,
+            conninfo=conninfo,
+            seed=seed,
+            journal=fill_journal,
+            fast_load=fill_fast_load,
+            server_side=server_side,
+            scale_spec=scale_spec,
+            key_source=key_source,
+            top_up=top_up,
+            exact_count_max=exact_count_max,
+        )
 
 
 if __name__ == "__main__":
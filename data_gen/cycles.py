@@ -0,0 +1,87 @@
+import secrets
+from typing import List, Optional, Sequence
+
+from psycopg import sql
+
+from data_gen.table_node import ForeignKeyConstraint
+
+# Identifies the rows written by the current transaction, as opposed to the
+# rows that were in the table before the fill
+_CURRENT_TRANSACTION_FILTER = sql.SQL("{}.xmin = pg_current_xact_id()::xid").format(
+    sql.Identifier("child")
+)
+
+
+def _split_table_name(table_name: str) -> sql.Identifier:
+    schema_name, relation_name = table_name.split(".", 1)
+    return sql.Identifier(schema_name, relation_name)
+
+
+def defer_constraints_statement(
+    relationships: Sequence[ForeignKeyConstraint],
+) -> Optional[sql.Composed]:
+    # Deferrable foreign keys are only checked at commit, after the patch
+    constraints = [
+        sql.Identifier(relationship.child_table.split(".", 1)[0], relationship.constraint_name)
+        for relationship in relationships
+        if relationship.is_deferrable
+    ]
+    if not constraints:
+        return None
+
+    return sql.SQL("SET CONSTRAINTS {} DEFERRED").format(sql.SQL(", ").join(constraints))
+
+
+def patch_statement(relationship: ForeignKeyConstraint, salt: str) -> sql.Composed:
+    # Points the rows of the child written by the current transaction to
+    # random rows of the parent, in a single statement. The keys of the parent
+    # are collected into arrays, one per column, and every child row picks an
+    # index from a hash of its location, so composite keys stay whole and
+    # seeded fills patch the same way every time.
+    parent_columns = [sql.Identifier(column) for column in relationship.parent_columns]
+    key_arrays = [f"keys_{index}" for index in range(len(parent_columns))]
+
+    row_index = sql.SQL(
+        "1 + mod(hashtext({}.ctid::text || {})::bigint + 2147483648, {}.num_keys)"
+    ).format(sql.Identifier("child"), sql.Literal(salt), sql.Identifier("parent"))
+
+    return sql.SQL(
+        "UPDATE {child_table} AS child SET {assignments} "
+        "FROM (SELECT {aggregates}, count(*) AS num_keys FROM {parent_table} "
+        "WHERE {not_null}) AS parent "
+        "WHERE parent.num_keys > 0 AND {current_transaction}"
+    ).format(
+        child_table=_split_table_name(relationship.child_table),
+        assignments=sql.SQL(", ").join(
+            sql.SQL("{} = {}[{}]").format(
+                sql.Identifier(child_column),
+                sql.Identifier("parent", key_array),
+                row_index,
+            )
+            for child_column, key_array in zip(relationship.child_columns, key_arrays)
+        ),
+        aggregates=sql.SQL(", ").join(
+            sql.SQL("array_agg({} ORDER BY {}) AS {}").format(
+                parent_column,
+                sql.SQL(", ").join(parent_columns),
+                sql.Identifier(key_array),
+            )
+            for parent_column, key_array in zip(parent_columns, key_arrays)
+        ),
+        parent_table=_split_table_name(relationship.parent_table),
+        not_null=sql.SQL(" AND ").join(
+            sql.SQL("{} IS NOT NULL").format(column) for column in parent_columns
+        ),
+        current_transaction=_CURRENT_TRANSACTION_FILTER,
+    )
+
+
+def patch_statements(
+    relationships: Sequence[ForeignKeyConstraint], seed: Optional[int] = None
+) -> List[sql.Composed]:
+    # One statement per deferred foreign key
+    salt = str(seed) if seed is not None else secrets.token_hex(8)
+    return [
+        patch_statement(relationship, f"{salt}/{relationship.constraint_name}")
+        for relationship in relationships
+    ]
@@ -1,227 +1,629 @@
-import random
-from typing import Any, Dict, Tuple
-import uuid
+import itertools
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
 
-from faker import Faker
+import numpy as np
 from psycopg import Connection
+from data_gen.cycles import defer_constraints_statement, patch_statements
 from data_gen.depgraph import DepGraph, TableNode
-from data_gen.sql_enums import (
-    check_if_type_is_enum,
-    get_enum_options,
-    get_user_defined_type,
+from data_gen.fast_load import FastLoad
+from data_gen.journal import Journal
+from data_gen.key_pool import KeyPool
+from data_gen.key_source import KeySource
+from data_gen.metrics import get_metrics
+from data_gen.parameters import (
+    BATCH_SIZE_DEFAULT,
+    NUM_ROWS_DEFAULT,
+    SHARD_MIN_ROWS,
+    SHARDS_DEFAULT,
+    TOP_UP_EXACT_COUNT_MAX,
 )
+from data_gen.plan import compile_table_plan
+from data_gen.scale import FanOut, ScaleSpec, get_fan_outs, get_row_counts
+from data_gen.server_plan import compile_server_plan, insert_ranges
+from data_gen.sharding import (
+    fill_table_sharded,
+    get_unique_columns,
+    get_unique_offsets,
+)
+from data_gen.sinks import DatabaseSink, Sink
+from data_gen.table_node import ForeignKeyConstraint
+from data_gen.top_up import get_top_up
+from data_gen.uniqueness import (
+    create_unique_filters,
+    get_checked_constraints,
+    get_unique_foreign_keys,
+    load_unique_filters,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def fill_table(
-    table: TableNode, dep_graph: DepGraph, db_connection: Connection, num_rows: int = 10
+    table: TableNode,
+    dep_graph: DepGraph,
+    db_connection: Connection,
+    key_pool: KeyPool,
+    rng: np.random.Generator,
+    num_rows: int = NUM_ROWS_DEFAULT,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    commit_per_batch: bool = False,
+    num_shards: int = SHARDS_DEFAULT,
+    conninfo: Optional[str] = None,
+    seed: Optional[int] = None,
+    journal: Optional[Journal] = None,
+    deferred_relationships: Sequence[ForeignKeyConstraint] = (),
+    commit: bool = True,
+    server_side: bool = False,
+    fan_outs: Optional[Dict[str, FanOut]] = None,
+    start_row: int = 0,
 ):
-    for column in table.columns:
-        print(
-            f"Table: {table.full_table_name}, Column: {column.column_name}, Data Type: {column.data_type}"
+    # Foreign keys in deferred_relationships are left empty, see fill_component.
+    # Without commit the table is loaded in the open transaction of the
+    # connection, and so in a single process.
+    # With server_side the rows are generated by the database, see ServerPlan.
+    # fan_outs spreads the rows over the keys of their parents, see FanOut.
+    # The rows are numbered from start_row, see get_top_up.
+    metrics = get_metrics()
+    with metrics.timer(table.full_table_name, "fill"):
+        _fill_table(
+            table,
+            dep_graph,
+            db_connection,
+            key_pool,
+            rng,
+            num_rows,
+            batch_size,
+            commit_per_batch,
+            num_shards,
+            conninfo,
+            seed,
+            journal,
+            deferred_relationships,
+            commit,
+            server_side,
+            fan_outs,
+            start_row,
         )
 
-        for i in range(num_rows):
-            print(
-                f"Inserting Row {i}: {column.column_name} = {column.data_type}")
-
-            sample_values, sample_types = generate_sample_entry_data(
-                table, dep_graph, db_connection
-            )
-
-            # TODO: Do the insert into the table
-
-            # Construct the insert statement
-            insert_column_names = ""
-            insert_column_values = ""
-
-            # Get the column names and values from the sample data
-            for column_name, value in sample_values.items():
-                # Skip if the column is an id column
-
-                insert_column_names += column_name + ", "
-                insert_column_values = _format_append_value(
-                    sample_types, column_name, insert_column_values, value
-                )
-
-            # Remove the trailing comma and space
-            insert_column_names = insert_column_names[:-2]
-            insert_column_values = insert_column_values[:-2]
 
-            if insert_column_names == "":
-                continue
-
-            # Construct the SQL insert statement
-            insert_statement = f"INSERT INTO {table.full_table_name} ( {insert_column_names} ) VALUES ( {insert_column_values} );"
-            print("Insert Statement:", insert_statement)
+def _fill_table(
+    table: TableNode,
+    dep_graph: DepGraph,
+    db_connection: Connection,
+    key_pool: KeyPool,
+    rng: np.random.Generator,
+    num_rows: int,
+    batch_size: int,
+    commit_per_batch: bool,
+    num_shards: int,
+    conninfo: Optional[str],
+    seed: Optional[int],
+    journal: Optional[Journal],
+    deferred_relationships: Sequence[ForeignKeyConstraint],
+    commit: bool,
+    server_side: bool,
+    fan_outs: Optional[Dict[str, FanOut]],
+    start_row: int,
+):
+    if num_rows == 0:
+        logger.info("Skipping table: %s, no rows to add", table.full_table_name)
+        return
+
+    logger.info("Filling table: %s with %d rows", table.full_table_name, num_rows)
+    metrics = get_metrics()
+
+    # A resumed table only gets the rows the previous run did not commit
+    progress = journal.get_progress(table.full_table_name) if journal is not None else None
+    committed_ranges = progress.ranges if progress is not None else []
+    missing_ranges = (
+        progress.get_missing_ranges(start_row, num_rows)
+        if progress is not None
+        else [(start_row, num_rows)]
+    )
+    missing_rows = sum(range_rows for _, range_rows in missing_ranges)
+    metrics.advance_progress(num_rows - missing_rows)
+
+    if not missing_ranges:
+        logger.info("Skipping table: %s, filled by a previous run", table.full_table_name)
+        return
+
+    # Make sure the keys of all the parents are available in memory, unless
+    # the database looks them up itself
+    if not server_side:
+        with metrics.timer(table.full_table_name, "parent_keys"):
+            for relationship in table.parent_relationships:
+                if relationship not in deferred_relationships:
+                    key_pool.ensure_keys(relationship, db_connection)
+
+    # Unique columns keep being numbered from where the first run started
+    if progress is not None:
+        unique_offsets = progress.unique_offsets
+    else:
+        unique_offsets = get_unique_offsets(table, db_connection, start_row)
 
-            # Execute the insert statement
-            cursor = db_connection.cursor()
-            cursor.execute(insert_statement)
+    if journal is not None:
+        journal.start_table(table.full_table_name, unique_offsets, db_connection)
+        if commit:
             db_connection.commit()
 
+    deferred_columns = [
+        child_column
+        for relationship in deferred_relationships
+        if relationship.child_table == table.full_table_name
+        for child_column in relationship.child_columns
+    ]
+    before_commit = (
+        journal.batch_recorder(table.full_table_name, missing_ranges)
+        if journal is not None
+        else None
+    )
+
+    # Unique constraints whose values can collide are checked against the
+    # values already in the table and the ones generated so far
+    unique_filters = None
+    checked_constraints = get_checked_constraints(
+        table, unique_offsets, fan_outs, deferred_columns
+    )
+    if checked_constraints:
+        unique_filters = load_unique_filters(
+            table, checked_constraints, missing_rows, db_connection
+        )
 
-def fill_tables(table_graph: DepGraph, db_connection: Connection):
-
-    # Get the fill order
-    fill_order = table_graph.get_fill_order()
-
-    # Fill the tables in the order specified
-    for table in fill_order:
-        fill_table(table_graph.get_table(table), table_graph, db_connection)
-
-
-def generate_sample_entry_data(
-    table_node: TableNode, dep_graph: DepGraph, db_connection: Connection
-) -> Tuple[Dict[str, Any], Dict[str, str]]:
-    print("Table Name:", table_node.full_table_name)
-    print("Number of parent relationships:",
-          len(table_node._parent_relationships))
-    fake = Faker()
-    dep_values = get_dep_values(table_node, dep_graph, db_connection)
-
-    sample_values = {}
-    sample_types = {}
-
-    for column in table_node.columns:
-        if column.column_name == "id" and column.data_type == "bigserial":
-            continue  # Skip ID generation for bigserial columns
-        elif column.column_name == "id":
-            # Only set UUID for text IDs
-            sample_values["id"] = str(uuid.uuid4())
-            sample_types["id"] = "text"
-
-        if column.column_name in dep_values:
-            sample_values[column.column_name] = dep_values[column.column_name]
-            sample_types[column.column_name] = column.data_type
-
-            print(
-                f"Filling column: {column.column_name} with value: {dep_values[column.column_name]} (dependent column)"
-            )
-            continue
-
-        # if check_if_type_is_enum(column.data_type, db_connection):
-        #     enum_options = get_enum_options(column.data_type, db_connection)
-        #     sample_values[column.column_name] = random.choice(enum_options)
-        #     sample_types[column.column_name] = column.data_type
-
-        #     print(
-        #         f"Filling column: {column.column_name} with value: {sample_values[column.column_name]} (enum)"
-        #     )
-        #     continue
-
-        print(
-            f"Filling column: {column.column_name} with type: {column.data_type}")
-        sample_types[column.column_name] = column.data_type
-
-        if column.data_type == "bigint":
-            sample_values[column.column_name] = random.randint(0, 2**63 - 1)
-            sample_types[column.column_name] = "bigint"
-        elif column.data_type == "integer":
-            sample_values[column.column_name] = random.randint(0, 100)
-        elif column.data_type == "text":
-            if column.column_name == "first_name":
-                sample_values[column.column_name] = fake.first_name()
-            elif column.column_name == "last_name":
-                sample_values[column.column_name] = fake.last_name()
-            elif column.column_name == "email":
-                sample_values[column.column_name] = fake.email()
-            elif column.column_name == "name":
-                sample_values[column.column_name] = fake.word()
-            elif column.column_name == "phone_number":
-                sample_values[column.column_name] = fake.phone_number()
-            elif column.column_name == "id":
-                sample_values[column.column_name] = str(uuid.uuid4())
-            else:
-                sample_values[column.column_name] = fake.sentence()
-        elif column.data_type == "date":
-            sample_values[column.column_name] = fake.date()
-        elif column.data_type == "boolean":
-            sample_values[column.column_name] = bool(random.getrandbits(1))
-        elif column.data_type == "real":
-            sample_values[column.column_name] = random.random()
-        elif column.data_type == "jsonb":
-            sample_values[column.column_name] = '{"key": "value"}'
-        elif (
-            column.data_type == "timestamp"
-            or column.data_type == "timestamp with time zone"
-            or column.data_type == "timestamp without time zone"
-        ):
-            sample_values[column.column_name] = fake.iso8601()
-        elif column.data_type == "USER-DEFINED":
-            # TODO: Handle user defined types
-            print("WARNING: User defined type not handled")
-            user_type = get_user_defined_type(
-                schema_name=table_node.schema_name,
-                table_name=table_node.table_name,
-                column_name=column.column_name,
-                conneciton=db_connection
+    # Generate the rows with INSERT ... SELECT statements, nothing goes
+    # through the client but the columns the database can't generate. The
+    # children of this table read its keys back from the database.
+    if server_side:
+        with metrics.timer(table.full_table_name, "plan"):
+            server_plan = compile_server_plan(
+                table,
+                key_pool,
+                dep_graph.type_registry,
+                unique_offsets,
+                seed=seed,
+                deferred_columns=deferred_columns,
+                fan_outs=fan_outs,
+                unique_filters=unique_filters,
             )
-            print(f"User defined type: {user_type}")
-
-            # Get the enum options
-            enum_options = get_enum_options(user_type, db_connection)
-            sample_values[column.column_name] = random.choice(enum_options)
-        elif column.data_type == "numeric":
-            sample_values[column.column_name] = random.randint(0, 100)
-            sample_types[column.column_name] = "numeric"
-        else:
-            raise ValueError(
-                f"Data type {column.data_type} not supported for column {column.column_name} in table {table_node.full_table_name}")
-
-        print(
-            f"Filling column: {column.column_name} with value: {sample_values[column.column_name]}"
+
+        loaded_rows = insert_ranges(
+            server_plan,
+            db_connection,
+            rng,
+            missing_ranges,
+            batch_size,
+            commit_per_batch=commit_per_batch,
+            before_commit=before_commit,
+            commit=commit,
+        )
+        logger.info("Inserted %d rows into %s", loaded_rows, table.full_table_name)
+        return
+
+    # Large tables are generated and loaded by several processes at once,
+    # unless their values have to be checked against each other
+    if commit and num_shards > 1 and num_rows >= SHARD_MIN_ROWS and not unique_filters:
+        if conninfo is None:
+            raise ValueError("A connection string is needed to fill tables in shards")
+
+        loaded_rows = fill_table_sharded(
+            table,
+            dep_graph.type_registry,
+            db_connection,
+            conninfo,
+            key_pool,
+            rng,
+            num_rows,
+            num_shards,
+            batch_size=batch_size,
+            commit_per_batch=commit_per_batch,
+            unique_offsets=unique_offsets,
+            seed=seed,
+            journal=journal,
+            committed_ranges=committed_ranges,
+            fan_outs=fan_outs,
+            start_row=start_row,
         )
 
-    return sample_values, sample_types
+        # The keys of the shards stay in their processes, children of this
+        # table read them back from the database
+        logger.info("Loaded %d rows into %s", loaded_rows, table.full_table_name)
+        return
+
+    # Resolve the generator of every column once for the whole table
+    # Unique columns are generated from the row index
+    with metrics.timer(table.full_table_name, "plan"):
+        plan = compile_table_plan(
+            table,
+            key_pool,
+            dep_graph.type_registry,
+            unique_offsets,
+            seed=seed,
+            deferred_columns=deferred_columns,
+            fan_outs=fan_outs,
+            unique_filters=unique_filters,
+        )
 
+    referenced_keys = dep_graph.get_referenced_keys(table.full_table_name)
+
+    # Children also reference the rows committed by the previous run, or
+    # those the table already had before a top-up
+    if missing_rows < num_rows or start_row > 0:
+        for column_names in referenced_keys:
+            key_pool.load_keys(table.full_table_name, column_names, db_connection)
+
+    batches = itertools.chain.from_iterable(
+        plan.iter_batches(rng, range_rows, batch_size, start_row)
+        for start_row, range_rows in missing_ranges
+    )
+
+    # Record the keys that the children of this table will reference
+    batches = key_pool.capture_batches(table.full_table_name, referenced_keys, batches)
+    batches = metrics.timed_batches(table.full_table_name, batches)
+
+    # Stream the generated batches into the table using COPY, recording every
+    # batch in the journal as part of its transaction
+    loaded_rows = DatabaseSink(
+        db_connection, commit_per_batch, before_commit, commit
+    ).write_table(table, batches)
+
+    logger.info("Loaded %d rows into %s", loaded_rows, table.full_table_name)
+
+
+def _get_component_relationships(
+    dep_graph: DepGraph, table_names: List[str]
+) -> List[ForeignKeyConstraint]:
+    return [
+        relationship
+        for relationship in dep_graph.get_deferred_relationships()
+        if relationship.child_table in table_names
+    ]
+
+
+def _is_component_filled(
+    table_names: List[str],
+    row_counts: Dict[str, int],
+    start_rows: Dict[str, int],
+    journal: Optional[Journal],
+) -> bool:
+    if journal is None:
+        return False
+
+    for table_name in table_names:
+        progress = journal.get_progress(table_name)
+        if progress is None or progress.get_missing_ranges(
+            start_rows.get(table_name, 0), row_counts[table_name]
+        ):
+            return False
+
+    return True
+
+
+def fill_component(
+    table_names: List[str],
+    dep_graph: DepGraph,
+    db_connection: Connection,
+    key_pool: KeyPool,
+    rngs: Iterable[np.random.Generator],
+    row_counts: Dict[str, int],
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    commit_per_batch: bool = False,
+    num_shards: int = SHARDS_DEFAULT,
+    conninfo: Optional[str] = None,
+    seed: Optional[int] = None,
+    journal: Optional[Journal] = None,
+    fast_load: Optional[FastLoad] = None,
+    server_side: bool = False,
+    scale_spec: Optional[ScaleSpec] = None,
+    start_rows: Optional[Dict[str, int]] = None,
+):
+    # Fills the tables of a component of the graph, with one random stream
+    # and number of rows (see get_row_counts) per table, numbered from its
+    # start row (0 unless topped up, see get_top_up). The tables of a cycle
+    # are loaded in a single transaction with the foreign keys that close the
+    # cycle left empty, which are then set by one UPDATE per foreign key
+    # before the commit.
+    deferred_relationships = _get_component_relationships(dep_graph, table_names)
+    if start_rows is None:
+        start_rows = {}
+
+    # A cycle is committed at once, so it is either filled or not
+    if _is_component_filled(table_names, row_counts, start_rows, journal):
+        get_metrics().advance_progress(sum(row_counts[name] for name in table_names))
+        logger.info("Skipping tables: %s, filled by a previous run", ", ".join(table_names))
+        return
+
+    arguments = (
+        table_names,
+        dep_graph,
+        db_connection,
+        key_pool,
+        rngs,
+        row_counts,
+        batch_size,
+        commit_per_batch,
+        num_shards,
+        conninfo,
+        seed,
+        journal,
+        deferred_relationships,
+        server_side,
+        scale_spec,
+        start_rows,
+    )
+
+    if fast_load is None:
+        _fill_component(*arguments)
+        return
+
+    # The foreign keys that close a cycle are deferred by name
+    with fast_load.suspend(
+        [dep_graph.get_table(table_name) for table_name in table_names],
+        db_connection,
+        [
+            (relationship.child_table, relationship.constraint_name)
+            for relationship in deferred_relationships
+        ],
+    ):
+        _fill_component(*arguments)
+
+
+def _fill_component(
+    table_names: List[str],
+    dep_graph: DepGraph,
+    db_connection: Connection,
+    key_pool: KeyPool,
+    rngs: Iterable[np.random.Generator],
+    row_counts: Dict[str, int],
+    batch_size: int,
+    commit_per_batch: bool,
+    num_shards: int,
+    conninfo: Optional[str],
+    seed: Optional[int],
+    journal: Optional[Journal],
+    deferred_relationships: List[ForeignKeyConstraint],
+    server_side: bool,
+    scale_spec: Optional[ScaleSpec],
+    start_rows: Dict[str, int],
+):
+    if not deferred_relationships:
+        for table_name, rng in zip(table_names, rngs):
+            table = dep_graph.get_table(table_name)
+            fill_table(
+                table,
+                dep_graph,
+                db_connection,
+                key_pool,
+                rng,
+                num_rows=row_counts[table_name],
+                batch_size=batch_size,
+                commit_per_batch=commit_per_batch,
+                num_shards=num_shards,
+                conninfo=conninfo,
+                seed=seed,
+                journal=journal,
+                server_side=server_side,
+                fan_outs=get_fan_outs(table, scale_spec),
+                start_row=start_rows.get(table_name, 0),
+            )
+        return
+
+    logger.info(
+        "Filling tables: %s in one transaction, patching %s afterwards",
+        ", ".join(table_names),
+        ", ".join(relationship.constraint_name for relationship in deferred_relationships),
+    )
+
+    metrics = get_metrics()
+    try:
+        defer_statement = defer_constraints_statement(deferred_relationships)
+        if defer_statement is not None:
+            db_connection.execute(defer_statement)
+
+        for table_name, rng in zip(table_names, rngs):
+            table = dep_graph.get_table(table_name)
+            fill_table(
+                table,
+                dep_graph,
+                db_connection,
+                key_pool,
+                rng,
+                num_rows=row_counts[table_name],
+                batch_size=batch_size,
+                conninfo=conninfo,
+                seed=seed,
+                journal=journal,
+                deferred_relationships=deferred_relationships,
+                commit=False,
+                server_side=server_side,
+                fan_outs=get_fan_outs(table, scale_spec),
+                start_row=start_rows.get(table_name, 0),
+            )
 
-def _format_append_value(
-    sample_types: Dict[str, str], column_name: str, insert_statement: str, value: Any
-) -> str:
-    if value is None and column_name != "id":
-        insert_statement += "NULL, "
-        return insert_statement
+        cursor = db_connection.cursor()
+        for relationship, statement in zip(
+            deferred_relationships, patch_statements(deferred_relationships, seed)
+        ):
+            with metrics.timer(relationship.child_table, "patch"):
+                cursor.execute(statement)
+            metrics.increment(relationship.child_table, "rows_patched", cursor.rowcount)
 
-    if sample_types[column_name] == "bigint" or sample_types[column_name] == "int":
-        insert_statement += f"{value}, "
-    elif (
-        sample_types[column_name] == "text"
-        or sample_types[column_name] == "date"
-        or sample_types[column_name] == "jsonb"
-    ):
-        insert_statement += f"'{value}', "
-    elif sample_types[column_name] == "boolean":
-        insert_statement += f"{value}, "
-    elif sample_types[column_name] == "real":
-        insert_statement += f"{value}, "
-    else:
-        insert_statement += f"'{value}', "
+        # Deferred foreign keys are checked here
+        with metrics.timer(table_names[-1], "load"):
+            db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+
+
+def fill_tables(
+    table_graph: DepGraph,
+    db_connection: Connection,
+    num_rows: int = NUM_ROWS_DEFAULT,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    commit_per_batch: bool = False,
+    num_shards: int = SHARDS_DEFAULT,
+    conninfo: Optional[str] = None,
+    seed: Optional[int] = None,
+    journal: Optional[Journal] = None,
+    fast_load: Optional[FastLoad] = None,
+    server_side: bool = False,
+    scale_spec: Optional[ScaleSpec] = None,
+    key_source: Optional[KeySource] = None,
+    top_up: bool = False,
+    exact_count_max: int = TOP_UP_EXACT_COUNT_MAX,
+):
 
-    return insert_statement
+    # Get the fill order, grouped by cycles
+    components = table_graph.get_components()
 
+    # Number of rows of every table, num_rows unless the scale spec says otherwise
+    row_counts = get_row_counts(table_graph, num_rows, scale_spec)
 
-def get_dep_values(
-    table_node: TableNode, dep_graph: DepGraph, db_connection: Connection
-) -> Dict[str, Any]:
-    dep_values = {}
+    # Only add the rows every table is missing to reach its number of rows
+    start_rows: Dict[str, int] = {}
+    if top_up:
+        row_counts, start_rows = get_top_up(
+            table_graph, row_counts, db_connection, exact_count_max
+        )
 
-    for parent in table_node._parent_relationships:
-        dep_values = {}
-    for parent in table_node._parent_relationships:
-        parent_table_name = parent._parent_table
-        parent_column_name = parent._parent_column
+    # Keys of the filled tables, shared by their children. The keys of large
+    # pre-existing parents are sampled by the key source.
+    key_pool = KeyPool(key_source)
 
-        select_query = f"SELECT {parent_column_name} FROM {parent_table_name} ORDER BY RANDOM() LIMIT 1;"
-        cursor = db_connection.cursor()
-        cursor.execute(select_query)
-        row = cursor.fetchone()
+    rng = np.random.default_rng(seed)
 
-        if row is None:
-            # Fallback for empty parent tables
-            print(f"No rows in {parent_table_name}. Using a default value.")
-            dep_values[parent._child_column] = None
-            continue
+    get_metrics().start_progress(sum(row_counts.values()))
 
-        dep_values[parent._child_column] = row[0]
+    # Fill the tables in the order specified
+    try:
+        for component in components:
+            fill_component(
+                component,
+                table_graph,
+                db_connection,
+                key_pool,
+                itertools.repeat(rng),
+                row_counts,
+                batch_size=batch_size,
+                commit_per_batch=commit_per_batch,
+                num_shards=num_shards,
+                conninfo=conninfo,
+                seed=seed,
+                journal=journal,
+                fast_load=fast_load,
+                server_side=server_side,
+                scale_spec=scale_spec,
+                start_rows=start_rows,
+            )
+    finally:
+        get_metrics().finish_progress()
+
+
+def write_tables(
+    table_graph: DepGraph,
+    sink: Sink,
+    num_rows: int = NUM_ROWS_DEFAULT,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    rng: Optional[np.random.Generator] = None,
+    seed: Optional[int] = None,
+    scale_spec: Optional[ScaleSpec] = None,
+):
+    # Generates every table without a database, e.g. from a schema snapshot.
+    # All the keys come from the generated rows themselves.
+    components = table_graph.get_components()
+    row_counts = get_row_counts(table_graph, num_rows, scale_spec)
+
+    key_pool = KeyPool()
+
+    if rng is None:
+        rng = np.random.default_rng(seed)
+
+    metrics = get_metrics()
+    metrics.start_progress(sum(row_counts.values()))
+
+    try:
+        for component in components:
+            # Cycles are patched by the script, in its transaction
+            deferred_relationships = _get_component_relationships(table_graph, component)
+            defer_statement = defer_constraints_statement(deferred_relationships)
+            if defer_statement is not None:
+                sink.write_statements([defer_statement.as_string(None) + ";"])
+
+            for table_name in component:
+                table = table_graph.get_table(table_name)
+                _write_table(
+                    table,
+                    table_graph,
+                    sink,
+                    key_pool,
+                    rng,
+                    row_counts[table_name],
+                    batch_size,
+                    seed,
+                    deferred_relationships,
+                    get_fan_outs(table, scale_spec),
+                )
 
-    return dep_values
+            if deferred_relationships:
+                sink.write_statements(
+                    [
+                        statement.as_string(None) + ";"
+                        for statement in patch_statements(deferred_relationships, seed)
+                    ]
+                )
+    finally:
+        sink.close()
+        metrics.finish_progress()
+
+
+def _write_table(
+    table: TableNode,
+    table_graph: DepGraph,
+    sink: Sink,
+    key_pool: KeyPool,
+    rng: np.random.Generator,
+    num_rows: int,
+    batch_size: int,
+    seed: Optional[int],
+    deferred_relationships: Sequence[ForeignKeyConstraint],
+    fan_outs: Dict[str, FanOut],
+):
+    logger.info("Writing table: %s with %d rows", table.full_table_name, num_rows)
+    metrics = get_metrics()
+
+    # The tables start out empty, so unique columns are numbered from 0
+    unique_offsets = {column.column_name: 0 for column in get_unique_columns(table)}
+    unique_offsets.update(
+        (relationship.constraint_name, 0) for relationship in get_unique_foreign_keys(table)
+    )
+    deferred_columns = [
+        child_column
+        for relationship in deferred_relationships
+        if relationship.child_table == table.full_table_name
+        for child_column in relationship.child_columns
+    ]
+    unique_filters = create_unique_filters(
+        get_checked_constraints(table, unique_offsets, fan_outs, deferred_columns), num_rows
+    )
+    plan = compile_table_plan(
+        table,
+        key_pool,
+        table_graph.type_registry,
+        unique_offsets,
+        generate_auto_columns=True,
+        seed=seed,
+        deferred_columns=deferred_columns,
+        fan_outs=fan_outs,
+        unique_filters=unique_filters,
+    )
+
+    batches = key_pool.capture_batches(
+        table.full_table_name,
+        table_graph.get_referenced_keys(table.full_table_name),
+        plan.iter_batches(rng, num_rows, batch_size),
+    )
+    batches = metrics.timed_batches(table.full_table_name, batches)
+
+    with metrics.timer(table.full_table_name, "fill"):
+        written_rows = sink.write_table(table, batches)
+    logger.info("Wrote %d rows of %s", written_rows, table.full_table_name)
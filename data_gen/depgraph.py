@@ -1,16 +1,89 @@
+import logging
 import pathlib
-from typing import Dict, List
+import shutil
+import subprocess
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import networkx as nx
-import os
 
 from data_gen.table_node import ForeignKeyConstraint, TableNode
+from data_gen.type_registry import TypeRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def ancestor_closure(graph: nx.DiGraph, table_names: Iterable[str]) -> Set[str]:
+    # The tables and all the tables they reference, directly or not. Works
+    # on any graph of parent -> child edges, e.g. before the tables are read.
+    closure: Set[str] = set()
+    for table_name in table_names:
+        if table_name not in closure:
+            closure.add(table_name)
+            closure.update(nx.ancestors(graph, table_name))
+    return closure
 
 
 class DepGraph(nx.DiGraph):
 
     def __init__(self):
+        # Planned once, and again after the graph changes, through any of the
+        # methods of nx.DiGraph that add or remove nodes and edges
+        self._cycle_plan: Optional[Tuple[List[List[str]], List[ForeignKeyConstraint]]] = None
+        self._fill_order: Optional[List[str]] = None
         super(DepGraph, self).__init__()
         self._tables: Dict[str, TableNode] = {}
+        self._type_registry = TypeRegistry()
+
+    def _invalidate(self):
+        self._cycle_plan = None
+        self._fill_order = None
+
+    def add_node(self, node_for_adding, **attr):
+        self._invalidate()
+        super().add_node(node_for_adding, **attr)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        self._invalidate()
+        super().add_edge(u_of_edge, v_of_edge, **attr)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        self._invalidate()
+        super().add_nodes_from(nodes_for_adding, **attr)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        self._invalidate()
+        super().add_edges_from(ebunch_to_add, **attr)
+
+    def remove_node(self, n):
+        self._invalidate()
+        super().remove_node(n)
+
+    def remove_nodes_from(self, nodes):
+        self._invalidate()
+        super().remove_nodes_from(nodes)
+
+    def remove_edge(self, u, v):
+        self._invalidate()
+        super().remove_edge(u, v)
+
+    def remove_edges_from(self, ebunch):
+        self._invalidate()
+        super().remove_edges_from(ebunch)
+
+    def clear(self):
+        self._invalidate()
+        super().clear()
+
+    def clear_edges(self):
+        self._invalidate()
+        super().clear_edges()
+
+    @property
+    def type_registry(self) -> TypeRegistry:
+        return self._type_registry
+
+    @type_registry.setter
+    def type_registry(self, type_registry: TypeRegistry):
+        self._type_registry = type_registry
 
     def get_all_tables(self) -> List[TableNode]:
         return list(self._tables.values())
@@ -30,8 +103,9 @@ class DepGraph(nx.DiGraph):
         child: TableNode,
         parent: TableNode,
         constraint_name: str,
-        parent_column: str,
-        child_column: str,
+        parent_columns: List[str],
+        child_columns: List[str],
+        is_deferrable: bool = False,
     ):
 
         # Add the foreign key constraint to the parent and child nodes
@@ -39,30 +113,127 @@ class DepGraph(nx.DiGraph):
             ForeignKeyConstraint(
                 constraint_name=constraint_name,
                 parent_table=parent.full_table_name,
-                parent_column=parent_column,
+                parent_columns=parent_columns,
                 child_table=child.full_table_name,
-                child_column=child_column,
+                child_columns=child_columns,
+                is_deferrable=is_deferrable,
             )
         )
 
         # Add to networkx graph
         self.add_edge(parent.full_table_name, child.full_table_name)
 
-    def get_fill_order(self) -> List[str]:
+    def get_referenced_keys(self, table_name: str) -> List[List[str]]:
+        # Keys of the table that the foreign keys of its children point to, as
+        # their columns
+        referenced_keys: List[List[str]] = []
+        for child_table_name in self.successors(table_name):
+            for relationship in self.get_table(child_table_name).parent_relationships:
+                if relationship.parent_table != table_name:
+                    continue
+
+                if relationship.parent_columns not in referenced_keys:
+                    referenced_keys.append(relationship.parent_columns)
+
+        return referenced_keys
 
-        # Check if its a DAG
-        if not nx.is_directed_acyclic_graph(self):
-            raise ValueError("Graph is not a directed acyclic graph")
+    def get_ancestor_closure(self, table_names: Iterable[str]) -> Set[str]:
+        return ancestor_closure(self, table_names)
 
-        # Get the topological sort
-        order = list(nx.topological_sort(self))
+    def subset(self, table_names: Iterable[str]) -> "DepGraph":
+        # Graph of the tables and their ancestors, sharing their table nodes.
+        # Every parent of a kept table is kept, so are its foreign keys.
+        closure = self.get_ancestor_closure(table_names)
 
-        # Since this doesn't include the nodes without any edges, we need to add them
-        for node in self.nodes:
-            if node not in order:
-                order.append(node)
+        dep_graph = DepGraph()
+        dep_graph.type_registry = self._type_registry
+        for table_name in sorted(closure):
+            dep_graph.add_table(self.get_table(table_name))
+        for table_name in sorted(closure):
+            for relationship in self.get_table(table_name).parent_relationships:
+                dep_graph.add_edge(relationship.parent_table, table_name)
 
-        return order
+        return dep_graph
+
+    def _is_nullable_relationship(self, relationship: ForeignKeyConstraint) -> bool:
+        child = self.get_table(relationship.child_table)
+        return all(
+            child.get_column(column_name).is_nullable
+            for column_name in relationship.child_columns
+        )
+
+    def _break_cycle(
+        self, table_names: List[str], relationships: List[ForeignKeyConstraint]
+    ) -> Tuple[List[str], List[ForeignKeyConstraint]]:
+        # Foreign keys of the cycle that are left out while loading, nullable
+        # ones first and deferrable ones only if that is not enough. Returns
+        # the load order of the tables once they are left out.
+        nullable = [r for r in relationships if self._is_nullable_relationship(r)]
+        deferrable = [r for r in relationships if r.is_deferrable and r not in nullable]
+
+        for deferred in (nullable, nullable + deferrable):
+            remaining = nx.DiGraph()
+            remaining.add_nodes_from(table_names)
+            remaining.add_edges_from(
+                (r.parent_table, r.child_table) for r in relationships if r not in deferred
+            )
+            if nx.is_directed_acyclic_graph(remaining):
+                return list(nx.lexicographical_topological_sort(remaining)), deferred
+
+        blocking = [r.constraint_name for r in relationships if r not in deferred]
+        raise ValueError(
+            f"Tables {', '.join(table_names)} reference each other through the NOT NULL foreign keys {', '.join(blocking)}, which are not deferrable"
+        )
+
+    def _plan_cycles(self) -> Tuple[List[List[str]], List[ForeignKeyConstraint]]:
+        if self._cycle_plan is None:
+            self._cycle_plan = self._compute_cycle_plan()
+        return self._cycle_plan
+
+    def _compute_cycle_plan(self) -> Tuple[List[List[str]], List[ForeignKeyConstraint]]:
+        components: List[List[str]] = []
+        deferred: List[ForeignKeyConstraint] = []
+
+        condensed = nx.condensation(self)
+        for component in nx.topological_sort(condensed):
+            members = condensed.nodes[component]["members"]
+            table_names = sorted(members)
+
+            cycle_relationships = [
+                relationship
+                for table_name in table_names
+                for relationship in self.get_table(table_name).parent_relationships
+                if relationship.parent_table in members
+            ]
+            if not cycle_relationships:
+                components.append(table_names)
+                continue
+
+            order, component_deferred = self._break_cycle(table_names, cycle_relationships)
+            components.append(order)
+            deferred += component_deferred
+
+        return components, deferred
+
+    def get_components(self) -> List[List[str]]:
+        # Tables in fill order, grouped by strongly connected component. The
+        # tables of a component reference each other (or themselves) in a
+        # cycle, which is broken by its deferred relationships.
+        return self._plan_cycles()[0]
+
+    def get_deferred_relationships(self) -> List[ForeignKeyConstraint]:
+        # Foreign keys that close a cycle. They are loaded empty and patched
+        # once the whole component is loaded.
+        return self._plan_cycles()[1]
+
+    def get_fill_order(self) -> List[str]:
+        if self._fill_order is None:
+            self._fill_order = [
+                table_name
+                for component in self.get_components()
+                for table_name in component
+            ]
+        return self._fill_order
 
     def print_graph(self):
 
@@ -70,13 +241,36 @@ class DepGraph(nx.DiGraph):
             print(f"{edge[0]} -> {edge[1]}")
             print("\n")
 
-    def draw_graph(self, filename: str = "depgraph") -> None:
-        tt = pathlib.Path("./").joinpath(filename + ".dot")
-        print("output:", str(tt.absolute()))
-        nx.nx_agraph.to_agraph(self).write(str(tt.absolute()))
+    def write_dot(self, path: pathlib.Path):
+        # Written by hand rather than through pygraphviz, which is slow to
+        # import and not always installed
+        with open(path, "w", encoding="utf-8") as dot_file:
+            dot_file.write("digraph {\n")
+            for table_name in self.nodes:
+                dot_file.write(f"  {_dot_quote(table_name)};\n")
+            for parent, child in self.edges:
+                dot_file.write(f"  {_dot_quote(parent)} -> {_dot_quote(child)};\n")
+            dot_file.write("}\n")
 
-        os.system(
-            "dot -Tpdf {} -o {}.pdf".format(
-                str(tt.absolute()), pathlib.Path("./").joinpath(tt.stem)
-            )
+    def draw_graph(self, filename: str = "depgraph") -> Optional[subprocess.Popen]:
+        # Writes the graph as filename.dot and renders it to filename.pdf in
+        # the background, which can take minutes for large graphs. Returns
+        # the dot process, or None when Graphviz is not installed.
+        dot_path = pathlib.Path(filename + ".dot").absolute()
+        logger.info("Writing the dependency graph to %s", dot_path)
+        self.write_dot(dot_path)
+
+        dot_command = shutil.which("dot")
+        if dot_command is None:
+            logger.warning("Graphviz dot not found, not rendering %s", dot_path)
+            return None
+
+        return subprocess.Popen(
+            [dot_command, "-Tpdf", str(dot_path), "-o", str(dot_path.with_suffix(".pdf"))],
+            stdin=subprocess.DEVNULL,
         )
+
+
+def _dot_quote(name: str) -> str:
+    escaped = name.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
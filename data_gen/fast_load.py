@@ -0,0 +1,396 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Collection, Iterator, List, Optional, Tuple
+
+import psycopg
+from psycopg import Connection, sql
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+from data_gen.loader import table_identifier
+from data_gen.metrics import get_metrics
+from data_gen.parameters import FAST_LOAD_MODES, JOURNAL_SCHEMA, REBUILD_WORKERS_DEFAULT
+from data_gen.table_node import TableNode
+
+# Kinds of suspended objects, in the order they are restored: the table has
+# to be logged again before logged tables can reference it, and the indexes
+# are rebuilt before the foreign keys are validated
+PERSISTENCE = "persistence"
+INDEX = "index"
+CONSTRAINT = "constraint"
+TRIGGER = "trigger"
+RESTORE_ORDER = (PERSISTENCE, INDEX, CONSTRAINT, TRIGGER)
+
+# (table name, kind, name, statement restoring the object)
+SuspendedObject = Tuple[str, str, str, str]
+
+# ALTER TABLE ... ENABLE clause of every pg_trigger.tgenabled state
+_TRIGGER_ENABLE_CLAUSES = {
+    "O": "ENABLE TRIGGER",
+    "R": "ENABLE REPLICA TRIGGER",
+    "A": "ENABLE ALWAYS TRIGGER",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def with_replication_role(conninfo: str) -> str:
+    # Sessions in the replica role skip the triggers, including those that
+    # check foreign keys. Every connection of the fill needs it, shards
+    # included, so it is set through the connection string. Only superusers
+    # can use it.
+    options = conninfo_to_dict(conninfo).get("options") or ""
+    return make_conninfo(
+        conninfo, options=f"{options} -c session_replication_role=replica".strip()
+    )
+
+
+def _comment_statement(kind: str, identifier: sql.Composable, comment: Optional[str]):
+    if comment is None:
+        return sql.SQL("")
+
+    return sql.SQL("; COMMENT ON {} {} IS {}").format(
+        sql.SQL(kind), identifier, sql.Literal(comment)
+    )
+
+
+class FastLoad:
+    # Loads every table without its secondary indexes and, in drop mode,
+    # without its foreign keys and user triggers, optionally as an unlogged
+    # table, and puts everything back once the table is filled. Every
+    # suspended object is recorded in the database, in the transaction that
+    # suspends it, along with the statement that restores it, so a fill that
+    # dies before restoring the schema is repaired by the next run.
+
+    def __init__(
+        self,
+        mode: str = "drop",
+        unlogged: bool = False,
+        conninfo: Optional[str] = None,
+        num_workers: int = REBUILD_WORKERS_DEFAULT,
+    ):
+        if mode not in FAST_LOAD_MODES[1:]:
+            raise ValueError(
+                f"Unknown fast load mode {mode}, expected one of {', '.join(FAST_LOAD_MODES[1:])}"
+            )
+        if num_workers < 1:
+            raise ValueError(f"Number of workers must be positive, got {num_workers}")
+
+        self._mode = mode
+        self._unlogged = unlogged
+        self._conninfo = conninfo
+        self._num_workers = num_workers
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def _records_table(self) -> sql.Identifier:
+        return sql.Identifier(JOURNAL_SCHEMA, "fast_load_objects")
+
+    def open(self, db_connection: Connection):
+        # Restores whatever a previous run left suspended
+        cursor = db_connection.cursor()
+        cursor.execute(
+            sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(JOURNAL_SCHEMA))
+        )
+        cursor.execute(
+            sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "table_name text NOT NULL, kind text NOT NULL, name text NOT NULL, "
+                "statement text NOT NULL, PRIMARY KEY (table_name, kind, name))"
+            ).format(self._records_table())
+        )
+        cursor.execute(
+            sql.SQL("SELECT DISTINCT table_name FROM {} ORDER BY table_name").format(
+                self._records_table()
+            )
+        )
+        table_names = [row[0] for row in cursor.fetchall()]
+        db_connection.commit()
+
+        if table_names:
+            logger.warning(
+                "Restoring the indexes, constraints and triggers suspended by a previous run on %s",
+                ", ".join(table_names),
+            )
+            self.restore(table_names, db_connection)
+
+    @contextmanager
+    def suspend(
+        self,
+        tables: List[TableNode],
+        db_connection: Connection,
+        kept_constraints: Collection[Tuple[str, str]] = (),
+    ) -> Iterator[None]:
+        # kept_constraints are (table name, constraint name) pairs of foreign
+        # keys that the load itself relies on
+        table_names = [table.full_table_name for table in tables]
+
+        try:
+            for table in tables:
+                with get_metrics().timer(table.full_table_name, "suspend"):
+                    self._suspend_table(table, db_connection, kept_constraints)
+            db_connection.commit()
+        except Exception:
+            db_connection.rollback()
+            raise
+
+        try:
+            yield
+        except BaseException:
+            try:
+                # The connection may be in a failed transaction
+                db_connection.rollback()
+                self.restore(table_names, db_connection)
+            except Exception as error:
+                logger.error(
+                    "Failed to restore %s, the next run will retry: %s",
+                    ", ".join(table_names),
+                    error,
+                )
+            raise
+
+        self.restore(table_names, db_connection)
+
+    def _suspend_table(
+        self,
+        table: TableNode,
+        db_connection: Connection,
+        kept_constraints: Collection[Tuple[str, str]],
+    ):
+        identifier = table_identifier(table)
+        table_oid = identifier.as_string(db_connection)
+        suspended: List[SuspendedObject] = []
+        cursor = db_connection.cursor()
+
+        # Indexes that no constraint is built on or relies on (e.g. the
+        # unique index a foreign key references), and that are not special
+        # to the table. Indexes of partitioned tables are kept, they span
+        # every partition.
+        cursor.execute(
+            """
+            SELECT i.relname, pg_get_indexdef(x.indexrelid), ts.spcname,
+                obj_description(x.indexrelid, 'pg_class')
+            FROM pg_catalog.pg_index x
+            JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+            LEFT JOIN pg_catalog.pg_tablespace ts ON ts.oid = i.reltablespace
+            WHERE x.indrelid = %s::regclass
+                AND i.relkind = 'i'
+                AND x.indisvalid
+                AND NOT x.indisprimary
+                AND NOT x.indisreplident
+                AND NOT x.indisclustered
+                AND NOT EXISTS (
+                    SELECT 1 FROM pg_catalog.pg_constraint c
+                    WHERE c.conindid = x.indexrelid
+                )
+            ORDER BY i.relname
+            """,
+            (table_oid,),
+        )
+        for index_name, definition, tablespace, comment in cursor.fetchall():
+            index_identifier = sql.Identifier(table.schema_name, index_name)
+            statement = sql.SQL("{}{}{}").format(
+                (
+                    sql.SQL("SET LOCAL default_tablespace = {}; ").format(
+                        sql.Identifier(tablespace)
+                    )
+                    if tablespace is not None
+                    else sql.SQL("")
+                ),
+                sql.SQL(definition),
+                _comment_statement("INDEX", index_identifier, comment),
+            )
+            suspended.append(
+                (table.full_table_name, INDEX, index_name, statement.as_string(db_connection))
+            )
+            cursor.execute(sql.SQL("DROP INDEX {}").format(index_identifier))
+
+        if self._mode == "drop":
+            # Foreign keys are validated in one pass when they are added back
+            cursor.execute(
+                """
+                SELECT c.conname, pg_get_constraintdef(c.oid),
+                    obj_description(c.oid, 'pg_constraint')
+                FROM pg_catalog.pg_constraint c
+                WHERE c.conrelid = %s::regclass
+                    AND c.contype = 'f'
+                    AND c.conparentid = 0
+                ORDER BY c.conname
+                """,
+                (table_oid,),
+            )
+            for constraint_name, definition, comment in cursor.fetchall():
+                if (table.full_table_name, constraint_name) in kept_constraints:
+                    continue
+
+                statement = sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}{}").format(
+                    identifier,
+                    sql.Identifier(constraint_name),
+                    sql.SQL(definition),
+                    _comment_statement(
+                        f"CONSTRAINT {sql.Identifier(constraint_name).as_string(db_connection)} ON",
+                        identifier,
+                        comment,
+                    ),
+                )
+                suspended.append(
+                    (
+                        table.full_table_name,
+                        CONSTRAINT,
+                        constraint_name,
+                        statement.as_string(db_connection),
+                    )
+                )
+                cursor.execute(
+                    sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+                        identifier, sql.Identifier(constraint_name)
+                    )
+                )
+
+            # User triggers are put back in the state they were in
+            cursor.execute(
+                """
+                SELECT t.tgname, t.tgenabled
+                FROM pg_catalog.pg_trigger t
+                WHERE t.tgrelid = %s::regclass
+                    AND NOT t.tgisinternal
+                    AND t.tgparentid = 0
+                    AND t.tgenabled <> 'D'
+                ORDER BY t.tgname
+                """,
+                (table_oid,),
+            )
+            for trigger_name, enabled in cursor.fetchall():
+                statement = sql.SQL("ALTER TABLE {} {} {}").format(
+                    identifier,
+                    sql.SQL(_TRIGGER_ENABLE_CLAUSES[enabled]),
+                    sql.Identifier(trigger_name),
+                )
+                suspended.append(
+                    (
+                        table.full_table_name,
+                        TRIGGER,
+                        trigger_name,
+                        statement.as_string(db_connection),
+                    )
+                )
+                cursor.execute(
+                    sql.SQL("ALTER TABLE {} DISABLE TRIGGER {}").format(
+                        identifier, sql.Identifier(trigger_name)
+                    )
+                )
+
+        if self._unlogged:
+            # Logged and unlogged tables can't reference each other
+            cursor.execute(
+                """
+                SELECT c.relkind = 'r' AND c.relpersistence = 'p' AND NOT EXISTS (
+                    SELECT 1 FROM pg_catalog.pg_constraint f
+                    WHERE f.contype = 'f'
+                        AND (f.conrelid = c.oid OR f.confrelid = c.oid)
+                        AND f.conrelid <> f.confrelid
+                )
+                FROM pg_catalog.pg_class c
+                WHERE c.oid = %s::regclass
+                """,
+                (table_oid,),
+            )
+            if cursor.fetchone()[0]:
+                statement = sql.SQL("ALTER TABLE {} SET LOGGED").format(identifier)
+                suspended.append(
+                    (table.full_table_name, PERSISTENCE, "logged", statement.as_string(db_connection))
+                )
+                cursor.execute(sql.SQL("ALTER TABLE {} SET UNLOGGED").format(identifier))
+            else:
+                logger.info(
+                    "Loading %s logged, it is linked to other tables by foreign keys",
+                    table.full_table_name,
+                )
+
+        cursor.executemany(
+            sql.SQL(
+                "INSERT INTO {} (table_name, kind, name, statement) VALUES (%s, %s, %s, %s)"
+            ).format(self._records_table()),
+            suspended,
+        )
+
+        logger.info(
+            "Suspended %d indexes, constraints and triggers of %s",
+            len(suspended),
+            table.full_table_name,
+        )
+
+    def restore(self, table_names: List[str], db_connection: Connection):
+        # Every object is restored in the transaction that deletes its record
+        cursor = db_connection.cursor()
+        cursor.execute(
+            sql.SQL(
+                "SELECT table_name, kind, name, statement FROM {} "
+                "WHERE table_name = ANY(%s) ORDER BY table_name, name"
+            ).format(self._records_table()),
+            (table_names,),
+        )
+        suspended: List[SuspendedObject] = cursor.fetchall()
+        db_connection.commit()
+
+        for kind in RESTORE_ORDER:
+            objects = [entry for entry in suspended if entry[1] == kind]
+            if not objects:
+                continue
+
+            # Indexes of a table can be built at the same time, adding foreign
+            # keys or changing the table locks it for the others
+            if kind == INDEX and self._conninfo is not None and self._num_workers > 1:
+                with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+                    for _ in executor.map(self._restore_object_separately, objects):
+                        pass
+                continue
+
+            for entry in objects:
+                self._restore_object(entry, db_connection)
+
+        metrics = get_metrics()
+        for table_name in table_names:
+            with metrics.timer(table_name, "analyze"):
+                schema_name, relation_name = table_name.split(".", 1)
+                cursor.execute(
+                    sql.SQL("ANALYZE {}").format(sql.Identifier(schema_name, relation_name))
+                )
+                db_connection.commit()
+
+    def _restore_object_separately(self, entry: SuspendedObject):
+        with psycopg.connect(self._conninfo) as db_connection:
+            self._restore_object(entry, db_connection)
+
+    def _restore_object(self, entry: SuspendedObject, db_connection: Connection):
+        table_name, kind, name, statement = entry
+        logger.info("Restoring %s %s of %s", kind, name, table_name)
+
+        try:
+            with get_metrics().timer(table_name, "rebuild"):
+                cursor = db_connection.cursor()
+                cursor.execute(statement)
+                cursor.execute(
+                    sql.SQL(
+                        "DELETE FROM {} WHERE table_name = %s AND kind = %s AND name = %s"
+                    ).format(self._records_table()),
+                    (table_name, kind, name),
+                )
+                db_connection.commit()
+        except Exception:
+            db_connection.rollback()
+            raise
+
+
+def create_fast_load(
+    mode: str,
+    unlogged: bool = False,
+    conninfo: Optional[str] = None,
+    num_workers: int = REBUILD_WORKERS_DEFAULT,
+) -> Optional[FastLoad]:
+    if mode == "none":
+        return None
+
+    return FastLoad(mode, unlogged, conninfo, num_workers)
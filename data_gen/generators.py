@@ -0,0 +1,141 @@
+from typing import Callable, Sequence
+
+import numpy as np
+
+from data_gen.parameters import DATE_RANGE_END
+from data_gen.value_pools import sample_pool
+
+_EPOCH_DATE = np.datetime64("1970-01-01", "D")
+_EPOCH_TIMESTAMP = np.datetime64("1970-01-01T00:00:00", "us")
+
+# Fixed upper bounds, so that the same seed gives the same dates on any day
+_MAX_DATE = np.datetime64(DATE_RANGE_END, "D")
+_MAX_TIMESTAMP = np.datetime64(DATE_RANGE_END, "us")
+
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# Character positions of the hex digits in the canonical UUID representation
+_UUID_GROUPS = ((0, 8, 0), (9, 13, 8), (14, 18, 12), (19, 23, 16), (24, 36, 20))
+
+
+def generate_bigints(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return rng.integers(0, 2**63 - 1, size=num_rows, dtype=np.int64)
+
+
+def generate_integers(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return rng.integers(0, 100, size=num_rows, endpoint=True, dtype=np.int32)
+
+
+def generate_numerics(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return rng.integers(0, 100, size=num_rows, endpoint=True, dtype=np.int64)
+
+
+def generate_reals(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return rng.random(size=num_rows)
+
+
+def generate_booleans(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return rng.integers(0, 2, size=num_rows, dtype=np.int8).astype(bool)
+
+
+def generate_dates(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    # Dates between the epoch and the end of the date range
+    max_days = int((_MAX_DATE - _EPOCH_DATE).astype(np.int64))
+    days = rng.integers(0, max_days, size=num_rows, endpoint=True)
+    return _EPOCH_DATE + days
+
+
+def generate_timestamps(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    # Timestamps between the epoch and the end of the date range
+    max_microseconds = int((_MAX_TIMESTAMP - _EPOCH_TIMESTAMP).astype(np.int64))
+    microseconds = rng.integers(0, max_microseconds, size=num_rows, endpoint=True)
+    return _EPOCH_TIMESTAMP + microseconds
+
+
+def generate_uuids(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    # Random (version 4) UUIDs, formatted without a Python level loop
+    raw = rng.integers(0, 256, size=(num_rows, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+    hex_digits = np.empty((num_rows, 32), dtype=np.uint8)
+    hex_digits[:, 0::2] = _HEX_DIGITS[raw >> 4]
+    hex_digits[:, 1::2] = _HEX_DIGITS[raw & 0x0F]
+
+    formatted = np.full((num_rows, 36), ord("-"), dtype=np.uint8)
+    for start, end, offset in _UUID_GROUPS:
+        formatted[:, start:end] = hex_digits[:, offset : offset + end - start]
+
+    return formatted.view("S36").ravel().astype(str)
+
+
+def generate_jsonb(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return np.full(num_rows, '{"key": "value"}', dtype=object)
+
+
+def generate_nulls(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    return np.full(num_rows, None, dtype=object)
+
+
+def truncate_text(values: np.ndarray, max_length: int) -> np.ndarray:
+    # Casting to a fixed width string type cuts every value at once
+    return values.astype(f"<U{max_length}")
+
+
+def choose_values(
+    rng: np.random.Generator, values: Sequence, num_rows: int, distinct: bool = False
+) -> np.ndarray:
+    if len(values) == 0:
+        return generate_nulls(rng, num_rows)
+
+    pool = np.asarray(values, dtype=object)
+
+    # When distinct values are asked for, use every value at most once while
+    # there are enough of them
+    replace = not distinct or num_rows > len(pool)
+    indices = rng.choice(len(pool), size=num_rows, replace=replace)
+    return pool[indices]
+
+
+def text_pool_generator(
+    provider: str,
+) -> Callable[[np.random.Generator, int], np.ndarray]:
+    # Faker only runs once per process to build the pool of the provider, the
+    # cells are filled by sampling indices into the pool
+    def generate(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+        return sample_pool(provider, rng, num_rows)
+
+    generate.__name__ = f"generate_{provider}"
+    return generate
+
+
+TEXT_GENERATORS = {
+    "first_name": text_pool_generator("first_name"),
+    "last_name": text_pool_generator("last_name"),
+    "email": text_pool_generator("email"),
+    "name": text_pool_generator("word"),
+    "phone_number": text_pool_generator("phone_number"),
+    "id": generate_uuids,
+}
+
+DEFAULT_TEXT_GENERATOR = text_pool_generator("sentence")
+
+# Data types that are filled by the text generators
+TEXT_TYPES = ("text", "character varying", "character")
+
+TYPE_GENERATORS = {
+    "bigint": generate_bigints,
+    "integer": generate_integers,
+    "smallint": generate_integers,
+    "numeric": generate_numerics,
+    "real": generate_reals,
+    "double precision": generate_reals,
+    "boolean": generate_booleans,
+    "date": generate_dates,
+    "timestamp": generate_timestamps,
+    "timestamp with time zone": generate_timestamps,
+    "timestamp without time zone": generate_timestamps,
+    "uuid": generate_uuids,
+    "json": generate_jsonb,
+    "jsonb": generate_jsonb,
+}
@@ -1,34 +1,161 @@
-from typing import Any, Dict
+import logging
+from typing import Dict, List, Optional, Tuple
 
+import networkx as nx
 from psycopg import Connection
 
-from data_gen.depgraph import DepGraph
-from data_gen.table_node import TableNode
+from data_gen.depgraph import DepGraph, ancestor_closure
+from data_gen.metrics import CATALOG_SCOPE, get_metrics
+from data_gen.parameters import JOURNAL_SCHEMA
+from data_gen.subset import TableFilter
+from data_gen.table_node import CheckConstraint, TableNode, UniqueConstraint
+from data_gen.type_registry import load_type_registry
 
+# Schemas that never hold user tables, including the journal of resumable fills
+SYSTEM_SCHEMA_FILTER = f"""
+    n.nspname NOT IN ('pg_catalog', 'information_schema', '{JOURNAL_SCHEMA}')
+    AND n.nspname NOT LIKE 'pg\\_toast%'
+    AND n.nspname NOT LIKE 'pg\\_temp\\_%'
+"""
 
-def generate_dependency_graph(dep_graph: DepGraph, db_connection: Connection):
-    # Query to retrieve schema information
-    query = """
-        SELECT table_schema, table_name, column_name, data_type
-        FROM information_schema.columns
-        WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
-        ORDER BY table_schema, table_name;
+logger = logging.getLogger(__name__)
+
+
+def generate_dependency_graph(
+    dep_graph: DepGraph,
+    db_connection: Connection,
+    table_filter: Optional[TableFilter] = None,
+):
+    # Only the tables selected by the filter and their ancestors are read
+    with get_metrics().timer(CATALOG_SCOPE, "introspection"):
+        _generate_dependency_graph(dep_graph, db_connection, table_filter)
+
+    logger.info("Introspected %d tables", len(dep_graph.get_all_tables()))
+
+
+def _select_tables(db_connection: Connection, table_filter: TableFilter) -> List[int]:
+    # Oids of the selected tables and of the tables they reference, from the
+    # names and foreign keys alone so that the rest of the catalog is only
+    # read for them
+    cursor = db_connection.cursor()
+    cursor.execute(
+        f"""
+        SELECT c.oid, n.nspname || '.' || c.relname
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind IN ('r', 'p')
+            AND NOT c.relispartition
+            AND {SYSTEM_SCHEMA_FILTER};
+    """
+    )
+    table_oids: Dict[str, int] = {table_name: oid for oid, table_name in cursor.fetchall()}
+    table_names = {oid: table_name for table_name, oid in table_oids.items()}
+
+    cursor.execute(
+        "SELECT confrelid, conrelid FROM pg_catalog.pg_constraint WHERE contype = 'f';"
+    )
+    graph = nx.DiGraph()
+    graph.add_nodes_from(table_oids)
+    graph.add_edges_from(
+        (table_names[parent_oid], table_names[child_oid])
+        for parent_oid, child_oid in cursor.fetchall()
+        if parent_oid in table_names and child_oid in table_names
+    )
+    get_metrics().increment(CATALOG_SCOPE, "catalog_queries", 2)
+
+    selected = table_filter.select(sorted(table_oids))
+    if not selected:
+        logger.warning(
+            "No table matches --include %s --exclude %s",
+            " ".join(table_filter.include) or "*",
+            " ".join(table_filter.exclude) or "-",
+        )
+
+    closure = ancestor_closure(graph, selected)
+    logger.info(
+        "Selected %d of %d tables, plus %d referenced by them",
+        len(selected),
+        len(table_oids),
+        len(closure) - len(selected),
+    )
+    return sorted(table_oids[table_name] for table_name in closure)
+
+
+def _generate_dependency_graph(
+    dep_graph: DepGraph, db_connection: Connection, table_filter: Optional[TableFilter]
+):
+    # Types, enums and domains are read once and shared by all the columns
+    type_registry = load_type_registry(db_connection)
+    dep_graph.type_registry = type_registry
+
+    # Restrict the catalog queries to the selected tables. The oids are
+    # inlined since the queries are not parameterized (see the LIKE patterns).
+    table_condition = "TRUE"
+    if table_filter is not None and not table_filter.is_empty:
+        table_oids = _select_tables(db_connection, table_filter)
+        table_condition = "c.oid = ANY('{{{}}}'::oid[])".format(",".join(map(str, table_oids)))
+
+    # Query to retrieve the columns of all the tables. Partitions are filled
+    # through their partitioned table.
+    query = f"""
+        SELECT
+            n.nspname, c.relname, a.attnum, a.attname, a.atttypid, a.attnotnull,
+            CASE
+                WHEN t.typtype = 'd'
+                    AND t.typbasetype IN ('bpchar'::regtype, 'varchar'::regtype)
+                    AND t.typtypmod > 0
+                THEN t.typtypmod - 4
+                WHEN a.atttypid IN ('bpchar'::regtype, 'varchar'::regtype)
+                    AND a.atttypmod > 0
+                THEN a.atttypmod - 4
+            END,
+            pg_get_expr(d.adbin, d.adrelid), a.attidentity, a.attgenerated
+        FROM pg_catalog.pg_attribute a
+        JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_catalog.pg_type t ON t.oid = a.atttypid
+        LEFT JOIN pg_catalog.pg_attrdef d
+            ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE c.relkind IN ('r', 'p')
+            AND NOT c.relispartition
+            AND a.attnum > 0
+            AND NOT a.attisdropped
+            AND {SYSTEM_SCHEMA_FILTER}
+            AND {table_condition}
+        ORDER BY n.nspname, c.relname, a.attnum;
     """
     cursor = db_connection.cursor()
     cursor.execute(query)
 
-    # Iterate over the rows and print table names, column names and their types
-    print("Tables and Columns:")
+    get_metrics().increment(CATALOG_SCOPE, "catalog_queries")
+
     rows = cursor.fetchall()
-    print(f"Total Number of table rows: {len(rows)}")
+    logger.debug("Total number of columns: %d", len(rows))
 
     table_objects_memo: Dict[str, TableNode] = (
         {}
     )  # Store them here first before adding into dep graph
 
+    # (full table name, attnum) -> column name, to resolve constraint keys
+    column_names_memo: Dict[Tuple[str, int], str] = {}
+
     for row in rows:
-        schema, table, column, data_type = row
-        print(f"{schema}.{table}.{column}: {data_type}")
+        (
+            schema,
+            table,
+            attnum,
+            column,
+            type_oid,
+            not_null,
+            max_length,
+            default,
+            identity,
+            generated,
+        ) = row
+
+        sql_type = type_registry.get_type(type_oid)
+        data_type = type_registry.get_data_type(sql_type)
+        logger.debug("%s.%s.%s: %s", schema, table, column, data_type)
 
         # Create the full table name (use this only for any logic)
         full_table_name = f"{schema}.{table}"
@@ -43,60 +170,107 @@ def generate_dependency_graph(dep_graph: DepGraph, db_connection: Connection):
             table_objects_memo[full_table_name] = table_object
 
         # Add the column to the TableNode corresponding to the table
-        table_object.add_column(column_name=column, data_type=data_type)
+        table_object.add_column(
+            column_name=column,
+            data_type=data_type,
+            is_nullable=not (not_null or sql_type.not_null),
+            udt_name=sql_type.type_name,
+            sql_type=sql_type,
+            default=default,
+            identity=identity,
+            generated=generated,
+            max_length=max_length,
+        )
+        column_names_memo[(full_table_name, attnum)] = column
 
     # Store the table object in the memo onto the dep graph
     for _, table_object in table_objects_memo.items():
         dep_graph.add_table(table_object)
 
-    # Query to retrieve foreign key information
-    query = """
+    # Query to retrieve all the primary key, unique, check and foreign key
+    # constraints. Keys are kept as attnum arrays so that composite keys stay
+    # a single constraint.
+    query = f"""
         SELECT
-            tc.table_schema, tc.table_name, kcu.column_name, tc.constraint_name,
-            ccu.table_schema AS foreign_table_schema,
-            ccu.table_name AS foreign_table_name,
-            ccu.column_name AS foreign_column_name
-        FROM
-            information_schema.table_constraints AS tc
-            JOIN information_schema.key_column_usage AS kcu
-                ON tc.constraint_name = kcu.constraint_name
-            JOIN information_schema.constraint_column_usage AS ccu
-                ON ccu.constraint_name = tc.constraint_name
-        WHERE tc.constraint_type = 'FOREIGN KEY';    
+            con.conname, con.contype, n.nspname, c.relname, con.conkey,
+            fn.nspname, fc.relname, con.confkey, con.condeferrable,
+            pg_get_constraintdef(con.oid)
+        FROM pg_catalog.pg_constraint con
+        JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_catalog.pg_class fc ON fc.oid = con.confrelid
+        LEFT JOIN pg_catalog.pg_namespace fn ON fn.oid = fc.relnamespace
+        WHERE con.contype IN ('p', 'u', 'c', 'f')
+            AND {SYSTEM_SCHEMA_FILTER}
+            AND {table_condition}
+        ORDER BY n.nspname, c.relname, con.conname;
     """
     cursor.execute(query)
-
-    # Iterate over the rows and print foreign key information
-    print("\nForeign Keys:")
+    get_metrics().increment(CATALOG_SCOPE, "catalog_queries")
     for row in cursor.fetchall():
         (
+            constraint_name,
+            constraint_type,
             schema,
             table,
-            column,
-            constraint_name,
+            column_numbers,
             foreign_schema,
             foreign_table,
-            foreign_column,
+            foreign_column_numbers,
+            is_deferrable,
+            definition,
         ) = row
-        print(
-            f"{constraint_name} : {schema}.{table}.{column} -> {foreign_schema}.{foreign_table}.{foreign_column}"
-        )
 
         # Create the full table name (current)
         current_table_name = f"{schema}.{table}"
+
+        # Constraints of partitions are also declared on their partitioned table
+        if current_table_name not in table_objects_memo:
+            continue
+
         current_table_object = dep_graph.get_table(current_table_name)
 
+        logger.debug("%s : %s %s", constraint_name, current_table_name, definition)
+
+        if constraint_type == "c":
+            current_table_object.add_check_constraint(
+                CheckConstraint(constraint_name=constraint_name, definition=definition)
+            )
+            continue
+
+        columns = [
+            column_names_memo[(current_table_name, column_number)]
+            for column_number in column_numbers
+        ]
+
+        if constraint_type in ("p", "u"):
+            current_table_object.add_unique_constraint(
+                UniqueConstraint(
+                    constraint_name=constraint_name,
+                    column_names=columns,
+                    is_primary_key=constraint_type == "p",
+                )
+            )
+            continue
+
         # Create the full table name (foreign) and retrieve the TableNode
         foreign_table_name = f"{foreign_schema}.{foreign_table}"
+        if foreign_table_name not in table_objects_memo:
+            continue
 
         foreign_table_object = dep_graph.get_table(foreign_table_name)
 
-        # Add the foreign table as a child of the table
-        # table_nodes[foreign_table_name].add_child(table_nodes[current_table_name], constraint_name, foreign_column, column)
+        foreign_columns = [
+            column_names_memo[(foreign_table_name, column_number)]
+            for column_number in foreign_column_numbers
+        ]
+
+        # Add the foreign table as a parent of the table
         dep_graph.add_child(
             child=current_table_object,
             parent=foreign_table_object,
             constraint_name=constraint_name,
-            parent_column=foreign_column,
-            child_column=column,
+            parent_columns=foreign_columns,
+            child_columns=columns,
+            is_deferrable=is_deferrable,
         )
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import pathlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from psycopg import Connection, sql
+from psycopg.types.json import Jsonb
+
+from data_gen.parameters import JOURNAL_FILE_DEFAULT, JOURNAL_KINDS, JOURNAL_SCHEMA
+
+# (first row index, number of rows)
+RowRange = Tuple[int, int]
+
+logger = logging.getLogger(__name__)
+
+
+def subtract_ranges(start_row: int, num_rows: int, ranges: List[RowRange]) -> List[RowRange]:
+    # Parts of [start_row, start_row + num_rows) not covered by any of ranges
+    missing: List[RowRange] = []
+    position = start_row
+    end_row = start_row + num_rows
+
+    for range_start, range_rows in sorted(ranges):
+        range_end = range_start + range_rows
+        if range_end <= position or range_rows <= 0:
+            continue
+        if range_start >= end_row:
+            break
+        if range_start > position:
+            missing.append((position, range_start - position))
+        position = max(position, range_end)
+
+    if position < end_row:
+        missing.append((position, end_row - position))
+
+    return missing
+
+
+class TableProgress:
+    # What previous runs committed for a table: the offsets its unique columns
+    # were numbered from, and the ranges of rows that are in the database
+
+    def __init__(self, unique_offsets: Dict[str, int], ranges: List[RowRange]):
+        self._unique_offsets = unique_offsets
+        self._ranges = ranges
+
+    @property
+    def unique_offsets(self) -> Dict[str, int]:
+        return self._unique_offsets
+
+    @property
+    def ranges(self) -> List[RowRange]:
+        return self._ranges
+
+    def get_missing_ranges(self, start_row: int, num_rows: int) -> List[RowRange]:
+        return subtract_ranges(start_row, num_rows, self._ranges)
+
+
+class BatchRecorder:
+    # Records the batches of a list of row ranges as they are loaded. The
+    # batches never straddle two ranges, so the ranges are filled in order.
+
+    def __init__(self, journal: "Journal", table_name: str, ranges: List[RowRange]):
+        self._journal = journal
+        self._table_name = table_name
+        self._ranges = ranges
+        self._range_index = 0
+        self._done_rows = 0
+
+    def __call__(self, db_connection: Connection, num_rows: int):
+        while self._done_rows >= self._ranges[self._range_index][1]:
+            self._range_index += 1
+            self._done_rows = 0
+
+        self._done_rows += num_rows
+        self._journal.record_range(
+            self._table_name,
+            self._ranges[self._range_index][0],
+            self._done_rows,
+            db_connection,
+        )
+
+
+class Journal(ABC):
+    # Progress of a fill, so that an interrupted run can be resumed. Every
+    # batch is recorded before its transaction commits.
+
+    def __init__(self):
+        self._progress: Dict[str, TableProgress] = {}
+
+    @abstractmethod
+    def open(self, db_connection: Connection, resume: bool):
+        # Resuming reads the progress of the previous run, otherwise it is
+        # cleared
+        ...
+
+    def get_progress(self, table_name: str) -> Optional[TableProgress]:
+        return self._progress.get(table_name)
+
+    @abstractmethod
+    def start_table(
+        self, table_name: str, unique_offsets: Dict[str, int], db_connection: Connection
+    ):
+        ...
+
+    @abstractmethod
+    def record_range(
+        self, table_name: str, start_row: int, num_rows: int, db_connection: Connection
+    ):
+        ...
+
+    def batch_recorder(self, table_name: str, ranges: List[RowRange]) -> BatchRecorder:
+        return BatchRecorder(self, table_name, ranges)
+
+    def _set_progress(
+        self,
+        unique_offsets: Dict[str, Dict[str, int]],
+        ranges: Dict[Tuple[str, int], int],
+    ):
+        self._progress = {}
+        for table_name, offsets in unique_offsets.items():
+            self._progress[table_name] = TableProgress(offsets, [])
+        for (table_name, start_row), num_rows in sorted(ranges.items()):
+            if table_name in self._progress:
+                self._progress[table_name].ranges.append((start_row, num_rows))
+
+
+class DatabaseJournal(Journal):
+    # Journal kept in the target database, written in the same transaction
+    # as the rows it records
+
+    def _table(self, name: str) -> sql.Identifier:
+        return sql.Identifier(JOURNAL_SCHEMA, name)
+
+    def open(self, db_connection: Connection, resume: bool):
+        cursor = db_connection.cursor()
+        cursor.execute(
+            sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(JOURNAL_SCHEMA))
+        )
+        cursor.execute(
+            sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "table_name text PRIMARY KEY, unique_offsets jsonb NOT NULL)"
+            ).format(self._table("journal_tables"))
+        )
+        cursor.execute(
+            sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} ("
+                "table_name text NOT NULL, start_row bigint NOT NULL, "
+                "num_rows bigint NOT NULL, PRIMARY KEY (table_name, start_row))"
+            ).format(self._table("journal_ranges"))
+        )
+
+        if not resume:
+            cursor.execute(
+                sql.SQL("TRUNCATE {}, {}").format(
+                    self._table("journal_tables"), self._table("journal_ranges")
+                )
+            )
+            db_connection.commit()
+            return
+
+        cursor.execute(
+            sql.SQL("SELECT table_name, unique_offsets FROM {}").format(
+                self._table("journal_tables")
+            )
+        )
+        unique_offsets = {row[0]: row[1] for row in cursor.fetchall()}
+
+        cursor.execute(
+            sql.SQL("SELECT table_name, start_row, num_rows FROM {}").format(
+                self._table("journal_ranges")
+            )
+        )
+        ranges = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+        db_connection.commit()
+
+        self._set_progress(unique_offsets, ranges)
+
+    def start_table(
+        self, table_name: str, unique_offsets: Dict[str, int], db_connection: Connection
+    ):
+        db_connection.execute(
+            sql.SQL(
+                "INSERT INTO {} (table_name, unique_offsets) VALUES (%s, %s) "
+                "ON CONFLICT (table_name) DO NOTHING"
+            ).format(self._table("journal_tables")),
+            (table_name, Jsonb(unique_offsets)),
+        )
+
+    def record_range(
+        self, table_name: str, start_row: int, num_rows: int, db_connection: Connection
+    ):
+        db_connection.execute(
+            sql.SQL(
+                "INSERT INTO {} (table_name, start_row, num_rows) VALUES (%s, %s, %s) "
+                "ON CONFLICT (table_name, start_row) "
+                "DO UPDATE SET num_rows = EXCLUDED.num_rows"
+            ).format(self._table("journal_ranges")),
+            (table_name, start_row, num_rows),
+        )
+
+
+class FileJournal(Journal):
+    # Journal kept in a local file. A file can't be part of a transaction, so
+    # every range is written with the id of the transaction that loads it,
+    # and only counts once that transaction is known to have committed.
+
+    def __init__(self, path: pathlib.Path = pathlib.Path(JOURNAL_FILE_DEFAULT)):
+        super().__init__()
+        self._path = path
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    def _append(self, entry: Dict):
+        # A single write of a whole line, which concurrent writers (threads or
+        # shard processes) can't interleave
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def open(self, db_connection: Connection, resume: bool):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        if not resume or not self._path.exists():
+            self._path.write_bytes(b"")
+            return
+
+        unique_offsets: Dict[str, Dict[str, int]] = {}
+        pending_ranges: List[Tuple[str, int, int, int]] = []
+        with open(self._path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                # The last line may be cut short by a crash
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Ignoring a truncated line of the journal %s", self._path)
+                    continue
+
+                if "unique_offsets" in entry:
+                    unique_offsets.setdefault(entry["table"], entry["unique_offsets"])
+                else:
+                    pending_ranges.append(
+                        (entry["table"], entry["start_row"], entry["num_rows"], entry["xid"])
+                    )
+
+        # Transactions too old for their status to be known have committed
+        # long ago, the status of aborted ones is kept for much longer
+        cursor = db_connection.cursor()
+        cursor.execute(
+            "SELECT xid, txid_status(xid) FROM unnest(%s::bigint[]) AS xid",
+            (sorted({xid for _, _, _, xid in pending_ranges}),),
+        )
+        committed_xids = {
+            xid for xid, status in cursor.fetchall() if status in ("committed", None)
+        }
+        db_connection.commit()
+
+        ranges: Dict[Tuple[str, int], int] = {}
+        for table_name, start_row, num_rows, xid in pending_ranges:
+            if xid in committed_xids:
+                key = (table_name, start_row)
+                ranges[key] = max(ranges.get(key, 0), num_rows)
+
+        self._set_progress(unique_offsets, ranges)
+
+    def start_table(
+        self, table_name: str, unique_offsets: Dict[str, int], db_connection: Connection
+    ):
+        self._append({"table": table_name, "unique_offsets": unique_offsets})
+
+    def record_range(
+        self, table_name: str, start_row: int, num_rows: int, db_connection: Connection
+    ):
+        cursor = db_connection.cursor()
+        cursor.execute("SELECT txid_current()")
+        xid = cursor.fetchone()[0]
+
+        self._append(
+            {"table": table_name, "start_row": start_row, "num_rows": num_rows, "xid": xid}
+        )
+
+
+def create_journal(kind: str, path: Optional[pathlib.Path] = None) -> Optional[Journal]:
+    if kind == "none":
+        return None
+    if kind == "table":
+        return DatabaseJournal()
+    if kind == "file":
+        return FileJournal(path if path is not None else pathlib.Path(JOURNAL_FILE_DEFAULT))
+
+    raise ValueError(f"Unknown journal {kind}, expected one of {', '.join(JOURNAL_KINDS)}")
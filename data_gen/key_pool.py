@@ -0,0 +1,495 @@
+import threading
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from psycopg import AsyncConnection, Connection, sql
+
+from data_gen.key_source import (
+    KeyRow,
+    KeySource,
+    row_estimate_query,
+    sample_keys,
+    sample_keys_async,
+)
+from data_gen.metrics import get_metrics
+from data_gen.parameters import KEY_RANGE_MIN_DENSITY, KEY_SAMPLE_REFRESH_DRAWS
+from data_gen.scale import FanOut
+from data_gen.table_node import ForeignKeyConstraint
+
+_BIGINT_MIN = -(2**63)
+_BIGINT_MAX = 2**63 - 1
+
+
+class KeyRange:
+    # Consecutive integer keys, e.g. of a serial column, kept as their bounds
+    # so they take no memory however many there are
+
+    def __init__(self, first: int, num_keys: int):
+        self._first = first
+        self._num_keys = num_keys
+
+    @property
+    def first(self) -> int:
+        return self._first
+
+    def __len__(self) -> int:
+        return self._num_keys
+
+    def extend(self, num_keys: int):
+        self._num_keys += num_keys
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        return self._first + indices.astype(np.int64)
+
+    def to_array(self) -> array:
+        return array("q", range(self._first, self._first + self._num_keys))
+
+
+class CompositeKeys:
+    # Keys of several columns, one list per column, the values of a key being
+    # at the same index of every list. NULLs are left out as a whole key.
+
+    def __init__(self, num_columns: int):
+        self._columns: List[List[Any]] = [[] for _ in range(num_columns)]
+        self._arrays: Optional[List[np.ndarray]] = None
+
+    @property
+    def num_columns(self) -> int:
+        return len(self._columns)
+
+    def __len__(self) -> int:
+        return len(self._columns[0])
+
+    def add_rows(self, columns: Sequence[np.ndarray]):
+        valid = np.ones(len(columns[0]), dtype=bool)
+        for values in columns:
+            if values.dtype == object:
+                valid &= np.array([value is not None for value in values.tolist()], dtype=bool)
+
+        for keys, values in zip(self._columns, columns):
+            keys.extend(values[valid].tolist())
+        self._arrays = None
+
+    def take(self, indices: np.ndarray, position: int) -> np.ndarray:
+        # The lists are turned into arrays once they stop growing
+        if self._arrays is None:
+            self._arrays = [np.asarray(keys + [None], dtype=object)[:-1] for keys in self._columns]
+        return self._arrays[position][indices]
+
+
+KeyArray = Union[array, List[Any], np.ndarray, KeyRange, CompositeKeys]
+
+
+def get_key_name(column_names: Sequence[str]) -> str:
+    # Name of the pool entry of a key: its column, or all its columns
+    # together for a composite key, so that they are picked as whole tuples
+    if len(column_names) == 1:
+        return column_names[0]
+    return "(" + ", ".join(column_names) + ")"
+
+
+def _select_keys_query(table_name: str, column_names: Sequence[str]) -> sql.Composed:
+    schema_name, relation_name = table_name.split(".", 1)
+    columns = sql.SQL(", ").join(sql.Identifier(name) for name in column_names)
+
+    if len(column_names) == 1:
+        return sql.SQL("SELECT {0} FROM {1} ORDER BY {0}").format(
+            columns, sql.Identifier(schema_name, relation_name)
+        )
+
+    return sql.SQL("SELECT {0} FROM {1} WHERE {2} ORDER BY {0}").format(
+        columns,
+        sql.Identifier(schema_name, relation_name),
+        sql.SQL(" AND ").join(
+            sql.SQL("{} IS NOT NULL").format(sql.Identifier(name)) for name in column_names
+        ),
+    )
+
+
+def _key_bounds_query(table_name: str, column_name: str) -> sql.Composed:
+    # Read from the ends of the index of the key
+    schema_name, relation_name = table_name.split(".", 1)
+    return sql.SQL("SELECT min({0}), max({0}) FROM {1}").format(
+        sql.Identifier(column_name), sql.Identifier(schema_name, relation_name)
+    )
+
+
+def _key_count_query(table_name: str, column_name: str) -> sql.Composed:
+    schema_name, relation_name = table_name.split(".", 1)
+    return sql.SQL("SELECT count({0}) FROM {1}").format(
+        sql.Identifier(column_name), sql.Identifier(schema_name, relation_name)
+    )
+
+
+def _may_be_key_range(minimum: Any, maximum: Any, estimated_rows: Optional[float]) -> bool:
+    # Integer bounds, and unless the table was never analyzed, about as many
+    # rows as values between them. Only then are the keys counted, which
+    # reads the whole table.
+    return (
+        isinstance(minimum, int)
+        and not isinstance(minimum, bool)
+        and _BIGINT_MIN <= minimum <= maximum <= _BIGINT_MAX
+        and (
+            estimated_rows is None
+            or estimated_rows >= KEY_RANGE_MIN_DENSITY * (maximum - minimum + 1)
+        )
+    )
+
+
+def _is_key_range(minimum: Any, maximum: Any, num_keys: int) -> bool:
+    # Integer keys without gaps (nor duplicates, for the count to match)
+    return (
+        num_keys > 0
+        and isinstance(minimum, int)
+        and not isinstance(minimum, bool)
+        and _BIGINT_MIN <= minimum <= maximum <= _BIGINT_MAX
+        and maximum - minimum + 1 == num_keys
+    )
+
+
+# Keys of the parent tables, kept in memory so that child rows can pick their
+# foreign key values without querying the database
+class KeyPool:
+
+    def __init__(self, key_source: Optional[KeySource] = None):
+        # (full table name, column name) -> keys of that column
+        self._keys: Dict[Tuple[str, str], KeyArray] = {}
+
+        # Without a key source, the keys of pre-existing parents are read
+        # whole however many there are
+        self._key_source = key_source
+
+        # Keys that are only a sample of their table -> [keys drawn from the
+        # sample, number of samples taken]
+        self._samples: Dict[Tuple[str, str], List[int]] = {}
+
+        # Keys kept in a list (text, uuids, ...) as an object array, built on
+        # the first take after the list grew
+        self._object_keys: Dict[Tuple[str, str], np.ndarray] = {}
+
+        # Tables can be filled concurrently, in which case siblings may ask for
+        # the keys of the same pre-existing parent at the same time
+        self._load_lock = threading.Lock()
+
+    def has_keys(self, table_name: str, column_name: str) -> bool:
+        return (table_name, column_name) in self._keys
+
+    def get_keys(self, table_name: str, column_name: str) -> KeyArray:
+        return self._keys.get((table_name, column_name), array("q"))
+
+    def set_keys(self, table_name: str, column_name: str, keys: KeyArray):
+        self._keys[(table_name, column_name)] = keys
+        self._object_keys.pop((table_name, column_name), None)
+
+    def get_all_columns(self) -> List[Tuple[str, str]]:
+        return list(self._keys.keys())
+
+    def add_key(self, table_name: str, column_name: str, value: Any):
+        # NULLs can never be referenced by a foreign key
+        if value is None:
+            return
+
+        pool_key = (table_name, column_name)
+        keys = self._keys.setdefault(pool_key, array("q"))
+
+        if isinstance(keys, KeyRange):
+            if isinstance(value, int) and value == keys.first + len(keys):
+                keys.extend(1)
+                return
+            keys = keys.to_array()
+            self._keys[pool_key] = keys
+
+        # Integer keys are packed into a typed array, anything else falls back
+        # to a plain list
+        if isinstance(keys, array):
+            if (
+                isinstance(value, int)
+                and not isinstance(value, bool)
+                and _BIGINT_MIN <= value <= _BIGINT_MAX
+            ):
+                keys.append(value)
+                return
+
+            keys = list(keys)
+            self._keys[pool_key] = keys
+        elif isinstance(keys, np.ndarray):
+            keys = keys.tolist()
+            self._keys[pool_key] = keys
+
+        keys.append(value)
+        self._object_keys.pop(pool_key, None)
+
+    def add_keys(self, table_name: str, column_name: str, values: Iterable[Any]):
+        # Make sure the entry exists even if there are no values, so an empty
+        # parent is not looked up again
+        self._keys.setdefault((table_name, column_name), array("q"))
+        for value in values:
+            self.add_key(table_name, column_name, value)
+
+    def add_column_keys(self, table_name: str, column_name: str, values: np.ndarray):
+        keys = self._keys.setdefault((table_name, column_name), array("q"))
+
+        # Keys numbered in order, e.g. by a sequence, stay a range
+        if (
+            values.dtype.kind in "iu"
+            and len(values) > 0
+            and (isinstance(keys, KeyRange) or (isinstance(keys, array) and len(keys) == 0))
+        ):
+            first = keys.first + len(keys) if isinstance(keys, KeyRange) else int(values[0])
+            if int(values[0]) == first and np.array_equal(
+                values, np.arange(first, first + len(values))
+            ):
+                if isinstance(keys, KeyRange):
+                    keys.extend(len(values))
+                else:
+                    self._keys[(table_name, column_name)] = KeyRange(first, len(values))
+                return
+
+        if isinstance(keys, KeyRange):
+            keys = keys.to_array()
+            self._keys[(table_name, column_name)] = keys
+
+        # Integer columns are appended to the typed array in one go
+        if isinstance(keys, array) and values.dtype.kind in "iu":
+            keys.frombytes(values.astype(np.int64).tobytes())
+            return
+
+        self.add_keys(table_name, column_name, values.tolist())
+
+    def add_composite_keys(
+        self, table_name: str, column_names: Sequence[str], columns: Sequence[np.ndarray]
+    ):
+        keys = self._keys.setdefault(
+            (table_name, get_key_name(column_names)), CompositeKeys(len(column_names))
+        )
+        keys.add_rows(columns)
+
+    def capture_batches(
+        self,
+        table_name: str,
+        keys: List[List[str]],
+        batches: Iterable[Dict[str, np.ndarray]],
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        # Pass the batches through, recording the values of the referenced
+        # keys, given as their columns
+        for batch in batches:
+            for column_names in keys:
+                if not all(column_name in batch for column_name in column_names):
+                    continue
+                if len(column_names) == 1:
+                    self.add_column_keys(table_name, column_names[0], batch[column_names[0]])
+                else:
+                    self.add_composite_keys(
+                        table_name, column_names, [batch[name] for name in column_names]
+                    )
+            yield batch
+
+    def _set_loaded_keys(
+        self, table_name: str, column_names: Sequence[str], rows: Iterable[Tuple]
+    ):
+        if len(column_names) == 1:
+            self.add_keys(table_name, column_names[0], (row[0] for row in rows))
+            return
+
+        keys = CompositeKeys(len(column_names))
+        rows = list(rows)
+        keys.add_rows(
+            [
+                np.asarray([row[position] for row in rows] + [None], dtype=object)[:-1]
+                for position in range(len(column_names))
+            ]
+        )
+        self.set_keys(table_name, get_key_name(column_names), keys)
+
+    def load_keys(
+        self, table_name: str, column_names: Sequence[str], db_connection: Connection
+    ):
+        # One bulk read for keys that were not produced in Python (e.g. the
+        # parent is pre-existing or the key is generated by the database).
+        # The keys are sorted so that seeded runs sample the same keys.
+        # Integer keys without gaps are only read as their bounds.
+        # Past the max_keys of the key source, only a sample of them is kept
+        metrics = get_metrics()
+        with metrics.timer(table_name, "key_load"):
+            cursor = db_connection.cursor()
+            num_keys = None
+
+            if len(column_names) == 1:
+                cursor.execute(_key_bounds_query(table_name, column_names[0]))
+                minimum, maximum = cursor.fetchone()
+                cursor.execute(row_estimate_query(table_name))
+                if _may_be_key_range(minimum, maximum, cursor.fetchone()[0]):
+                    cursor.execute(_key_count_query(table_name, column_names[0]))
+                    num_keys = cursor.fetchone()[0]
+                if num_keys is not None and _is_key_range(minimum, maximum, num_keys):
+                    self.set_keys(table_name, column_names[0], KeyRange(minimum, num_keys))
+                    self._record_key_load(table_name, column_names)
+                    return
+
+            if self._key_source is not None:
+                key_name = get_key_name(column_names)
+                rows = sample_keys(
+                    self._key_source,
+                    table_name,
+                    column_names,
+                    key_name,
+                    db_connection,
+                    self._get_generation(table_name, key_name),
+                    num_keys,
+                )
+                if rows is not None:
+                    self._set_sampled_keys(table_name, column_names, rows)
+                    self._record_key_load(table_name, column_names)
+                    return
+
+            cursor.execute(_select_keys_query(table_name, column_names))
+            self._set_loaded_keys(table_name, column_names, cursor)
+
+        self._record_key_load(table_name, column_names)
+
+    async def load_keys_async(
+        self, table_name: str, column_names: Sequence[str], db_connection: AsyncConnection
+    ):
+        metrics = get_metrics()
+        with metrics.timer(table_name, "key_load"):
+            cursor = db_connection.cursor()
+            num_keys = None
+
+            if len(column_names) == 1:
+                await cursor.execute(_key_bounds_query(table_name, column_names[0]))
+                minimum, maximum = await cursor.fetchone()
+                await cursor.execute(row_estimate_query(table_name))
+                if _may_be_key_range(minimum, maximum, (await cursor.fetchone())[0]):
+                    await cursor.execute(_key_count_query(table_name, column_names[0]))
+                    num_keys = (await cursor.fetchone())[0]
+                if num_keys is not None and _is_key_range(minimum, maximum, num_keys):
+                    self.set_keys(table_name, column_names[0], KeyRange(minimum, num_keys))
+                    self._record_key_load(table_name, column_names)
+                    return
+
+            if self._key_source is not None:
+                key_name = get_key_name(column_names)
+                rows = await sample_keys_async(
+                    self._key_source,
+                    table_name,
+                    column_names,
+                    key_name,
+                    db_connection,
+                    self._get_generation(table_name, key_name),
+                    num_keys,
+                )
+                if rows is not None:
+                    self._set_sampled_keys(table_name, column_names, rows)
+                    self._record_key_load(table_name, column_names)
+                    return
+
+            await cursor.execute(_select_keys_query(table_name, column_names))
+            self._set_loaded_keys(table_name, column_names, await cursor.fetchall())
+
+        self._record_key_load(table_name, column_names)
+
+    def _get_generation(self, table_name: str, key_name: str) -> int:
+        return self._samples.get((table_name, key_name), [0, 0])[1]
+
+    def _set_sampled_keys(
+        self, table_name: str, column_names: Sequence[str], rows: List[KeyRow]
+    ):
+        key_name = get_key_name(column_names)
+        pool_key = (table_name, key_name)
+        sample = self._samples.get(pool_key)
+
+        # A refreshed sample keeps the size of the one it replaces, since
+        # sibling tables may be drawing indices into it at the same time
+        if sample is not None and self.has_keys(table_name, key_name):
+            num_keys = self.get_num_keys(table_name, key_name)
+            if len(rows) < num_keys:
+                return
+            rng = self._key_source.get_rng(table_name, key_name, sample[1])
+            rows = [rows[index] for index in sorted(rng.choice(len(rows), num_keys, replace=False))]
+
+        # Built aside and then swapped in whole
+        sampled_pool = KeyPool()
+        sampled_pool._set_loaded_keys(table_name, column_names, rows)
+        self.set_keys(table_name, key_name, sampled_pool.get_keys(table_name, key_name))
+        self._samples[pool_key] = [0, sample[1] + 1 if sample is not None else 1]
+
+    def is_stale(self, table_name: str, key_name: str) -> bool:
+        # A sample that served KEY_SAMPLE_REFRESH_DRAWS draws per key is read
+        # again, so that large fills reference more of the parent. Seeded
+        # samples are never refreshed.
+        sample = self._samples.get((table_name, key_name))
+        if sample is None or self._key_source is None or self._key_source.seed is not None:
+            return False
+        return sample[0] >= self.get_num_keys(table_name, key_name) * KEY_SAMPLE_REFRESH_DRAWS
+
+    def _record_key_load(self, table_name: str, column_names: Sequence[str]):
+        get_metrics().merge(
+            table_name,
+            {
+                "key_queries": 1,
+                "keys_loaded": self.get_num_keys(table_name, get_key_name(column_names)),
+            },
+        )
+
+    def ensure_keys(self, constraint: ForeignKeyConstraint, db_connection: Connection):
+        with self._load_lock:
+            key_name = get_key_name(constraint.parent_columns)
+            if not self.has_keys(constraint.parent_table, key_name) or self.is_stale(
+                constraint.parent_table, key_name
+            ):
+                self.load_keys(constraint.parent_table, constraint.parent_columns, db_connection)
+
+    def get_num_keys(self, table_name: str, key_name: str) -> int:
+        return len(self.get_keys(table_name, key_name))
+
+    def take(
+        self, table_name: str, key_name: str, indices: np.ndarray, position: int = 0
+    ) -> np.ndarray:
+        # Keys at the given indices, or the values of their column at
+        # position for a composite key
+        keys = self.get_keys(table_name, key_name)
+
+        sample = self._samples.get((table_name, key_name))
+        if sample is not None:
+            sample[0] += len(indices)
+
+        if isinstance(keys, CompositeKeys):
+            return keys.take(indices, position)
+
+        if isinstance(keys, KeyRange):
+            return keys.take(indices)
+
+        if isinstance(keys, array):
+            return np.frombuffer(keys, dtype=np.int64)[indices]
+
+        if isinstance(keys, np.ndarray):
+            return keys[indices]
+
+        pool_key = (table_name, key_name)
+        object_keys = self._object_keys.get(pool_key)
+        if object_keys is None:
+            object_keys = np.asarray(keys, dtype=object)
+            self._object_keys[pool_key] = object_keys
+        return object_keys[indices]
+
+    def sample_many(
+        self,
+        table_name: str,
+        column_name: str,
+        rng: np.random.Generator,
+        num_rows: int,
+        fan_out: Optional[FanOut] = None,
+        start_row: int = 0,
+    ) -> np.ndarray:
+        # Keys picked uniformly, or following the fan-out of the foreign key
+        keys = self.get_keys(table_name, column_name)
+        if len(keys) == 0:
+            return np.full(num_rows, None, dtype=object)
+
+        if fan_out is None:
+            indices = rng.integers(0, len(keys), size=num_rows)
+        else:
+            indices = fan_out.sample_indices(rng, start_row, num_rows, len(keys))
+
+        return self.take(table_name, column_name, indices)
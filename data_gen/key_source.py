@@ -0,0 +1,335 @@
+import logging
+import math
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from psycopg import AsyncConnection, Connection, sql
+
+from data_gen.parameters import (
+    BATCH_SIZE_DEFAULT,
+    KEY_RANGE_ROWS,
+    KEY_SAMPLE_METHOD_DEFAULT,
+    KEY_SAMPLE_METHODS,
+    KEY_SAMPLE_OVERSAMPLING,
+    MAX_PARENT_KEYS_DEFAULT,
+)
+from data_gen.seeding import column_key
+
+KeyRow = Tuple[Any, ...]
+
+logger = logging.getLogger(__name__)
+
+
+def _table_identifier(table_name: str) -> sql.Identifier:
+    schema_name, relation_name = table_name.split(".", 1)
+    return sql.Identifier(schema_name, relation_name)
+
+
+class KeySource:
+    # How the keys of parents that were not generated by this run are read.
+    # Parents with at most max_keys keys are read whole, larger ones through a
+    # reservoir of max_keys keys sampled with the method:
+    # - system: TABLESAMPLE SYSTEM, random pages, the fastest
+    # - bernoulli: TABLESAMPLE BERNOULLI, random rows, reads the whole table
+    # - range: runs of consecutive keys starting at random points of the
+    #   index, for integer keys (others use system)
+    # With a seed the same table contents give the same sample, and samples
+    # are not refreshed.
+
+    def __init__(
+        self,
+        max_keys: int = MAX_PARENT_KEYS_DEFAULT,
+        method: str = KEY_SAMPLE_METHOD_DEFAULT,
+        seed: Optional[int] = None,
+    ):
+        if max_keys < 1:
+            raise ValueError(f"Maximum number of parent keys must be positive, got {max_keys}")
+        if method not in KEY_SAMPLE_METHODS:
+            raise ValueError(
+                f"Unknown key sample method {method}, expected one of {', '.join(KEY_SAMPLE_METHODS)}"
+            )
+
+        self._max_keys = max_keys
+        self._method = method
+        self._seed = seed
+
+    @property
+    def max_keys(self) -> int:
+        return self._max_keys
+
+    @property
+    def method(self) -> str:
+        return self._method
+
+    @property
+    def seed(self) -> Optional[int]:
+        return self._seed
+
+    def _sample_key(self, table_name: str, key_name: str, generation: int) -> Optional[int]:
+        if self._seed is None:
+            return None
+        return column_key(self._seed, table_name, f"{key_name}/sample{generation}")
+
+    def get_rng(self, table_name: str, key_name: str, generation: int) -> np.random.Generator:
+        return np.random.default_rng(self._sample_key(table_name, key_name, generation))
+
+    def get_repeatable(self, table_name: str, key_name: str, generation: int) -> Optional[int]:
+        # Seed of TABLESAMPLE ... REPEATABLE
+        sample_key = self._sample_key(table_name, key_name, generation)
+        return sample_key % 2**31 if sample_key is not None else None
+
+
+class Reservoir:
+    # Uniform sample of at most capacity rows of a stream read in chunks
+    # (algorithm R), so the memory does not depend on the size of the table
+
+    def __init__(self, capacity: int, rng: np.random.Generator):
+        self._capacity = capacity
+        self._rng = rng
+        self._rows: List[KeyRow] = []
+        self._num_seen = 0
+
+    @property
+    def num_seen(self) -> int:
+        return self._num_seen
+
+    def add(self, rows: Sequence[KeyRow]):
+        free = max(self._capacity - len(self._rows), 0)
+        self._rows.extend(rows[:free])
+        rest = rows[free:]
+
+        if rest:
+            # Row i of the stream replaces a random slot with probability
+            # capacity / (i + 1)
+            positions = np.arange(self._num_seen + free, self._num_seen + len(rows)) + 1
+            slots = (self._rng.random(len(rest)) * positions).astype(np.int64)
+            for row, slot in zip(rest, slots.tolist()):
+                if slot < self._capacity:
+                    self._rows[slot] = row
+
+        self._num_seen += len(rows)
+
+    def get_rows(self) -> List[KeyRow]:
+        # Sorted like the keys read whole, for seeded runs
+        return sorted(self._rows)
+
+
+def row_estimate_query(table_name: str) -> sql.Composed:
+    # Rows of the table scaled from the statistics to its current size, or
+    # NULL when it was never analyzed
+    return sql.SQL(
+        "SELECT CASE WHEN reltuples > 0 AND relpages > 0 THEN "
+        "reltuples / relpages * (pg_relation_size(oid) / current_setting('block_size')::int) END "
+        "FROM pg_class WHERE oid = {}::regclass"
+    ).format(sql.Literal(_table_identifier(table_name).as_string(None)))
+
+
+def _has_more_keys_query(
+    table_name: str, column_names: Sequence[str], max_keys: int
+) -> sql.Composed:
+    # Counts up to max_keys + 1 keys, without reading the whole table
+    return sql.SQL("SELECT count(*) FROM (SELECT 1 FROM {} WHERE {} LIMIT {}) AS keys").format(
+        _table_identifier(table_name),
+        _not_null(column_names),
+        sql.Literal(max_keys + 1),
+    )
+
+
+def _not_null(column_names: Sequence[str]) -> sql.Composed:
+    return sql.SQL(" AND ").join(
+        sql.SQL("{} IS NOT NULL").format(sql.Identifier(name)) for name in column_names
+    )
+
+
+def _sample_percent(max_keys: int, estimated_rows: Optional[float]) -> float:
+    # Slightly more rows than the reservoir holds, the reservoir evens out
+    # the difference
+    if estimated_rows is None or estimated_rows <= 0:
+        return 100.0
+    return min(100.0, 100.0 * max_keys * KEY_SAMPLE_OVERSAMPLING / estimated_rows)
+
+
+def _table_sample_query(
+    table_name: str,
+    column_names: Sequence[str],
+    method: str,
+    percent: float,
+    repeatable: Optional[int],
+) -> sql.Composed:
+    return sql.SQL("SELECT {} FROM {} TABLESAMPLE {} ({}){} WHERE {}").format(
+        sql.SQL(", ").join(sql.Identifier(name) for name in column_names),
+        _table_identifier(table_name),
+        sql.SQL("BERNOULLI" if method == "bernoulli" else "SYSTEM"),
+        sql.Literal(percent),
+        (
+            sql.SQL(" REPEATABLE ({})").format(sql.Literal(repeatable))
+            if repeatable is not None
+            else sql.SQL("")
+        ),
+        _not_null(column_names),
+    )
+
+
+def _range_bounds_query(table_name: str, column_name: str) -> sql.Composed:
+    # Read from the ends of the index of the key
+    return sql.SQL("SELECT min({0}), max({0}) FROM {1}").format(
+        sql.Identifier(column_name), _table_identifier(table_name)
+    )
+
+
+def _range_sample_query(table_name: str, column_name: str) -> sql.Composed:
+    # KEY_RANGE_ROWS consecutive keys from every start, one index scan each
+    return sql.SQL(
+        "SELECT keys.{0} FROM unnest(%s::int8[]) AS starts(start) "
+        "CROSS JOIN LATERAL (SELECT {0} FROM {1} WHERE {0} >= starts.start "
+        "ORDER BY {0} LIMIT {2}) AS keys"
+    ).format(
+        sql.Identifier(column_name), _table_identifier(table_name), sql.Literal(KEY_RANGE_ROWS)
+    )
+
+
+def _range_starts(
+    rng: np.random.Generator, minimum: int, maximum: int, max_keys: int
+) -> List[int]:
+    num_ranges = math.ceil(max_keys / KEY_RANGE_ROWS)
+    return sorted(rng.integers(minimum, maximum, size=num_ranges, endpoint=True).tolist())
+
+
+def _is_range_sampled(key_source: KeySource, bounds: Optional[Tuple[Any, Any]]) -> bool:
+    return (
+        key_source.method == "range"
+        and bounds is not None
+        and isinstance(bounds[0], int)
+        and not isinstance(bounds[0], bool)
+    )
+
+
+def _range_rows(rows: Sequence[KeyRow]) -> List[KeyRow]:
+    # Runs that start close together overlap
+    return sorted(set(rows))
+
+
+def sample_keys(
+    key_source: KeySource,
+    table_name: str,
+    column_names: Sequence[str],
+    key_name: str,
+    db_connection: Connection,
+    generation: int = 0,
+    num_keys: Optional[int] = None,
+) -> Optional[List[KeyRow]]:
+    # A sample of at most max_keys keys of the table, or None when it has no
+    # more than that and is read whole. num_keys is the number of keys when
+    # it is already known.
+    cursor = db_connection.cursor()
+
+    if num_keys is None:
+        cursor.execute(_has_more_keys_query(table_name, column_names, key_source.max_keys))
+        num_keys = cursor.fetchone()[0]
+    if num_keys <= key_source.max_keys:
+        return None
+
+    rng = key_source.get_rng(table_name, key_name, generation)
+    reservoir = Reservoir(key_source.max_keys, rng)
+
+    if key_source.method == "range" and len(column_names) == 1:
+        cursor.execute(_range_bounds_query(table_name, column_names[0]))
+        bounds = cursor.fetchone()
+        if _is_range_sampled(key_source, bounds):
+            cursor.execute(
+                _range_sample_query(table_name, column_names[0]),
+                (_range_starts(rng, bounds[0], bounds[1], key_source.max_keys),),
+            )
+            reservoir.add(_range_rows(cursor.fetchall()))
+            return reservoir.get_rows()
+
+    cursor.execute(row_estimate_query(table_name))
+    percent = _sample_percent(key_source.max_keys, cursor.fetchone()[0])
+
+    # Streamed through a server side cursor, a chunk at a time
+    with db_connection.cursor(name="data_gen_key_sample") as sample_cursor:
+        sample_cursor.execute(
+            _table_sample_query(
+                table_name,
+                column_names,
+                key_source.method,
+                percent,
+                key_source.get_repeatable(table_name, key_name, generation),
+            )
+        )
+        while True:
+            rows = sample_cursor.fetchmany(BATCH_SIZE_DEFAULT)
+            if not rows:
+                break
+            reservoir.add(rows)
+
+    logger.info(
+        "Sampled %d keys of %s out of %d read (%.2f%% of the table)",
+        min(reservoir.num_seen, key_source.max_keys),
+        table_name,
+        reservoir.num_seen,
+        percent,
+    )
+    return reservoir.get_rows()
+
+
+async def sample_keys_async(
+    key_source: KeySource,
+    table_name: str,
+    column_names: Sequence[str],
+    key_name: str,
+    db_connection: AsyncConnection,
+    generation: int = 0,
+    num_keys: Optional[int] = None,
+) -> Optional[List[KeyRow]]:
+    cursor = db_connection.cursor()
+
+    if num_keys is None:
+        await cursor.execute(
+            _has_more_keys_query(table_name, column_names, key_source.max_keys)
+        )
+        num_keys = (await cursor.fetchone())[0]
+    if num_keys <= key_source.max_keys:
+        return None
+
+    rng = key_source.get_rng(table_name, key_name, generation)
+    reservoir = Reservoir(key_source.max_keys, rng)
+
+    if key_source.method == "range" and len(column_names) == 1:
+        await cursor.execute(_range_bounds_query(table_name, column_names[0]))
+        bounds = await cursor.fetchone()
+        if _is_range_sampled(key_source, bounds):
+            await cursor.execute(
+                _range_sample_query(table_name, column_names[0]),
+                (_range_starts(rng, bounds[0], bounds[1], key_source.max_keys),),
+            )
+            reservoir.add(_range_rows(await cursor.fetchall()))
+            return reservoir.get_rows()
+
+    await cursor.execute(row_estimate_query(table_name))
+    percent = _sample_percent(key_source.max_keys, (await cursor.fetchone())[0])
+
+    async with db_connection.cursor(name="data_gen_key_sample") as sample_cursor:
+        await sample_cursor.execute(
+            _table_sample_query(
+                table_name,
+                column_names,
+                key_source.method,
+                percent,
+                key_source.get_repeatable(table_name, key_name, generation),
+            )
+        )
+        while True:
+            rows = await sample_cursor.fetchmany(BATCH_SIZE_DEFAULT)
+            if not rows:
+                break
+            reservoir.add(rows)
+
+    logger.info(
+        "Sampled %d keys of %s out of %d read (%.2f%% of the table)",
+        min(reservoir.num_seen, key_source.max_keys),
+        table_name,
+        reservoir.num_seen,
+        percent,
+    )
+    return reservoir.get_rows()
@@ -0,0 +1,144 @@
+from typing import AsyncIterable, Callable, Iterable, List, Mapping, Optional, Sequence
+
+from psycopg import AsyncConnection, Connection, sql
+
+from data_gen.metrics import get_metrics
+from data_gen.table_node import TableNode
+
+ColumnBatch = Mapping[str, Sequence]
+
+
+class EncodedBatch:
+    # A batch already formatted as COPY text, so sending it is only I/O
+
+    def __init__(self, column_names: List[str], num_rows: int, data: bytes):
+        self._column_names = column_names
+        self._num_rows = num_rows
+        self._data = data
+
+    @property
+    def column_names(self) -> List[str]:
+        return self._column_names
+
+    @property
+    def num_rows(self) -> int:
+        return self._num_rows
+
+    @property
+    def data(self) -> bytes:
+        return self._data
+
+
+def table_identifier(table: TableNode) -> sql.Identifier:
+    return sql.Identifier(table.schema_name, table.table_name)
+
+
+def _to_python_list(column: Sequence) -> list:
+    # NumPy arrays convert all their values to Python objects in one C call
+    if hasattr(column, "tolist"):
+        return column.tolist()
+    return list(column)
+
+
+def copy_statement(table: TableNode, column_names: List[str]) -> sql.Composed:
+    return sql.SQL("COPY {} ({}) FROM STDIN").format(
+        table_identifier(table),
+        sql.SQL(", ").join(sql.Identifier(name) for name in column_names),
+    )
+
+
+def copy_columns(
+    table: TableNode, columns: ColumnBatch, db_connection: Connection
+) -> int:
+    column_names = list(columns.keys())
+    if not column_names:
+        return 0
+
+    values = [_to_python_list(columns[name]) for name in column_names]
+
+    num_rows = 0
+    cursor = db_connection.cursor()
+    with cursor.copy(copy_statement(table, column_names)) as copy:
+        for row in zip(*values):
+            copy.write_row(row)
+            num_rows += 1
+
+    return num_rows
+
+
+def copy_batches(
+    table: TableNode,
+    batches: Iterable[ColumnBatch],
+    db_connection: Connection,
+    commit_per_batch: bool = False,
+    before_commit: Optional[Callable[[Connection, int], None]] = None,
+    commit: bool = True,
+) -> int:
+    # The batches are pulled one at a time. Generating a batch may still need
+    # the connection (e.g. to look up types), which is not possible while a
+    # COPY is in progress, so a batch is only sent once it is complete.
+    # before_commit is called with the number of rows of every batch, in the
+    # transaction of the batch. Without commit the rows are left in the open
+    # transaction of the connection, for the caller to commit.
+    total_rows = 0
+    metrics = get_metrics()
+
+    try:
+        for batch in batches:
+            with metrics.timer(table.full_table_name, "load"):
+                num_rows = copy_columns(table, batch, db_connection)
+
+                if before_commit is not None:
+                    before_commit(db_connection, num_rows)
+
+                if commit and commit_per_batch:
+                    db_connection.commit()
+
+            total_rows += num_rows
+            metrics.increment(table.full_table_name, "rows_loaded", num_rows)
+
+        if commit:
+            with metrics.timer(table.full_table_name, "load"):
+                db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+
+    return total_rows
+
+
+async def copy_batches_async(
+    table: TableNode,
+    batches: AsyncIterable[EncodedBatch],
+    db_connection: AsyncConnection,
+    commit_per_batch: bool = False,
+) -> int:
+    # Same as copy_batches for batches encoded ahead of time, so the event
+    # loop is free while the next ones are generated
+    total_rows = 0
+    metrics = get_metrics()
+
+    try:
+        async for batch in batches:
+            if not batch.column_names:
+                continue
+
+            with metrics.timer(table.full_table_name, "load"):
+                cursor = db_connection.cursor()
+                async with cursor.copy(copy_statement(table, batch.column_names)) as copy:
+                    await copy.write(batch.data)
+
+                if commit_per_batch:
+                    await db_connection.commit()
+
+            total_rows += batch.num_rows
+            metrics.increment(table.full_table_name, "rows_loaded", batch.num_rows)
+
+        with metrics.timer(table.full_table_name, "load"):
+            await db_connection.commit()
+    except BaseException:
+        # Also roll back when the task is cancelled because another one failed
+        await db_connection.rollback()
+        raise
+
+    return total_rows
@@ -0,0 +1,187 @@
+import datetime
+import json
+import logging
+import pathlib
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Mapping, Optional, Sequence
+
+from data_gen.parameters import PROGRESS_INTERVAL_DEFAULT
+
+progress_logger = logging.getLogger("data_gen.progress")
+
+# Scope of the metrics that do not belong to a table
+CATALOG_SCOPE = "catalog"
+
+
+class ProgressReporter:
+    # Logs the number of rows done, the throughput and the remaining time at
+    # most once per interval
+
+    def __init__(self, total_rows: int, interval: float = PROGRESS_INTERVAL_DEFAULT):
+        self._total_rows = total_rows
+        self._interval = interval
+        self._done_rows = 0
+        self._start_time = time.perf_counter()
+        self._last_report_time = self._start_time
+        self._lock = threading.Lock()
+
+    @property
+    def done_rows(self) -> int:
+        return self._done_rows
+
+    def advance(self, num_rows: int):
+        with self._lock:
+            self._done_rows += num_rows
+            now = time.perf_counter()
+            if now - self._last_report_time < self._interval:
+                return
+            self._last_report_time = now
+
+        self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self._start_time
+        rows_per_second = self._done_rows / elapsed if elapsed > 0 else 0.0
+
+        if rows_per_second > 0 and self._total_rows > self._done_rows:
+            remaining = datetime.timedelta(
+                seconds=round((self._total_rows - self._done_rows) / rows_per_second)
+            )
+        else:
+            remaining = datetime.timedelta(0)
+
+        percent = 100.0 * self._done_rows / self._total_rows if self._total_rows else 100.0
+        progress_logger.info(
+            "Progress: %d/%d rows (%.1f%%), %.0f rows/s, ETA %s",
+            self._done_rows,
+            self._total_rows,
+            percent,
+            rows_per_second,
+            remaining,
+        )
+
+
+def _batch_length(batch: Mapping[str, Sequence]) -> int:
+    return len(next(iter(batch.values()))) if batch else 0
+
+
+class Metrics:
+    # Counters and timers (the counters ending in _seconds) per table, shared
+    # by all the threads of a run
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scopes: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self._progress: Optional[ProgressReporter] = None
+        self._start_time = time.perf_counter()
+
+    def reset(self):
+        with self._lock:
+            self._scopes.clear()
+            self._progress = None
+            self._start_time = time.perf_counter()
+
+    def increment(self, scope: str, name: str, value: float = 1):
+        with self._lock:
+            self._scopes[scope][name] += value
+
+    def merge(self, scope: str, values: Mapping[str, float]):
+        with self._lock:
+            for name, value in values.items():
+                self._scopes[scope][name] += value
+
+    def get(self, scope: str) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._scopes.get(scope, {}))
+
+    @contextmanager
+    def timer(self, scope: str, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.increment(scope, f"{stage}_seconds", time.perf_counter() - start)
+
+    def timed_batches(
+        self, table_name: str, batches: Iterable[Mapping[str, Sequence]]
+    ) -> Iterator[Mapping[str, Sequence]]:
+        # Time spent producing the batches is generation time, whatever
+        # consumes them accounts for its own time
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                self.increment(table_name, "generate_seconds", time.perf_counter() - start)
+                return
+
+            num_rows = _batch_length(batch)
+            self.merge(
+                table_name,
+                {
+                    "generate_seconds": time.perf_counter() - start,
+                    "rows_generated": num_rows,
+                    "batches": 1,
+                },
+            )
+            self.advance_progress(num_rows)
+
+            yield batch
+
+    def start_progress(
+        self, total_rows: int, interval: float = PROGRESS_INTERVAL_DEFAULT
+    ):
+        self._progress = ProgressReporter(total_rows, interval)
+
+    def advance_progress(self, num_rows: int):
+        if self._progress is not None:
+            self._progress.advance(num_rows)
+
+    def finish_progress(self):
+        if self._progress is not None:
+            self._progress.report()
+            self._progress = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Counters are whole numbers, only the timers are fractional
+        with self._lock:
+            scopes = {
+                scope: {
+                    name: value if name.endswith("_seconds") else int(value)
+                    for name, value in values.items()
+                }
+                for scope, values in self._scopes.items()
+            }
+
+        totals: Dict[str, float] = defaultdict(int)
+        for scope, values in scopes.items():
+            if scope == CATALOG_SCOPE:
+                continue
+            for name, value in values.items():
+                totals[name] += value
+
+        return {
+            "elapsed_seconds": time.perf_counter() - self._start_time,
+            "totals": dict(totals),
+            "catalog": scopes.pop(CATALOG_SCOPE, {}),
+            "tables": scopes,
+        }
+
+    def dump(self, path: pathlib.Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+
+# Metrics of the current run
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
@@ -1 +1,36 @@
-NUM_ROWS_DEFAULT = 10
\ No newline at end of file
+NUM_ROWS_DEFAULT = 10
+BATCH_SIZE_DEFAULT = 10000
+SNAPSHOT_FILE_DEFAULT = ".data_gen/schema_snapshot.json.gz"
+WORKERS_DEFAULT = 1
+CONNINFO_DEFAULT = "host=localhost dbname=postgres user=postgres password=postgres port=5432"
+SHARDS_DEFAULT = 1
+SHARD_MIN_ROWS = 100000
+SEED_BLOCK_SIZE = 10000
+DATE_RANGE_END = "2025-01-01"
+VALUE_POOL_SIZE = 10000
+VALUE_POOL_SEED = 0
+VALUE_POOL_FILE_DEFAULT = ".data_gen/value_pools.npz"
+PROGRESS_INTERVAL_DEFAULT = 5.0
+QUEUE_SIZE_DEFAULT = 4
+JOURNAL_SCHEMA = "data_gen"
+JOURNAL_FILE_DEFAULT = ".data_gen/journal.jsonl"
+REBUILD_WORKERS_DEFAULT = 4
+ZIPF_EXPONENT_DEFAULT = 1.1
+UNIQUE_RETRIES = 20
+UNIQUE_SET_MAX_ROWS = 1000000
+BLOOM_ERROR_RATE = 0.001
+MAX_PARENT_KEYS_DEFAULT = 1000000
+KEY_SAMPLE_METHOD_DEFAULT = "system"
+KEY_SAMPLE_OVERSAMPLING = 1.25
+KEY_SAMPLE_REFRESH_DRAWS = 10
+KEY_RANGE_ROWS = 1000
+KEY_RANGE_MIN_DENSITY = 0.9
+TOP_UP_EXACT_COUNT_MAX = 1000000
+
+# Choices of the command line, kept here so that it can list them without
+# importing the modules that implement them
+JOURNAL_KINDS = ("none", "table", "file")
+FAST_LOAD_MODES = ("none", "drop", "replica")
+KEY_SAMPLE_METHODS = ("system", "bernoulli", "range")
+OUTPUT_FORMATS = ("copy", "binary", "csv", "sql")
+COMPRESSIONS = ("none", "gzip", "zstd")
@@ -0,0 +1,357 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from data_gen.depgraph import DepGraph
+from data_gen.key_pool import KeyPool, get_key_name
+from data_gen.key_source import KeySource
+from data_gen.loader import ColumnBatch, EncodedBatch, copy_batches_async
+from data_gen.metrics import get_metrics
+from data_gen.parameters import (
+    BATCH_SIZE_DEFAULT,
+    NUM_ROWS_DEFAULT,
+    QUEUE_SIZE_DEFAULT,
+    TOP_UP_EXACT_COUNT_MAX,
+    WORKERS_DEFAULT,
+)
+from data_gen.plan import compile_table_plan
+from data_gen.scale import ScaleSpec, get_fan_outs, get_row_counts
+from data_gen.sharding import get_unique_offsets_async
+from data_gen.sinks import encode_copy_text_batch
+from data_gen.table_node import TableNode
+from data_gen.top_up import get_top_up_async
+from data_gen.uniqueness import get_checked_constraints, load_unique_filters_async
+
+logger = logging.getLogger(__name__)
+
+# Put in a batch queue after the last batch of a table
+_END_OF_TABLE = object()
+
+QueueItem = Union[EncodedBatch, BaseException, object]
+
+
+def _encode_batches(batches: Iterable[ColumnBatch]) -> Iterator[EncodedBatch]:
+    for batch in batches:
+        column_names = list(batch.keys())
+        num_rows = len(batch[column_names[0]]) if column_names else 0
+        yield EncodedBatch(column_names, num_rows, encode_copy_text_batch(batch))
+
+
+async def _produce_batches(
+    batches: Iterable[ColumnBatch], queue: asyncio.Queue, executor: Executor
+):
+    # Batches are generated and formatted as COPY text in the thread pool,
+    # so that the event loop keeps sending the previous ones. The queue is
+    # bounded, so generation stops when the loader falls behind.
+    loop = asyncio.get_running_loop()
+    iterator = _encode_batches(batches)
+
+    try:
+        while True:
+            batch = await loop.run_in_executor(executor, next, iterator, None)
+            if batch is None:
+                break
+            await queue.put(batch)
+    except Exception as error:
+        # Hand the error over to the loader, which is waiting on the queue
+        await queue.put(error)
+        return
+
+    await queue.put(_END_OF_TABLE)
+
+
+async def _consume_batches(queue: asyncio.Queue) -> AsyncIterator[EncodedBatch]:
+    while True:
+        item: QueueItem = await queue.get()
+        if item is _END_OF_TABLE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+class _AsyncFill:
+    # State shared by the tasks of an asynchronous fill. Every table has one
+    # task that reads its keys and loads it over connections of the pool,
+    # plus a producer task that generates its batches.
+
+    def __init__(
+        self,
+        dep_graph: DepGraph,
+        connection_pool: AsyncConnectionPool,
+        executor: Executor,
+        row_counts: Dict[str, int],
+        start_rows: Dict[str, int],
+        batch_size: int,
+        commit_per_batch: bool,
+        queue_size: int,
+        seed: Optional[int],
+        scale_spec: Optional[ScaleSpec],
+        key_source: Optional[KeySource],
+    ):
+        self._dep_graph = dep_graph
+        self._connection_pool = connection_pool
+        self._executor = executor
+        self._row_counts = row_counts
+        self._start_rows = start_rows
+        self._batch_size = batch_size
+        self._commit_per_batch = commit_per_batch
+        self._queue_size = queue_size
+        self._seed = seed
+        self._scale_spec = scale_spec
+
+        self._key_pool = KeyPool(key_source)
+        self._key_lock = asyncio.Lock()
+
+        # Set once all the rows of a table are generated, and so its keys are
+        # in the key pool, and once they are committed
+        fill_order = dep_graph.get_fill_order()
+        self._generated = {table_name: asyncio.Event() for table_name in fill_order}
+        self._loaded = {table_name: asyncio.Event() for table_name in fill_order}
+        self._failed_table: Optional[str] = None
+
+    def _abort(self, table_name: str):
+        # Wake up every table waiting on another one, cancelling them is not
+        # enough as the connection pool may swallow the cancellation
+        if self._failed_table is None:
+            self._failed_table = table_name
+        for event in list(self._generated.values()) + list(self._loaded.values()):
+            event.set()
+
+    async def _wait(self, event: asyncio.Event):
+        await event.wait()
+        if self._failed_table is not None:
+            raise RuntimeError(f"Stopped because table {self._failed_table} failed")
+
+    async def _ensure_parent_keys(self, table: TableNode):
+        for relationship in table.parent_relationships:
+            parent_table = relationship.parent_table
+            if parent_table in self._generated:
+                await self._wait(self._generated[parent_table])
+
+            key_name = get_key_name(relationship.parent_columns)
+            if self._key_pool.has_keys(parent_table, key_name) and not self._key_pool.is_stale(
+                parent_table, key_name
+            ):
+                continue
+
+            # Keys the database generates can only be read back once the
+            # parent is committed
+            if parent_table in self._loaded:
+                await self._wait(self._loaded[parent_table])
+
+            # Siblings may ask for the keys of the same parent at the same time
+            async with self._key_lock:
+                if not self._key_pool.has_keys(
+                    parent_table, key_name
+                ) or self._key_pool.is_stale(parent_table, key_name):
+                    async with self._connection_pool.connection() as db_connection:
+                        await self._key_pool.load_keys_async(
+                            parent_table, relationship.parent_columns, db_connection
+                        )
+
+    async def _wait_for_parents(self, table: TableNode):
+        for relationship in table.parent_relationships:
+            if relationship.parent_table in self._loaded:
+                await self._wait(self._loaded[relationship.parent_table])
+
+    async def fill_table(self, table_name: str, rng: np.random.Generator):
+        try:
+            await self._fill_table(table_name, rng)
+        except BaseException:
+            self._abort(table_name)
+            raise
+
+    async def _fill_table(self, table_name: str, rng: np.random.Generator):
+        table = self._dep_graph.get_table(table_name)
+        metrics = get_metrics()
+
+        with metrics.timer(table_name, "fill"):
+            num_rows = self._row_counts[table_name]
+            start_row = self._start_rows.get(table_name, 0)
+            if num_rows == 0:
+                # Children read the keys of the table from the database
+                logger.info("Skipping table: %s, no rows to add", table_name)
+                self._generated[table_name].set()
+                self._loaded[table_name].set()
+                return
+
+            logger.info("Filling table: %s with %d rows", table_name, num_rows)
+            fan_outs = get_fan_outs(table, self._scale_spec)
+            referenced_keys = self._dep_graph.get_referenced_keys(table_name)
+
+            # Connections are only held while reading from the database and
+            # loading, never while waiting on the parents, so that waiting
+            # tables leave the pool to those that can load
+            with metrics.timer(table_name, "parent_keys"):
+                await self._ensure_parent_keys(table)
+
+            async with self._connection_pool.connection() as db_connection:
+                unique_offsets = await get_unique_offsets_async(
+                    table, db_connection, start_row
+                )
+
+                # Unique constraints whose values can collide, see fill_table
+                unique_filters = None
+                checked_constraints = get_checked_constraints(table, unique_offsets, fan_outs)
+                if checked_constraints:
+                    unique_filters = await load_unique_filters_async(
+                        table, checked_constraints, num_rows, db_connection
+                    )
+
+            # Children also reference the rows the table already had
+            if start_row > 0:
+                async with self._key_lock:
+                    async with self._connection_pool.connection() as db_connection:
+                        for column_names in referenced_keys:
+                            await self._key_pool.load_keys_async(
+                                table_name, column_names, db_connection
+                            )
+
+            with metrics.timer(table_name, "plan"):
+                plan = compile_table_plan(
+                    table,
+                    self._key_pool,
+                    self._dep_graph.type_registry,
+                    unique_offsets,
+                    seed=self._seed,
+                    fan_outs=fan_outs,
+                    unique_filters=unique_filters,
+                )
+
+            batches = self._key_pool.capture_batches(
+                table_name,
+                referenced_keys,
+                plan.iter_batches(rng, num_rows, self._batch_size, start_row),
+            )
+            batches = metrics.timed_batches(table_name, batches)
+
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+            producer = asyncio.create_task(self._produce(table_name, batches, queue))
+
+            try:
+                # Rows can only reference committed parent rows, the batches
+                # queue up in the meantime
+                await self._wait_for_parents(table)
+
+                async with self._connection_pool.connection() as db_connection:
+                    loaded_rows = await copy_batches_async(
+                        table,
+                        _consume_batches(queue),
+                        db_connection,
+                        self._commit_per_batch,
+                    )
+            finally:
+                producer.cancel()
+
+        self._loaded[table_name].set()
+        logger.info("Loaded %d rows into %s", loaded_rows, table_name)
+
+    async def _produce(
+        self, table_name: str, batches: Iterable[ColumnBatch], queue: asyncio.Queue
+    ):
+        await _produce_batches(batches, queue, self._executor)
+        self._generated[table_name].set()
+
+
+async def fill_tables_async(
+    dep_graph: DepGraph,
+    conninfo: str,
+    num_workers: int = WORKERS_DEFAULT,
+    num_rows: int = NUM_ROWS_DEFAULT,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    commit_per_batch: bool = False,
+    queue_size: int = QUEUE_SIZE_DEFAULT,
+    seed: Optional[int] = None,
+    scale_spec: Optional[ScaleSpec] = None,
+    key_source: Optional[KeySource] = None,
+    top_up: bool = False,
+    exact_count_max: int = TOP_UP_EXACT_COUNT_MAX,
+):
+    # Tables are loaded over num_workers connections while num_workers threads
+    # generate their batches. A child starts generating as soon as the keys
+    # of its parents are known and starts loading once they are committed.
+    if num_workers < 1:
+        raise ValueError(f"Number of workers must be positive, got {num_workers}")
+    if queue_size < 1:
+        raise ValueError(f"Queue size must be positive, got {queue_size}")
+
+    # Cycles need all their tables loaded in one transaction, which does not
+    # fit loading every table over its own connection
+    deferred_relationships = dep_graph.get_deferred_relationships()
+    if deferred_relationships:
+        raise ValueError(
+            f"Tables referencing each other through {', '.join(r.constraint_name for r in deferred_relationships)} can't be filled asynchronously"
+        )
+
+    fill_order = dep_graph.get_fill_order()
+    row_counts = get_row_counts(dep_graph, num_rows, scale_spec)
+
+    # Only add the rows every table is missing, see fill_tables
+    start_rows: Dict[str, int] = {}
+    if top_up:
+        async with await AsyncConnection.connect(conninfo) as db_connection:
+            row_counts, start_rows = await get_top_up_async(
+                dep_graph, row_counts, db_connection, exact_count_max
+            )
+
+    # Every table gets its own independent random stream
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(fill_order))
+
+    metrics = get_metrics()
+    metrics.start_progress(sum(row_counts.values()))
+
+    try:
+        async with AsyncConnectionPool(
+            conninfo, min_size=num_workers, max_size=num_workers, open=False
+        ) as connection_pool:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                fill = _AsyncFill(
+                    dep_graph,
+                    connection_pool,
+                    executor,
+                    row_counts,
+                    start_rows,
+                    batch_size,
+                    commit_per_batch,
+                    queue_size,
+                    seed,
+                    scale_spec,
+                    key_source,
+                )
+
+                tasks: Dict[asyncio.Task, str] = {
+                    asyncio.create_task(
+                        fill.fill_table(table_name, np.random.default_rng(seed_sequence))
+                    ): table_name
+                    for table_name, seed_sequence in zip(fill_order, seed_sequences)
+                }
+
+                await _wait_for_tasks(tasks)
+    finally:
+        metrics.finish_progress()
+
+
+async def _wait_for_tasks(tasks: Dict[asyncio.Task, str]):
+    # Stop everything at the first failure, the children of a failed table
+    # would wait for it forever
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+
+    errors: List[BaseException] = []
+    for task in done:
+        error = task.exception()
+        if error is not None:
+            logger.error("Failed to fill table: %s: %s", tasks[task], error)
+            errors.append(error)
+
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,723 @@
+import logging
+from typing import Callable, Collection, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from data_gen.generators import (
+    DEFAULT_TEXT_GENERATOR,
+    TEXT_GENERATORS,
+    TEXT_TYPES,
+    TYPE_GENERATORS,
+    choose_values,
+    generate_nulls,
+    truncate_text,
+)
+from data_gen.key_pool import KeyPool, get_key_name
+from data_gen.metrics import get_metrics
+from data_gen.parameters import BATCH_SIZE_DEFAULT, SEED_BLOCK_SIZE, UNIQUE_RETRIES
+from data_gen.profile import get_column_stats, profile_generator
+from data_gen.scale import FanOut
+from data_gen.seeding import block_rng, column_key
+from data_gen.table_node import ForeignKeyConstraint, TableColumn, TableNode, UniqueConstraint
+from data_gen.type_registry import TypeRegistry
+from data_gen.uniqueness import (
+    UniqueFilter,
+    check_unique_keys,
+    fingerprint_rows,
+    get_checked_constraints,
+    resolve_fan_outs,
+)
+
+ValueGenerator = Callable[[np.random.Generator, int], np.ndarray]
+
+# Column generators also get the index of the first row of the batch in the
+# table, for the columns whose values depend on the position of the row
+ColumnGenerator = Callable[[np.random.Generator, int, int], np.ndarray]
+
+# Data types that are filled with sequences when they have to be unique
+SEQUENCE_TYPES = ("bigint", "integer", "smallint", "numeric")
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnPlan:
+
+    def __init__(self, column_name: str, generator: ColumnGenerator):
+        self._column_name = column_name
+        self._generator = generator
+
+    @property
+    def column_name(self) -> str:
+        return self._column_name
+
+    @property
+    def generator(self) -> ColumnGenerator:
+        return self._generator
+
+    def __str__(self):
+        return f"{self._column_name}: {getattr(self._generator, '__name__', self._generator)}"
+
+
+def _assign_rows(values: np.ndarray, rows: np.ndarray, new_values: np.ndarray) -> np.ndarray:
+    # The new values may not fit the type of the column, e.g. longer strings
+    try:
+        dtype = np.promote_types(values.dtype, new_values.dtype)
+    except TypeError:
+        dtype = np.dtype(object)
+
+    if dtype != values.dtype:
+        values = values.astype(dtype)
+    values[rows] = new_values
+    return values
+
+
+class UniqueGroup:
+    # Unique constraint whose values can collide. The values of every batch
+    # are checked against the ones already generated or in the table, and the
+    # rows that collide are generated again from other random streams, up to
+    # UNIQUE_RETRIES times.
+
+    def __init__(
+        self,
+        table: TableNode,
+        constraint: UniqueConstraint,
+        unique_filter: UniqueFilter,
+        retry_columns: Callable[[int], List[ColumnPlan]],
+    ):
+        self._table = table
+        self._constraint = constraint
+        self._columns = [table.get_column(name) for name in constraint.column_names]
+        self._unique_filter = unique_filter
+        self._retry_columns = retry_columns
+
+    @property
+    def constraint(self) -> UniqueConstraint:
+        return self._constraint
+
+    def enforce(
+        self,
+        batch: Dict[str, np.ndarray],
+        rng: np.random.Generator,
+        start_row: int,
+        num_rows: int,
+    ):
+        metrics = get_metrics()
+        pending = np.arange(num_rows)
+
+        for attempt in range(UNIQUE_RETRIES + 1):
+            with metrics.timer(self._table.full_table_name, "unique_check"):
+                fingerprints, nulls = fingerprint_rows(
+                    [(batch[column.column_name][pending], column) for column in self._columns]
+                )
+                # Rows with a NULL never collide
+                checked = pending[~nulls]
+                pending = checked[self._unique_filter.find_duplicates(fingerprints[~nulls])]
+
+            if len(pending) == 0:
+                return
+
+            if attempt == UNIQUE_RETRIES:
+                raise ValueError(
+                    f"Could not generate unique values of {self._constraint} in table {self._table.full_table_name} after {UNIQUE_RETRIES} retries, the columns have too few distinct values"
+                )
+
+            metrics.increment(self._table.full_table_name, "unique_retries", len(pending))
+            # Whole batches are generated again so that, with a seed, the value
+            # of a row still only depends on its index
+            for column in self._retry_columns(attempt + 1):
+                values = column.generator(rng, start_row, num_rows)
+                batch[column.column_name] = _assign_rows(
+                    batch[column.column_name], pending, values[pending]
+                )
+
+
+class TablePlan:
+
+    def __init__(
+        self,
+        table: TableNode,
+        columns: List[ColumnPlan],
+        unique_groups: Optional[List[UniqueGroup]] = None,
+    ):
+        self._table = table
+        self._columns = columns
+        self._unique_groups = unique_groups if unique_groups is not None else []
+
+    @property
+    def table(self) -> TableNode:
+        return self._table
+
+    @property
+    def columns(self) -> List[ColumnPlan]:
+        return self._columns
+
+    @property
+    def unique_groups(self) -> List[UniqueGroup]:
+        return self._unique_groups
+
+    def generate_batch(
+        self, rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> Dict[str, np.ndarray]:
+        # Everything has been resolved when the plan was compiled, so a batch
+        # is just one call per column, and the unique constraints that can
+        # collide checked afterwards
+        batch = {
+            column.column_name: column.generator(rng, start_row, num_rows)
+            for column in self._columns
+        }
+        for unique_group in self._unique_groups:
+            unique_group.enforce(batch, rng, start_row, num_rows)
+        return batch
+
+    def iter_batches(
+        self,
+        rng: np.random.Generator,
+        num_rows: int,
+        batch_size: int = BATCH_SIZE_DEFAULT,
+        start_row: int = 0,
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        if batch_size < 1:
+            raise ValueError(f"Batch size must be positive, got {batch_size}")
+
+        # Tables where every column is generated by the database have nothing
+        # to insert
+        if not self._columns:
+            return
+
+        for batch_start in range(0, num_rows, batch_size):
+            yield self.generate_batch(
+                rng, start_row + batch_start, min(batch_size, num_rows - batch_start)
+            )
+
+    def __str__(self):
+        ret = f"Plan: {self._table.full_table_name}\n"
+        ret += "\n".join([str(column) for column in self._columns]) + "\n"
+        for unique_group in self._unique_groups:
+            ret += f"checked: {unique_group.constraint}\n"
+        return ret
+
+
+def _column_generator(generator: ValueGenerator) -> ColumnGenerator:
+    def generate_column(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        return generator(rng, num_rows)
+
+    generate_column.__name__ = getattr(generator, "__name__", "generate_column")
+    return generate_column
+
+
+def _enum_generator(enum_options: List[str]) -> ValueGenerator:
+    def generate_enum(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+        return choose_values(rng, enum_options, num_rows)
+
+    return generate_enum
+
+
+def _key_index_generator(
+    parent_table: str,
+    key_name: str,
+    key_pool: KeyPool,
+    fan_out: Optional[FanOut] = None,
+    unique_offset: Optional[int] = None,
+) -> ColumnGenerator:
+    # Indices of the parent keys picked by the rows, uniformly or following
+    # the fan-out of the foreign key. The rows of a unique foreign key pick
+    # the keys after the unique_offset first ones.
+    def generate_key_indices(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        num_keys = key_pool.get_num_keys(parent_table, key_name)
+        if fan_out is None:
+            return rng.integers(0, num_keys, size=num_rows)
+        if unique_offset is None:
+            return fan_out.sample_indices(rng, start_row, num_rows, num_keys)
+        return fan_out.sample_indices(rng, unique_offset + start_row, num_rows, num_keys)
+
+    return generate_key_indices
+
+
+def _unique_key_check(
+    parent_table: str, key_name: str, key_pool: KeyPool, fan_out: FanOut
+) -> Callable[[int], None]:
+    # Fails once the rows of a unique foreign key outnumber the parent keys,
+    # given the number of rows up to the end of the batch
+    def check_keys(num_rows: int):
+        check_unique_keys(
+            parent_table, fan_out, num_rows, key_pool.get_num_keys(parent_table, key_name)
+        )
+
+    return check_keys
+
+
+class _KeySampler:
+    # Parent keys picked by the rows of a foreign key. The indices are drawn
+    # once per batch and shared by the columns of the key, so the values of a
+    # composite key always come from the same parent row.
+
+    def __init__(
+        self,
+        index_generator: ColumnGenerator,
+        unique_check: Optional[Callable[[int], None]] = None,
+    ):
+        self._index_generator = index_generator
+        self._unique_check = unique_check
+        self._indices: Optional[np.ndarray] = None
+
+    def get_indices(
+        self, rng: np.random.Generator, start_row: int, num_rows: int, refresh: bool
+    ) -> np.ndarray:
+        if refresh or self._indices is None:
+            if self._unique_check is not None:
+                self._unique_check(start_row + num_rows)
+            self._indices = self._index_generator(rng, start_row, num_rows)
+        return self._indices
+
+
+def _foreign_key_generator(
+    table_name: str,
+    parent_table: str,
+    key_name: str,
+    position: int,
+    key_pool: KeyPool,
+    sampler: _KeySampler,
+    refresh: bool,
+) -> ColumnGenerator:
+    # The first column of the key compiled into a plan draws the indices of
+    # the batch, the others reuse them
+    metrics = get_metrics()
+
+    def generate_foreign_key(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        with metrics.timer(table_name, "foreign_key"):
+            indices = sampler.get_indices(rng, start_row, num_rows, refresh)
+            keys = key_pool.take(parent_table, key_name, indices, position)
+        metrics.increment(table_name, "foreign_key_lookups", num_rows)
+        return keys
+
+    return generate_foreign_key
+
+
+def _truncating_generator(generator: ValueGenerator, max_length: int) -> ValueGenerator:
+    def generate_truncated(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+        return truncate_text(generator(rng, num_rows), max_length)
+
+    return generate_truncated
+
+
+def _sequence_generator(offset: int) -> ColumnGenerator:
+    # Values above the offset, one per row index, so that rows generated
+    # independently (e.g. by different shards) never collide
+    def generate_sequence(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        return np.arange(
+            offset + start_row + 1, offset + start_row + num_rows + 1, dtype=np.int64
+        )
+
+    return generate_sequence
+
+
+def _suffix_length(start_row: int, num_rows: int) -> int:
+    # Longest row index of the batch, with its separator
+    return len(str(max(start_row + num_rows - 1, 0))) + 1
+
+
+def _row_suffixed_generator(
+    generator: ValueGenerator, max_length: Optional[int] = None, offset: int = 0
+) -> ColumnGenerator:
+    # Text made unique by appending the row index, plus the offset past the
+    # rows already in the table. The generated part is cut so that the
+    # suffix fits in the column.
+    def generate_row_suffixed(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        first_index = offset + start_row
+        row_indices = np.arange(first_index, first_index + num_rows).astype(str)
+        values = generator(rng, num_rows).astype(str)
+
+        if max_length is not None:
+            prefix_length = max_length - _suffix_length(first_index, num_rows)
+            if prefix_length < 0:
+                raise ValueError(
+                    f"Unique values of length {max_length} can't hold row index {first_index + num_rows - 1}"
+                )
+            values = (
+                truncate_text(values, prefix_length)
+                if prefix_length > 0
+                else np.full(num_rows, "", dtype=str)
+            )
+
+        return np.char.add(np.char.add(values, "-"), row_indices)
+
+    return generate_row_suffixed
+
+
+def _row_suffixed_email_generator(
+    generator: ValueGenerator, max_length: Optional[int] = None, offset: int = 0
+) -> ColumnGenerator:
+    # Emails made unique by appending the row index to their local part, so
+    # they are still valid addresses. Local parts are shortened when the
+    # address would not fit in the column.
+    def generate_row_suffixed_email(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        first_index = offset + start_row
+        row_indices = np.arange(first_index, first_index + num_rows).astype(str)
+        parts = np.char.partition(generator(rng, num_rows).astype(str), "@")
+        local_parts = np.char.add(np.char.add(parts[:, 0], "."), row_indices)
+        values = np.char.add(np.char.add(local_parts, parts[:, 1]), parts[:, 2])
+
+        if max_length is None:
+            return values
+
+        too_long = np.flatnonzero(np.char.str_len(values) > max_length)
+        if len(too_long) == 0:
+            return values
+
+        values = values.astype(object)
+        for row in too_long.tolist():
+            local_part, at, domain = parts[row]
+            suffix = f".{row_indices[row]}{at}{domain}"
+            if len(suffix) > max_length:
+                raise ValueError(
+                    f"Unique email {local_part}{suffix} can't be shortened to {max_length} characters"
+                )
+            values[row] = local_part[: max_length - len(suffix)] + suffix
+        return values.astype(str)
+
+    return generate_row_suffixed_email
+
+
+def _counter_based_generator(
+    generator: ColumnGenerator,
+    seed: int,
+    table_name: str,
+    column_name: str,
+    block_size: int = SEED_BLOCK_SIZE,
+) -> ColumnGenerator:
+    # The values of a column are generated in fixed blocks of rows, each from
+    # its own random stream, so the value of a row only depends on the seed,
+    # the column and the row index. The random generator of the caller is not
+    # used.
+    key = column_key(seed, table_name, column_name)
+
+    def generate_seeded(
+        rng: np.random.Generator, start_row: int, num_rows: int
+    ) -> np.ndarray:
+        first_block = start_row // block_size
+
+        if num_rows <= 0:
+            return generator(block_rng(key, first_block), start_row, 0)
+
+        last_block = (start_row + num_rows - 1) // block_size
+
+        blocks = [
+            generator(block_rng(key, block_index), block_index * block_size, block_size)
+            for block_index in range(first_block, last_block + 1)
+        ]
+        values = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+
+        offset = start_row - first_block * block_size
+        return values[offset : offset + num_rows]
+
+    generate_seeded.__name__ = getattr(generator, "__name__", "generate_seeded")
+    return generate_seeded
+
+
+def _resolve_generator(
+    table: TableNode, column: TableColumn, type_registry: TypeRegistry, truncate: bool = True
+) -> ValueGenerator:
+    if column.data_type in TEXT_TYPES:
+        generator = TEXT_GENERATORS.get(column.column_name, DEFAULT_TEXT_GENERATOR)
+        if truncate and column.max_length is not None:
+            generator = _truncating_generator(generator, column.max_length)
+        return generator
+
+    if column.data_type == "USER-DEFINED":
+        base_type = (
+            type_registry.resolve_base_type(column.sql_type)
+            if column.sql_type is not None
+            else None
+        )
+        if base_type is None or not base_type.is_enum:
+            raise ValueError(
+                f"User defined type {column.udt_name} not supported for column {column.column_name} in table {table.full_table_name}"
+            )
+
+        return _enum_generator(base_type.enum_labels)
+
+    if column.data_type in TYPE_GENERATORS:
+        return TYPE_GENERATORS[column.data_type]
+
+    raise ValueError(
+        f"Data type {column.data_type} not supported for column {column.column_name} in table {table.full_table_name}"
+    )
+
+
+class _ColumnCompiler:
+    # Turns columns of a table into column plans. The salt is added to the
+    # names the seeded streams are derived from, so that the same columns can
+    # be compiled again into different values (e.g. to retry collisions).
+
+    def __init__(
+        self,
+        table: TableNode,
+        key_pool: KeyPool,
+        type_registry: TypeRegistry,
+        unique_offsets: Optional[Dict[str, int]],
+        generate_auto_columns: bool,
+        seed: Optional[int],
+        deferred_columns: Optional[Collection[str]],
+        fan_outs: Dict[str, FanOut],
+    ):
+        self._table = table
+        self._key_pool = key_pool
+        self._type_registry = type_registry
+        self._unique_offsets = unique_offsets
+        self._generate_auto_columns = generate_auto_columns
+        self._seed = seed
+        self._deferred_columns = deferred_columns
+        self._fan_outs = fan_outs
+
+        # Child column -> (foreign key, position of the column in the key)
+        self._foreign_keys: Dict[str, Tuple[ForeignKeyConstraint, int]] = {}
+        for relationship in table.parent_relationships:
+            for position, child_column in enumerate(relationship.child_columns):
+                self._foreign_keys[child_column] = (relationship, position)
+
+    def get_foreign_key(self, column_name: str) -> Optional[ForeignKeyConstraint]:
+        if column_name not in self._foreign_keys:
+            return None
+        if self._deferred_columns is not None and column_name in self._deferred_columns:
+            return None
+        return self._foreign_keys[column_name][0]
+
+    def _key_sampler(self, relationship: ForeignKeyConstraint, salt: str) -> _KeySampler:
+        key_name = get_key_name(relationship.parent_columns)
+        fan_out = self._fan_outs.get(relationship.constraint_name)
+
+        unique_offset = None
+        if (
+            fan_out is not None
+            and fan_out.distribution == "fixed"
+            and self._unique_offsets is not None
+        ):
+            unique_offset = self._unique_offsets.get(relationship.constraint_name)
+
+        # Rows of a unique foreign key whose key was already taken by a row of
+        # the table pick another one at random
+        if salt and unique_offset is not None:
+            fan_out = None
+            unique_offset = None
+
+        index_generator = _key_index_generator(
+            relationship.parent_table, key_name, self._key_pool, fan_out, unique_offset
+        )
+        unique_check = (
+            _unique_key_check(relationship.parent_table, key_name, self._key_pool, fan_out)
+            if unique_offset is not None
+            else None
+        )
+        if self._seed is not None:
+            # Single column keys keep the stream of their column
+            stream_name = (
+                relationship.constraint_name
+                if relationship.is_composite
+                else relationship.child_column
+            )
+            index_generator = _counter_based_generator(
+                index_generator, self._seed, self._table.full_table_name, stream_name + salt
+            )
+        return _KeySampler(index_generator, unique_check)
+
+    def _value_generator(self, column: TableColumn) -> ColumnGenerator:
+        table = self._table
+        unique_offsets = self._unique_offsets
+
+        if self._deferred_columns is not None and column.column_name in self._deferred_columns:
+            if column.is_nullable:
+                return _column_generator(generate_nulls)
+            return _column_generator(_resolve_generator(table, column, self._type_registry))
+
+        if unique_offsets is not None and column.column_name in unique_offsets:
+            if column.data_type in SEQUENCE_TYPES:
+                return _sequence_generator(unique_offsets[column.column_name])
+
+            if column.data_type in TEXT_TYPES:
+                unique_generator = (
+                    _row_suffixed_email_generator
+                    if column.column_name == "email"
+                    else _row_suffixed_generator
+                )
+                return unique_generator(
+                    _resolve_generator(table, column, self._type_registry, truncate=False),
+                    column.max_length,
+                    unique_offsets[column.column_name],
+                )
+
+        generator = _resolve_generator(table, column, self._type_registry)
+
+        # Values follow the statistics of the column in the profile, if any
+        stats = get_column_stats(table.full_table_name, column.column_name)
+        if stats is not None:
+            generator = profile_generator(stats, column, generator)
+
+        return _column_generator(generator)
+
+    def compile(
+        self, column_names: Optional[Collection[str]] = None, salt: str = ""
+    ) -> List[ColumnPlan]:
+        table = self._table
+        samplers: Dict[str, _KeySampler] = {}
+        columns: List[ColumnPlan] = []
+
+        for column in table.columns:
+            if column_names is not None and column.column_name not in column_names:
+                continue
+
+            if self._generate_auto_columns and (column.is_serial or column.is_identity):
+                generator = _sequence_generator(0)
+            elif column.is_auto_generated:
+                continue  # Serial, identity and generated columns are filled by the database
+            elif self.get_foreign_key(column.column_name) is not None:
+                relationship, position = self._foreign_keys[column.column_name]
+                key_name = get_key_name(relationship.parent_columns)
+
+                if self._key_pool.get_num_keys(relationship.parent_table, key_name) == 0:
+                    # Fallback for empty parent tables
+                    if not column.is_nullable:
+                        raise ValueError(
+                            f"No rows in {relationship.parent_table} for the non nullable column {column.column_name} in table {table.full_table_name}"
+                        )
+
+                    logger.warning(
+                        "No rows in %s for %s.%s, filling it with NULLs",
+                        relationship.parent_table,
+                        table.full_table_name,
+                        column.column_name,
+                    )
+                    columns.append(
+                        ColumnPlan(column.column_name, _column_generator(generate_nulls))
+                    )
+                    continue
+
+                # Already seeded through its sampler
+                refresh = relationship.constraint_name not in samplers
+                if refresh:
+                    samplers[relationship.constraint_name] = self._key_sampler(
+                        relationship, salt
+                    )
+                columns.append(
+                    ColumnPlan(
+                        column.column_name,
+                        _foreign_key_generator(
+                            table.full_table_name,
+                            relationship.parent_table,
+                            key_name,
+                            position,
+                            self._key_pool,
+                            samplers[relationship.constraint_name],
+                            refresh,
+                        ),
+                    )
+                )
+                continue
+            else:
+                generator = self._value_generator(column)
+
+            if self._seed is not None:
+                generator = _counter_based_generator(
+                    generator, self._seed, table.full_table_name, column.column_name + salt
+                )
+            columns.append(ColumnPlan(column.column_name, generator))
+
+        return columns
+
+
+def _retry_columns(
+    compiler: _ColumnCompiler, column_names: List[str]
+) -> Callable[[int], List[ColumnPlan]]:
+    # Columns generated again when the values of a unique constraint collide:
+    # its own, and every column of the foreign keys they are part of so that
+    # composite keys stay whole. They are compiled once per attempt.
+    retry_names = set(column_names)
+    for column_name in column_names:
+        relationship = compiler.get_foreign_key(column_name)
+        if relationship is not None:
+            retry_names.update(relationship.child_columns)
+
+    attempts: Dict[int, List[ColumnPlan]] = {}
+
+    def get_retry_columns(attempt: int) -> List[ColumnPlan]:
+        if attempt not in attempts:
+            attempts[attempt] = compiler.compile(retry_names, f"/retry{attempt}")
+        return attempts[attempt]
+
+    return get_retry_columns
+
+
+def compile_table_plan(
+    table: TableNode,
+    key_pool: KeyPool,
+    type_registry: TypeRegistry,
+    unique_offsets: Optional[Dict[str, int]] = None,
+    generate_auto_columns: bool = False,
+    seed: Optional[int] = None,
+    deferred_columns: Optional[Collection[str]] = None,
+    column_names: Optional[Collection[str]] = None,
+    fan_outs: Optional[Dict[str, FanOut]] = None,
+    unique_filters: Optional[Dict[str, UniqueFilter]] = None,
+) -> TablePlan:
+    # Columns listed in unique_offsets are generated from the row index so
+    # they stay unique no matter how the rows are split up, as are the
+    # foreign keys listed by constraint name
+    # Without a database (generate_auto_columns) serial and identity columns
+    # are numbered by us, since nothing else would give their children keys
+    # With a seed every value is derived from (seed, table, column, row index)
+    # Foreign key columns are filled from the keys of their parents, except
+    # deferred_columns, which close a cycle and are patched after the load:
+    # they are NULL, or a placeholder of their type when they are NOT NULL
+    # With column_names, only those columns are generated
+    # fan_outs gives the distribution of the keys picked by a foreign key, by
+    # constraint name, they are uniform otherwise, or fixed to one child per
+    # key for foreign keys that are unique
+    # unique_filters holds, by constraint name, the values of the unique
+    # constraints that can collide (see get_checked_constraints), which are
+    # then checked on every batch
+    fan_outs = resolve_fan_outs(table, fan_outs)
+    compiler = _ColumnCompiler(
+        table,
+        key_pool,
+        type_registry,
+        unique_offsets,
+        generate_auto_columns,
+        seed,
+        deferred_columns,
+        fan_outs,
+    )
+    columns = compiler.compile(column_names)
+
+    unique_groups: List[UniqueGroup] = []
+    if unique_filters:
+        compiled_names = {column.column_name for column in columns}
+        for constraint in get_checked_constraints(
+            table, unique_offsets, fan_outs, deferred_columns
+        ):
+            if constraint.constraint_name not in unique_filters:
+                continue
+            # Left to the database, e.g. columns generated by SQL
+            if not set(constraint.column_names) <= compiled_names:
+                continue
+
+            unique_groups.append(
+                UniqueGroup(
+                    table,
+                    constraint,
+                    unique_filters[constraint.constraint_name],
+                    _retry_columns(compiler, constraint.column_names),
+                )
+            )
+
+    return TablePlan(table, columns, unique_groups)
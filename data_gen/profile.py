@@ -0,0 +1,457 @@
+import datetime
+import json
+import logging
+import pathlib
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from psycopg import Connection
+
+from data_gen.inspection import SYSTEM_SCHEMA_FILTER
+from data_gen.subset import TableFilter
+from data_gen.table_node import TableColumn
+
+PROFILE_VERSION = 1
+
+ValueGenerator = Callable[[np.random.Generator, int], np.ndarray]
+
+# Data types whose values are spread between the histogram bounds, the
+# others only take the values of the statistics
+_INTEGER_TYPES = ("bigint", "integer", "smallint")
+_FLOAT_TYPES = ("numeric", "real", "double precision")
+_TIMESTAMP_TYPES = ("timestamp", "timestamp with time zone", "timestamp without time zone")
+_TEXT_TYPES = ("text", "character varying", "character")
+
+_EPOCH_DATE = datetime.date(1970, 1, 1)
+
+# Timestamps as PostgreSQL prints them, e.g. 2020-01-01 00:00:00.5+00
+_TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?"
+    r"(?:([+-])(\d\d)(?::(\d\d))?(?::(\d\d))?)?"
+)
+
+logger = logging.getLogger(__name__)
+
+# Profile the generators of this process sample from, see set_profile
+_profile: Optional["Profile"] = None
+
+
+class ColumnStats:
+    # Distribution of the values of a column, as estimated by ANALYZE (see the
+    # pg_stats view). Values are kept in their text representation.
+
+    def __init__(
+        self,
+        null_frac: float = 0.0,
+        n_distinct: float = 0.0,
+        most_common_vals: Optional[List[str]] = None,
+        most_common_freqs: Optional[List[float]] = None,
+        histogram_bounds: Optional[List[str]] = None,
+        correlation: Optional[float] = None,
+    ):
+        most_common_vals = most_common_vals or []
+        most_common_freqs = most_common_freqs or []
+        if len(most_common_vals) != len(most_common_freqs):
+            raise ValueError(
+                f"{len(most_common_vals)} most common values with {len(most_common_freqs)} frequencies"
+            )
+
+        self._null_frac = null_frac
+        self._n_distinct = n_distinct
+        self._most_common_vals = most_common_vals
+        self._most_common_freqs = most_common_freqs
+        self._histogram_bounds = histogram_bounds or []
+        self._correlation = correlation
+
+    @property
+    def null_frac(self) -> float:
+        return self._null_frac
+
+    @property
+    def n_distinct(self) -> float:
+        # Number of distinct values, or minus their fraction of the rows when
+        # it grows with the table
+        return self._n_distinct
+
+    @property
+    def most_common_vals(self) -> List[str]:
+        return self._most_common_vals
+
+    @property
+    def most_common_freqs(self) -> List[float]:
+        return self._most_common_freqs
+
+    @property
+    def histogram_bounds(self) -> List[str]:
+        return self._histogram_bounds
+
+    @property
+    def correlation(self) -> Optional[float]:
+        return self._correlation
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "null_frac": self._null_frac,
+            "n_distinct": self._n_distinct,
+            "most_common_vals": self._most_common_vals,
+            "most_common_freqs": self._most_common_freqs,
+            "histogram_bounds": self._histogram_bounds,
+            "correlation": self._correlation,
+        }
+
+
+class Profile:
+    # Statistics of the columns of a database, by table and column name
+
+    def __init__(self):
+        self._tables: Dict[str, Dict[str, ColumnStats]] = {}
+
+    @property
+    def table_names(self) -> List[str]:
+        return list(self._tables)
+
+    @property
+    def num_columns(self) -> int:
+        return sum(len(columns) for columns in self._tables.values())
+
+    def add_stats(self, table_name: str, column_name: str, stats: ColumnStats):
+        self._tables.setdefault(table_name, {})[column_name] = stats
+
+    def get_stats(self, table_name: str, column_name: str) -> Optional[ColumnStats]:
+        return self._tables.get(table_name, {}).get(column_name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": PROFILE_VERSION,
+            "tables": {
+                table_name: {
+                    column_name: stats.to_dict() for column_name, stats in columns.items()
+                }
+                for table_name, columns in self._tables.items()
+            },
+        }
+
+
+def save_profile(profile: Profile, path: pathlib.Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as profile_file:
+        json.dump(profile.to_dict(), profile_file, indent=1)
+
+
+def load_profile(path: pathlib.Path) -> Profile:
+    with open(path, encoding="utf-8") as profile_file:
+        data = json.load(profile_file)
+
+    if data.get("version") != PROFILE_VERSION:
+        raise ValueError(
+            f"Profile {path} has version {data.get('version')}, expected {PROFILE_VERSION}"
+        )
+
+    profile = Profile()
+    for table_name, columns in data["tables"].items():
+        for column_name, stats_data in columns.items():
+            profile.add_stats(table_name, column_name, ColumnStats(**stats_data))
+
+    return profile
+
+
+def _parse_array(literal: Optional[str]) -> Optional[List[Optional[str]]]:
+    # Elements of a one dimensional array literal, e.g. {a,"b c",NULL}. The
+    # statistics are anyarray, which can only be read as text.
+    if literal is None:
+        return []
+    if not literal.startswith("{") or literal.startswith("{{"):
+        return None
+
+    elements: List[Optional[str]] = []
+    position = 1
+    while position < len(literal) - 1:
+        if literal[position] == '"':
+            characters: List[str] = []
+            position += 1
+            while literal[position] != '"':
+                if literal[position] == "\\":
+                    position += 1
+                characters.append(literal[position])
+                position += 1
+            elements.append("".join(characters))
+            position += 1
+        else:
+            end = literal.find(",", position)
+            if end == -1:
+                end = len(literal) - 1
+            element = literal[position:end]
+            elements.append(None if element == "NULL" else element)
+            position = end
+
+        # Skip the delimiter
+        position += 1
+
+    return elements
+
+
+def capture_profile(
+    db_connection: Connection, table_filter: Optional[TableFilter] = None
+) -> Profile:
+    # Reads the statistics of the last ANALYZE of every column. Partitioned
+    # and inheritance parents only have statistics of their whole hierarchy.
+    query = f"""
+        SELECT DISTINCT ON (s.schemaname, s.tablename, s.attname)
+            s.schemaname || '.' || s.tablename, s.attname, s.null_frac, s.n_distinct,
+            s.most_common_vals::text, s.most_common_freqs,
+            s.histogram_bounds::text, s.correlation
+        FROM pg_catalog.pg_stats s
+        JOIN pg_catalog.pg_namespace n ON n.nspname = s.schemaname
+        WHERE {SYSTEM_SCHEMA_FILTER}
+        ORDER BY s.schemaname, s.tablename, s.attname, s.inherited;
+    """
+    cursor = db_connection.cursor()
+    cursor.execute(query)
+
+    profile = Profile()
+    for (
+        table_name,
+        column_name,
+        null_frac,
+        n_distinct,
+        most_common_vals,
+        most_common_freqs,
+        histogram_bounds,
+        correlation,
+    ) in cursor.fetchall():
+        if table_filter is not None and not table_filter.matches(table_name):
+            continue
+
+        common_values = _parse_array(most_common_vals)
+        bounds = _parse_array(histogram_bounds)
+        if common_values is None or bounds is None:
+            logger.debug("Skipping statistics of %s.%s, arrays of arrays", table_name, column_name)
+            continue
+
+        profile.add_stats(
+            table_name,
+            column_name,
+            ColumnStats(
+                null_frac=null_frac,
+                n_distinct=n_distinct,
+                most_common_vals=common_values,
+                most_common_freqs=most_common_freqs or [],
+                histogram_bounds=bounds,
+                correlation=correlation,
+            ),
+        )
+
+    return profile
+
+
+def set_profile(profile: Optional[Profile]):
+    # The generators of the columns that have statistics in the profile
+    # sample their values from them, see profile_generator
+    global _profile
+    _profile = profile
+
+
+def get_profile() -> Optional[Profile]:
+    return _profile
+
+
+def get_column_stats(table_name: str, column_name: str) -> Optional[ColumnStats]:
+    if _profile is None:
+        return None
+    return _profile.get_stats(table_name, column_name)
+
+
+def _parse_timestamp(value: str) -> np.datetime64:
+    # Read by hand, since datetime.fromisoformat only reads offsets such as
+    # +00 and fractions of less than 6 digits from Python 3.11
+    match = _TIMESTAMP_PATTERN.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+
+    year, month, day, hour, minute, second = (int(part) for part in match.groups()[:6])
+    microsecond = int((match.group(7) or "").ljust(6, "0"))
+    timestamp = np.datetime64(
+        datetime.datetime(year, month, day, hour, minute, second, microsecond), "us"
+    )
+
+    # Timestamps with a time zone are kept in UTC
+    if match.group(8) is not None:
+        offset = np.timedelta64(
+            int(match.group(9)) * 3600
+            + int(match.group(10) or 0) * 60
+            + int(match.group(11) or 0),
+            "s",
+        )
+        timestamp = timestamp - offset if match.group(8) == "+" else timestamp + offset
+    return timestamp
+
+
+def _parse_value(value: str, data_type: str) -> Any:
+    if data_type in _INTEGER_TYPES:
+        return int(value)
+    if data_type in _FLOAT_TYPES:
+        return float(value)
+    if data_type == "date":
+        return np.datetime64(datetime.date.fromisoformat(value), "D")
+    if data_type in _TIMESTAMP_TYPES:
+        return _parse_timestamp(value)
+    if data_type == "boolean":
+        return value == "t"
+    return value
+
+
+def _parse_values(
+    values: List[Optional[str]], data_type: str, max_length: Optional[int]
+) -> Tuple[np.ndarray, List[int]]:
+    # Typed values, and the positions of the ones that could be read (e.g.
+    # not infinity, or a date BC)
+    parsed: List[Any] = []
+    positions: List[int] = []
+    for position, value in enumerate(values):
+        if value is None:
+            continue
+        try:
+            parsed_value = _parse_value(value, data_type)
+        except ValueError:
+            continue
+        if max_length is not None and data_type in _TEXT_TYPES:
+            parsed_value = parsed_value[:max_length]
+        parsed.append(parsed_value)
+        positions.append(position)
+
+    if data_type in _INTEGER_TYPES:
+        return np.asarray(parsed, dtype=np.int64), positions
+    if data_type in _FLOAT_TYPES:
+        return np.asarray(parsed, dtype=np.float64), positions
+    if data_type == "date":
+        return np.asarray(parsed, dtype="datetime64[D]"), positions
+    if data_type in _TIMESTAMP_TYPES:
+        return np.asarray(parsed, dtype="datetime64[us]"), positions
+    if data_type == "boolean":
+        return np.asarray(parsed, dtype=bool), positions
+    return np.asarray(parsed, dtype=object), positions
+
+
+def _to_axis(values: np.ndarray) -> np.ndarray:
+    # Dates and timestamps are interpolated as days and microseconds
+    if values.dtype.kind == "M":
+        values = values.astype(np.int64)
+    return values.astype(np.float64)
+
+
+def _from_axis(positions: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    if dtype.kind in "iM":
+        return np.rint(positions).astype(np.int64).astype(dtype)
+    return positions.astype(dtype)
+
+
+def _merge(parts: List[Tuple[np.ndarray, np.ndarray]], num_rows: int) -> np.ndarray:
+    # Puts the values of every part at its rows, in a common type
+    arrays = [values for _, values in parts if len(values) > 0]
+    try:
+        dtype = np.result_type(*arrays) if arrays else np.dtype(object)
+    except TypeError:
+        dtype = np.dtype(object)
+
+    merged = np.empty(num_rows, dtype=dtype)
+    for rows, values in parts:
+        merged[rows] = values
+    return merged
+
+
+class _StatsSampler:
+    # Draws the values of a column from its statistics in one go per batch:
+    # NULLs in proportion of null_frac, the most common values with their
+    # frequencies, and the rest from the histogram, interpolated between its
+    # bounds for numbers and dates. A column with a fixed number of distinct
+    # values (positive n_distinct) only takes that many values. What the
+    # statistics don't describe comes from the generator of the column.
+
+    def __init__(self, stats: ColumnStats, column: TableColumn, generator: ValueGenerator):
+        data_type = column.data_type
+        self._generator = generator
+
+        common_values, positions = _parse_values(
+            stats.most_common_vals, data_type, column.max_length
+        )
+        frequencies = np.asarray(stats.most_common_freqs, dtype=np.float64)[positions]
+
+        # A NOT NULL column leaves the share of the NULLs to the other values
+        null_frac = min(max(stats.null_frac, 0.0), 1.0)
+        if not column.is_nullable:
+            frequencies = frequencies / (1.0 - null_frac) if null_frac < 1.0 else frequencies
+            null_frac = 0.0
+
+        bounds, _ = _parse_values(stats.histogram_bounds, data_type, column.max_length)
+        distinct_rest = 0
+        if stats.n_distinct > 0:
+            distinct_rest = max(round(stats.n_distinct) - len(common_values), 0)
+
+            # Every value is a common one, there is nothing else to draw
+            if distinct_rest == 0 and len(common_values) > 0:
+                frequencies = frequencies * (1.0 - null_frac) / frequencies.sum()
+
+        self._null_frac = null_frac
+        self._common_values = common_values
+        self._common_bounds = null_frac + np.cumsum(frequencies)
+        self._distinct_rest = distinct_rest
+
+        # The rest of the values, between the bounds of the histogram
+        self._axis: Optional[np.ndarray] = None
+        self._bound_values: Optional[np.ndarray] = None
+        if len(bounds) >= 2 and bounds.dtype.kind in "iufM":
+            self._axis = _to_axis(bounds)
+            self._dtype = bounds.dtype
+        elif 0 < distinct_rest <= len(bounds):
+            # As many values as there are distinct ones, evenly spread
+            picks = np.rint(np.linspace(0, len(bounds) - 1, distinct_rest)).astype(np.int64)
+            self._bound_values = bounds[picks]
+
+    def _sample_rest(self, rng: np.random.Generator, num_rows: int) -> np.ndarray:
+        if self._axis is not None:
+            if self._distinct_rest > 0:
+                slots = rng.integers(0, self._distinct_rest, size=num_rows)
+                quantiles = (slots + 0.5) / self._distinct_rest
+            else:
+                quantiles = rng.random(num_rows)
+            grid = np.linspace(0.0, 1.0, len(self._axis))
+            return _from_axis(np.interp(quantiles, grid, self._axis), self._dtype)
+
+        if self._bound_values is not None:
+            return self._bound_values[rng.integers(0, len(self._bound_values), size=num_rows)]
+
+        return self._generator(rng, num_rows)
+
+    def sample(self, rng: np.random.Generator, num_rows: int) -> np.ndarray:
+        draws = rng.random(num_rows)
+        null_rows = np.flatnonzero(draws < self._null_frac)
+
+        common_upper = self._common_bounds[-1] if len(self._common_bounds) else self._null_frac
+        is_common = (draws >= self._null_frac) & (draws < common_upper)
+        common_rows = np.flatnonzero(is_common)
+        rest_rows = np.flatnonzero(draws >= common_upper)
+
+        indices = np.searchsorted(self._common_bounds, draws[common_rows], side="right")
+        parts = [
+            (common_rows, self._common_values[indices]),
+            (rest_rows, self._sample_rest(rng, len(rest_rows))),
+        ]
+        values = _merge(parts, num_rows)
+
+        if len(null_rows) > 0:
+            values = values.astype(object)
+            values[null_rows] = None
+        return values
+
+
+def profile_generator(
+    stats: ColumnStats, column: TableColumn, generator: ValueGenerator
+) -> ValueGenerator:
+    sampler = _StatsSampler(stats, column, generator)
+
+    def generate_profiled(rng: np.random.Generator, num_rows: int) -> np.ndarray:
+        return sampler.sample(rng, num_rows)
+
+    generate_profiled.__name__ = f"profiled_{getattr(generator, '__name__', 'values')}"
+    return generate_profiled
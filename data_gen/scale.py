@@ -0,0 +1,299 @@
+import json
+import logging
+import pathlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_gen.depgraph import DepGraph
+from data_gen.parameters import ZIPF_EXPONENT_DEFAULT
+from data_gen.table_node import ForeignKeyConstraint, TableNode
+
+FAN_OUT_DISTRIBUTIONS = ("uniform", "zipf", "fixed")
+
+logger = logging.getLogger(__name__)
+
+
+class FanOut:
+    # How the rows of a child are spread over the keys of a parent, as the
+    # index of the parent key every child row picks:
+    # - uniform: any key with the same probability
+    # - zipf: the key of rank k with a probability proportional to k^-exponent,
+    #   the first keys being the most popular
+    # - fixed: children rows in a row for every key, in order
+
+    def __init__(
+        self,
+        distribution: str = "uniform",
+        exponent: float = ZIPF_EXPONENT_DEFAULT,
+        children: int = 1,
+    ):
+        if distribution not in FAN_OUT_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown fan-out distribution {distribution}, expected one of {', '.join(FAN_OUT_DISTRIBUTIONS)}"
+            )
+        if exponent <= 0:
+            raise ValueError(f"Zipf exponent must be positive, got {exponent}")
+        if children < 1:
+            raise ValueError(f"Number of children must be positive, got {children}")
+
+        self._distribution = distribution
+        self._exponent = float(exponent)
+        self._children = int(children)
+
+    @property
+    def distribution(self) -> str:
+        return self._distribution
+
+    @property
+    def exponent(self) -> float:
+        return self._exponent
+
+    @property
+    def children(self) -> int:
+        return self._children
+
+    def sample_indices(
+        self, rng: np.random.Generator, start_row: int, num_rows: int, num_keys: int
+    ) -> np.ndarray:
+        # Indices in [0, num_keys), computed in bulk without materializing the
+        # distribution, so the memory only depends on num_rows
+        if self._distribution == "fixed":
+            row_indices = np.arange(start_row, start_row + num_rows, dtype=np.int64)
+            return (row_indices // self._children) % num_keys
+
+        if self._distribution == "zipf":
+            # Inverse of the continuous distribution function over [1, num_keys + 1)
+            uniform = rng.random(num_rows)
+            if self._exponent == 1.0:
+                ranks = np.exp(uniform * np.log(num_keys + 1))
+            else:
+                power = 1.0 - self._exponent
+                ranks = ((float(num_keys + 1) ** power - 1.0) * uniform + 1.0) ** (
+                    1.0 / power
+                )
+            return np.minimum(ranks.astype(np.int64) - 1, num_keys - 1)
+
+        return rng.integers(0, num_keys, size=num_rows)
+
+    def __str__(self):
+        if self._distribution == "zipf":
+            return f"zipf({self._exponent})"
+        if self._distribution == "fixed":
+            return f"fixed({self._children})"
+        return self._distribution
+
+
+def _parse_fan_out(name: str, value: Any) -> FanOut:
+    if isinstance(value, str):
+        return FanOut(value)
+    if isinstance(value, dict):
+        unknown = set(value) - {"distribution", "exponent", "children"}
+        if unknown:
+            raise ValueError(f"Unknown fan-out settings of {name}: {', '.join(sorted(unknown))}")
+        return FanOut(
+            value.get("distribution", "uniform"),
+            value.get("exponent", ZIPF_EXPONENT_DEFAULT),
+            value.get("children", 1),
+        )
+
+    raise ValueError(f"Fan-out of {name} must be a distribution name or an object")
+
+
+class ScaleSpec:
+    # Number of rows of every table and fan-out of every foreign key. A table
+    # either has a number of rows, multiplied by the scale, or a number of
+    # rows per row of another table (usually a parent), which is already
+    # scaled. Tables without either get the default number of rows, scaled,
+    # or children x parent rows when one of their foreign keys has a fixed
+    # fan-out.
+
+    def __init__(
+        self,
+        scale: float = 1.0,
+        table_rows: Optional[Dict[str, int]] = None,
+        table_ratios: Optional[Dict[str, Tuple[Optional[str], float]]] = None,
+        fan_outs: Optional[Dict[str, FanOut]] = None,
+    ):
+        if scale <= 0:
+            raise ValueError(f"Scale must be positive, got {scale}")
+
+        self._scale = float(scale)
+        self._table_rows = table_rows if table_rows is not None else {}
+        # Table -> (table it is relative to, or its only parent, rows per row)
+        self._table_ratios = table_ratios if table_ratios is not None else {}
+        # "schema.table.column" or "schema.table.constraint" -> fan-out
+        self._fan_outs = fan_outs if fan_outs is not None else {}
+
+    @property
+    def scale(self) -> float:
+        return self._scale
+
+    @scale.setter
+    def scale(self, scale: float):
+        if scale <= 0:
+            raise ValueError(f"Scale must be positive, got {scale}")
+        self._scale = float(scale)
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any]) -> "ScaleSpec":
+        unknown = set(spec) - {"scale", "tables", "foreign_keys"}
+        if unknown:
+            raise ValueError(f"Unknown scale settings: {', '.join(sorted(unknown))}")
+
+        table_rows: Dict[str, int] = {}
+        table_ratios: Dict[str, Tuple[Optional[str], float]] = {}
+        for table_name, value in spec.get("tables", {}).items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                rows = value
+                table_rows[table_name] = rows
+            elif isinstance(value, dict) and "rows" in value:
+                rows = int(value["rows"])
+                table_rows[table_name] = rows
+            elif isinstance(value, dict) and "per_parent" in value:
+                rows = float(value["per_parent"])
+                table_ratios[table_name] = (value.get("parent"), rows)
+            else:
+                raise ValueError(
+                    f"Scale of {table_name} must be a number of rows, {{\"rows\": n}} or {{\"per_parent\": ratio}}"
+                )
+
+            if rows < 0:
+                raise ValueError(f"Number of rows of {table_name} can't be negative")
+
+        fan_outs = {
+            name: _parse_fan_out(name, value)
+            for name, value in spec.get("foreign_keys", {}).items()
+        }
+
+        return cls(spec.get("scale", 1.0), table_rows, table_ratios, fan_outs)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "ScaleSpec":
+        with open(path, encoding="utf-8") as spec_file:
+            return cls.from_dict(json.load(spec_file))
+
+    def get_fan_out(self, relationship: ForeignKeyConstraint) -> Optional[FanOut]:
+        # Set on the constraint, or on any of its columns
+        names = [f"{relationship.child_table}.{relationship.constraint_name}"]
+        names += [f"{relationship.child_table}.{column}" for column in relationship.child_columns]
+        for name in names:
+            if name in self._fan_outs:
+                return self._fan_outs[name]
+        return None
+
+    def get_fan_outs(self, table: TableNode) -> Dict[str, FanOut]:
+        # Constraint name -> fan-out of the foreign keys of the table
+        fan_outs: Dict[str, FanOut] = {}
+        for relationship in table.parent_relationships:
+            fan_out = self.get_fan_out(relationship)
+            if fan_out is not None:
+                fan_outs[relationship.constraint_name] = fan_out
+        return fan_outs
+
+    def _get_ratio(self, table: TableNode) -> Optional[Tuple[str, float]]:
+        if table.full_table_name in self._table_ratios:
+            relative_to, ratio = self._table_ratios[table.full_table_name]
+            if relative_to is not None:
+                return relative_to, ratio
+
+            parent_tables = sorted(
+                {
+                    relationship.parent_table
+                    for relationship in table.parent_relationships
+                    if relationship.parent_table != table.full_table_name
+                }
+            )
+            if len(parent_tables) != 1:
+                raise ValueError(
+                    f"Table {table.full_table_name} has {len(parent_tables)} parents, the scale spec has to name the one its rows are relative to"
+                )
+            return parent_tables[0], ratio
+
+        if table.full_table_name in self._table_rows:
+            return None
+
+        for relationship in table.parent_relationships:
+            fan_out = self.get_fan_out(relationship)
+            if (
+                fan_out is not None
+                and fan_out.distribution == "fixed"
+                and relationship.parent_table != table.full_table_name
+            ):
+                return relationship.parent_table, float(fan_out.children)
+
+        return None
+
+    def get_row_counts(self, dep_graph: DepGraph, num_rows: int) -> Dict[str, int]:
+        table_names = dep_graph.get_fill_order()
+        known_tables = set(table_names)
+
+        for table_name in list(self._table_rows) + list(self._table_ratios):
+            if table_name not in known_tables:
+                logger.warning("Table %s of the scale spec is not in the schema", table_name)
+        known_constraints = {
+            f"{relationship.child_table}.{name}"
+            for table_name in table_names
+            for relationship in dep_graph.get_table(table_name).parent_relationships
+            for name in [relationship.constraint_name] + relationship.child_columns
+        }
+        for name in self._fan_outs:
+            if name not in known_constraints:
+                logger.warning("Foreign key %s of the scale spec is not in the schema", name)
+
+        row_counts: Dict[str, int] = {}
+
+        def resolve(table_name: str, path: List[str]) -> int:
+            if table_name in row_counts:
+                return row_counts[table_name]
+            if table_name in path:
+                raise ValueError(
+                    f"Numbers of rows relative to each other: {' -> '.join(path + [table_name])}"
+                )
+            if table_name not in known_tables:
+                raise ValueError(f"Table {table_name} of the scale spec is not in the schema")
+
+            table = dep_graph.get_table(table_name)
+            ratio = self._get_ratio(table)
+            if ratio is not None:
+                relative_to, rows_per_row = ratio
+                count = round(resolve(relative_to, path + [table_name]) * rows_per_row)
+            else:
+                count = round(self._table_rows.get(table_name, num_rows) * self._scale)
+
+            row_counts[table_name] = count
+            return count
+
+        for table_name in table_names:
+            resolve(table_name, [])
+
+        return row_counts
+
+
+def get_row_counts(
+    dep_graph: DepGraph, num_rows: int, scale_spec: Optional[ScaleSpec]
+) -> Dict[str, int]:
+    # Without a spec every table gets num_rows
+    if scale_spec is None:
+        return {table_name: num_rows for table_name in dep_graph.get_fill_order()}
+    return scale_spec.get_row_counts(dep_graph, num_rows)
+
+
+def get_fan_outs(table: TableNode, scale_spec: Optional[ScaleSpec]) -> Dict[str, FanOut]:
+    if scale_spec is None:
+        return {}
+    return scale_spec.get_fan_outs(table)
+
+
+def load_scale_spec(
+    path: Optional[pathlib.Path], scale: Optional[float]
+) -> Optional[ScaleSpec]:
+    # The scale of the command line overrides the one of the file
+    if path is None and scale is None:
+        return None
+
+    scale_spec = ScaleSpec.load(path) if path is not None else ScaleSpec()
+    if scale is not None:
+        scale_spec.scale = scale
+
+    return scale_spec
@@ -0,0 +1,201 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from psycopg_pool import ConnectionPool
+
+from data_gen.data import fill_component
+from data_gen.depgraph import DepGraph
+from data_gen.fast_load import FastLoad
+from data_gen.journal import Journal
+from data_gen.key_pool import KeyPool
+from data_gen.key_source import KeySource
+from data_gen.metrics import get_metrics
+from data_gen.parameters import (
+    BATCH_SIZE_DEFAULT,
+    NUM_ROWS_DEFAULT,
+    SHARDS_DEFAULT,
+    TOP_UP_EXACT_COUNT_MAX,
+    WORKERS_DEFAULT,
+)
+from data_gen.scale import ScaleSpec, get_row_counts
+from data_gen.top_up import get_top_up
+
+logger = logging.getLogger(__name__)
+
+
+def _fill_component_task(
+    table_names: List[str],
+    dep_graph: DepGraph,
+    connection_pool: ConnectionPool,
+    key_pool: KeyPool,
+    rngs: List[np.random.Generator],
+    row_counts: Dict[str, int],
+    batch_size: int,
+    commit_per_batch: bool,
+    num_shards: int,
+    conninfo: Optional[str],
+    seed: Optional[int],
+    journal: Optional[Journal],
+    fast_load: Optional[FastLoad],
+    server_side: bool,
+    scale_spec: Optional[ScaleSpec],
+    start_rows: Dict[str, int],
+):
+    with connection_pool.connection() as db_connection:
+        fill_component(
+            table_names,
+            dep_graph,
+            db_connection,
+            key_pool,
+            rngs,
+            row_counts,
+            batch_size=batch_size,
+            commit_per_batch=commit_per_batch,
+            num_shards=num_shards,
+            conninfo=conninfo,
+            seed=seed,
+            journal=journal,
+            fast_load=fast_load,
+            server_side=server_side,
+            scale_spec=scale_spec,
+            start_rows=start_rows,
+        )
+
+
+def fill_tables_parallel(
+    dep_graph: DepGraph,
+    connection_pool: ConnectionPool,
+    num_workers: int = WORKERS_DEFAULT,
+    num_rows: int = NUM_ROWS_DEFAULT,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    commit_per_batch: bool = False,
+    num_shards: int = SHARDS_DEFAULT,
+    conninfo: Optional[str] = None,
+    seed: Optional[int] = None,
+    journal: Optional[Journal] = None,
+    fast_load: Optional[FastLoad] = None,
+    server_side: bool = False,
+    scale_spec: Optional[ScaleSpec] = None,
+    key_source: Optional[KeySource] = None,
+    top_up: bool = False,
+    exact_count_max: int = TOP_UP_EXACT_COUNT_MAX,
+):
+    if num_workers < 1:
+        raise ValueError(f"Number of workers must be positive, got {num_workers}")
+
+    # Validates that the graph can be filled at all. The tables of a cycle
+    # are filled together, by a single task.
+    components = dep_graph.get_components()
+    fill_order = [table_name for component in components for table_name in component]
+    row_counts = get_row_counts(dep_graph, num_rows, scale_spec)
+
+    # Only add the rows every table is missing, see fill_tables
+    start_rows: Dict[str, int] = {}
+    if top_up:
+        with connection_pool.connection() as db_connection:
+            row_counts, start_rows = get_top_up(
+                dep_graph, row_counts, db_connection, exact_count_max
+            )
+
+    component_names = [", ".join(component) for component in components]
+    component_of: Dict[str, int] = {
+        table_name: component_index
+        for component_index, component in enumerate(components)
+        for table_name in component
+    }
+
+    # Child components of every component
+    child_components: List[Set[int]] = [set() for _ in components]
+    for parent_table_name, child_table_name in dep_graph.edges():
+        parent_index = component_of[parent_table_name]
+        child_index = component_of[child_table_name]
+        if parent_index != child_index:
+            child_components[parent_index].add(child_index)
+
+    # Number of parents of every component that still have to be filled
+    pending_parents: List[int] = [0 for _ in components]
+    for children in child_components:
+        for child_index in children:
+            pending_parents[child_index] += 1
+    ready: List[int] = [
+        component_index
+        for component_index in range(len(components))
+        if pending_parents[component_index] == 0
+    ]
+
+    # Keys of the filled tables, shared by their children
+    key_pool = KeyPool(key_source)
+
+    # Every table gets its own independent random stream since numpy generators
+    # can't be shared between threads
+    seed_sequences = dict(
+        zip(fill_order, np.random.SeedSequence(seed).spawn(len(fill_order)))
+    )
+
+    running: Dict[Future, int] = {}
+    errors: List[BaseException] = []
+
+    metrics = get_metrics()
+    metrics.start_progress(sum(row_counts.values()))
+
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            while ready or running:
+                # Start every component whose parents are all filled, unless something
+                # already failed
+                while ready and not errors:
+                    component_index = ready.pop(0)
+                    logger.info("Scheduling tables: %s", component_names[component_index])
+                    future = executor.submit(
+                        _fill_component_task,
+                        components[component_index],
+                        dep_graph,
+                        connection_pool,
+                        key_pool,
+                        [
+                            np.random.default_rng(seed_sequences[table_name])
+                            for table_name in components[component_index]
+                        ],
+                        row_counts,
+                        batch_size,
+                        commit_per_batch,
+                        num_shards,
+                        conninfo,
+                        seed,
+                        journal,
+                        fast_load,
+                        server_side,
+                        scale_spec,
+                        start_rows,
+                    )
+                    running[future] = component_index
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    component_index = running.pop(future)
+
+                    error = future.exception()
+                    if error is not None:
+                        logger.error(
+                            "Failed to fill tables: %s: %s",
+                            component_names[component_index],
+                            error,
+                        )
+                        errors.append(error)
+                        continue
+
+                    # Children become ready once their last parent is filled
+                    for child_index in sorted(child_components[component_index]):
+                        pending_parents[child_index] -= 1
+                        if pending_parents[child_index] == 0:
+                            ready.append(child_index)
+    finally:
+        metrics.finish_progress()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,19 @@
+import hashlib
+
+import numpy as np
+
+
+def column_key(seed: int, table_name: str, column_name: str) -> int:
+    # Stable across processes and runs, unlike hash()
+    digest = hashlib.blake2b(
+        f"{seed}:{table_name}:{column_name}".encode("utf-8"), digest_size=16
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+def block_rng(key: int, block_index: int) -> np.random.Generator:
+    # Philox is counter based: every block starts at its own counter, 2**64
+    # draws apart, so a block is reached directly without drawing the ones
+    # before it
+    counter = np.array([0, block_index, 0, 0], dtype=np.uint64)
+    return np.random.Generator(np.random.Philox(counter=counter, key=key))
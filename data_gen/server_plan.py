@@ -0,0 +1,557 @@
+import logging
+from typing import Callable, Collection, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from psycopg import Connection, sql
+
+from data_gen.generators import TEXT_TYPES
+from data_gen.journal import RowRange
+from data_gen.key_pool import KeyPool
+from data_gen.loader import table_identifier
+from data_gen.metrics import get_metrics
+from data_gen.parameters import DATE_RANGE_END
+from data_gen.plan import SEQUENCE_TYPES, TablePlan, compile_table_plan
+from data_gen.profile import get_column_stats
+from data_gen.scale import FanOut
+from data_gen.seeding import column_key
+from data_gen.table_node import ForeignKeyConstraint, TableColumn, TableNode
+from data_gen.type_registry import TypeRegistry
+from data_gen.uniqueness import (
+    UniqueFilter,
+    check_unique_keys,
+    get_checked_constraints,
+    resolve_fan_outs,
+)
+
+# Expression of the index of the row in the table, counted from 0
+_ROW_INDEX = sql.SQL("r.row_index")
+
+logger = logging.getLogger(__name__)
+
+
+def _uniform(seed: Optional[int], key_name: Tuple[str, str], row_index: sql.Composable):
+    # Uniform double in [0, 1). With a seed it is a hash of the row index, so
+    # the value of a row does not depend on how the table is split up.
+    if seed is None:
+        return sql.SQL("random()")
+
+    key = column_key(seed, *key_name) % 2**63
+    return sql.SQL(
+        "(((hashint8extended({}, {}) >> 11) & 9007199254740991)::float8 / 9007199254740992)"
+    ).format(row_index, sql.Literal(key))
+
+
+def _cast_type(column: TableColumn) -> sql.SQL:
+    type_name = column.sql_type.formatted_name if column.sql_type is not None else column.data_type
+    # Without its length, character means character(1). Domains carry their
+    # own length.
+    is_domain = column.sql_type is not None and column.sql_type.is_domain
+    if column.max_length is not None and not is_domain:
+        type_name = f"{type_name}({column.max_length})"
+    return sql.SQL(type_name)
+
+
+class ServerPlan:
+    # A table compiled into a single INSERT ... SELECT, so its rows are
+    # generated by the database. Columns the database can't generate come from
+    # the Python plan of those columns, sent as arrays alongside. The keys of
+    # the parents are copied once into temporary tables that every statement
+    # looks up.
+
+    def __init__(
+        self,
+        table: TableNode,
+        column_names: List[str],
+        statement: sql.Composed,
+        fallback_plan: Optional[TablePlan],
+        parent_keys: Optional[List["_ParentKeys"]] = None,
+    ):
+        self._table = table
+        self._column_names = column_names
+        self._statement = statement
+        self._fallback_plan = fallback_plan
+        self._parent_keys = parent_keys if parent_keys is not None else []
+        self._num_keys: Dict[str, int] = {}
+
+    @property
+    def table(self) -> TableNode:
+        return self._table
+
+    @property
+    def column_names(self) -> List[str]:
+        return self._column_names
+
+    @property
+    def statement(self) -> sql.Composed:
+        return self._statement
+
+    @property
+    def has_fallback_columns(self) -> bool:
+        return self._fallback_plan is not None
+
+    def load_parent_keys(self, db_connection: Connection):
+        self._num_keys = {
+            keys.num_keys_name: keys.load(db_connection) for keys in self._parent_keys
+        }
+
+    def drop_parent_keys(self, db_connection: Connection):
+        for keys in self._parent_keys:
+            keys.drop(db_connection)
+        self._num_keys = {}
+
+    def insert_rows(
+        self,
+        db_connection: Connection,
+        rng: np.random.Generator,
+        start_row: int,
+        num_rows: int,
+    ) -> int:
+        if len(self._num_keys) != len(self._parent_keys):
+            raise ValueError(
+                f"The parent keys of {self._table.full_table_name} are not loaded"
+            )
+
+        for keys in self._parent_keys:
+            keys.check_num_keys(start_row + num_rows, self._num_keys[keys.num_keys_name])
+
+        parameters: Dict[str, object] = {"start_row": start_row, "num_rows": num_rows}
+        parameters.update(self._num_keys)
+
+        if self._fallback_plan is not None:
+            batch = self._fallback_plan.generate_batch(rng, start_row, num_rows)
+            for index, column in enumerate(self._fallback_plan.columns):
+                parameters[f"values_{index}"] = [
+                    None if value is None else str(value)
+                    for value in np.asarray(batch[column.column_name]).tolist()
+                ]
+
+        cursor = db_connection.cursor()
+        cursor.execute(self._statement, parameters)
+        return cursor.rowcount
+
+    def __str__(self):
+        return f"Server plan: {self._table.full_table_name}\n{self._statement.as_string(None)}\n"
+
+
+def is_server_type(column: TableColumn, type_registry: TypeRegistry) -> bool:
+    if column.data_type == "USER-DEFINED":
+        base_type = (
+            type_registry.resolve_base_type(column.sql_type)
+            if column.sql_type is not None
+            else None
+        )
+        return base_type is not None and base_type.is_enum
+
+    return column.data_type in _VALUE_EXPRESSIONS
+
+
+def _integer_expression(upper: int) -> Callable[[sql.Composable], sql.Composable]:
+    def expression(uniform: sql.Composable) -> sql.Composable:
+        return sql.SQL("floor({} * {})").format(uniform, sql.Literal(upper))
+
+    return expression
+
+
+def _bigint_expression(uniform: sql.Composable) -> sql.Composable:
+    return sql.SQL("floor({} * 9223372036854775807::float8)").format(uniform)
+
+
+def _boolean_expression(uniform: sql.Composable) -> sql.Composable:
+    return sql.SQL("{} < 0.5").format(uniform)
+
+
+def _date_expression(uniform: sql.Composable) -> sql.Composable:
+    # Same range as the Python generator: the epoch to the end of the range
+    return sql.SQL(
+        "DATE '1970-01-01' + floor({} * (DATE {} - DATE '1970-01-01' + 1))::int"
+    ).format(uniform, sql.Literal(DATE_RANGE_END))
+
+
+def _timestamp_expression(uniform: sql.Composable) -> sql.Composable:
+    return sql.SQL(
+        "TIMESTAMP '1970-01-01' + {} * (TIMESTAMP {} - TIMESTAMP '1970-01-01')"
+    ).format(uniform, sql.Literal(DATE_RANGE_END))
+
+
+def _json_expression(uniform: sql.Composable) -> sql.Composable:
+    return sql.Literal('{"key": "value"}')
+
+
+# Expression of a value of every data type, from a uniform double
+_VALUE_EXPRESSIONS: Dict[str, Callable[[sql.Composable], sql.Composable]] = {
+    "bigint": _bigint_expression,
+    "integer": _integer_expression(101),
+    "smallint": _integer_expression(101),
+    "numeric": _integer_expression(101),
+    "real": lambda uniform: uniform,
+    "double precision": lambda uniform: uniform,
+    "boolean": _boolean_expression,
+    "date": _date_expression,
+    "timestamp": _timestamp_expression,
+    "timestamp with time zone": _timestamp_expression,
+    "timestamp without time zone": _timestamp_expression,
+    "uuid": lambda uniform: sql.SQL("gen_random_uuid()"),
+    "json": _json_expression,
+    "jsonb": _json_expression,
+}
+
+
+def _value_expression(
+    table: TableNode,
+    column: TableColumn,
+    type_registry: TypeRegistry,
+    seed: Optional[int],
+) -> sql.Composable:
+    uniform = _uniform(seed, (table.full_table_name, column.column_name), _ROW_INDEX)
+
+    if column.data_type == "USER-DEFINED":
+        labels = type_registry.resolve_base_type(column.sql_type).enum_labels
+        if not labels:
+            return sql.NULL
+        return sql.SQL("({}::text[])[1 + floor({} * {})::int]").format(
+            sql.Literal(labels), uniform, sql.Literal(len(labels))
+        )
+
+    # gen_random_uuid() can't be seeded, a hash of the row index can
+    if column.data_type == "uuid" and seed is not None:
+        key = column_key(seed, table.full_table_name, column.column_name)
+        return sql.SQL("md5({} || ':' || {})::uuid").format(
+            sql.Literal(str(key)), _ROW_INDEX
+        )
+
+    return _VALUE_EXPRESSIONS[column.data_type](uniform)
+
+
+class _ParentKeys:
+    # Keys of a parent table copied into a temporary table, numbered from 1 in
+    # the order of the key, and the number every row picks in it, so
+    # composite keys stay whole. The copy is made once per table rather than
+    # by every statement.
+
+    def __init__(
+        self,
+        index: int,
+        relationship: ForeignKeyConstraint,
+        fan_out: Optional[FanOut],
+        unique_offset: Optional[int] = None,
+    ):
+        self._relationship = relationship
+        self._fan_out = fan_out
+        self._unique_offset = unique_offset
+        self._name = f"parent_{index}"
+        self._pick = f"pick_{index}"
+        self._num_keys_name = f"num_keys_{index}"
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def num_keys_name(self) -> str:
+        return self._num_keys_name
+
+    def _temp_table(self) -> sql.Identifier:
+        return sql.Identifier("pg_temp", f"data_gen_{self._name}")
+
+    def load(self, db_connection: Connection) -> int:
+        parent_columns = [sql.Identifier(name) for name in self._relationship.parent_columns]
+        schema_name, relation_name = self._relationship.parent_table.split(".", 1)
+
+        # A copy left by a failed fill of the same session is replaced
+        self.drop(db_connection)
+        cursor = db_connection.cursor()
+        cursor.execute(
+            sql.SQL(
+                "CREATE TEMPORARY TABLE {} AS "
+                "SELECT row_number() OVER (ORDER BY {})::int AS key_index, {} FROM {} WHERE {}"
+            ).format(
+                self._temp_table(),
+                sql.SQL(", ").join(parent_columns),
+                sql.SQL(", ").join(
+                    sql.SQL("{} AS {}").format(column, sql.Identifier(f"key_{i}"))
+                    for i, column in enumerate(parent_columns)
+                ),
+                sql.Identifier(schema_name, relation_name),
+                sql.SQL(" AND ").join(
+                    sql.SQL("{} IS NOT NULL").format(column) for column in parent_columns
+                ),
+            )
+        )
+        num_keys = cursor.rowcount
+
+        # Batches look their keys up by number
+        cursor.execute(
+            sql.SQL("ALTER TABLE {} ADD PRIMARY KEY (key_index)").format(self._temp_table())
+        )
+        cursor.execute(sql.SQL("ANALYZE {}").format(self._temp_table()))
+        return num_keys
+
+    def check_num_keys(self, num_rows: int, num_keys: int):
+        # Rows of a unique foreign key, up to the end of the batch
+        if self._unique_offset is not None:
+            check_unique_keys(self._relationship.parent_table, self._fan_out, num_rows, num_keys)
+
+    def drop(self, db_connection: Connection):
+        db_connection.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(self._temp_table()))
+
+    def join(self) -> sql.Composed:
+        return sql.SQL(" LEFT JOIN {} AS {} ON {}.key_index = r.{}").format(
+            self._temp_table(),
+            sql.Identifier(self._name),
+            sql.Identifier(self._name),
+            sql.Identifier(self._pick),
+        )
+
+    def pick(self, table: TableNode, seed: Optional[int], row_index: sql.Composable):
+        # Same distributions as FanOut.sample_indices. An empty parent gives
+        # number 1 or NULL, either way no key and a NULL foreign key.
+        num_keys = sql.SQL("{}::int").format(sql.Placeholder(self._num_keys_name))
+        uniform = _uniform(
+            seed, (table.full_table_name, self._relationship.constraint_name), row_index
+        )
+
+        if self._fan_out is not None and self._fan_out.distribution == "fixed":
+            # A unique foreign key picks the keys after those of the rows
+            # already in the table
+            if self._unique_offset:
+                row_index = sql.SQL("({} + {})").format(
+                    sql.Literal(self._unique_offset), row_index
+                )
+            index = sql.SQL("mod({} / {}, nullif({}, 0))").format(
+                row_index, sql.Literal(self._fan_out.children), num_keys
+            )
+        elif self._fan_out is not None and self._fan_out.distribution == "zipf":
+            if self._fan_out.exponent == 1.0:
+                rank = sql.SQL("exp({} * ln({} + 1))").format(uniform, num_keys)
+            else:
+                power = 1.0 - self._fan_out.exponent
+                rank = sql.SQL("power((power({} + 1, {}) - 1) * {} + 1, {})").format(
+                    num_keys, sql.Literal(power), uniform, sql.Literal(1.0 / power)
+                )
+            index = sql.SQL("least(floor({})::int - 1, {} - 1)").format(rank, num_keys)
+        else:
+            index = sql.SQL("floor({} * {})::int").format(uniform, num_keys)
+
+        return sql.SQL("1 + {} AS {}").format(index, sql.Identifier(self._pick))
+
+    def key(self, child_column: str) -> sql.Composed:
+        index = self._relationship.child_columns.index(child_column)
+        return sql.SQL("{}.{}").format(
+            sql.Identifier(self._name), sql.Identifier(f"key_{index}")
+        )
+
+
+def compile_server_plan(
+    table: TableNode,
+    key_pool: KeyPool,
+    type_registry: TypeRegistry,
+    unique_offsets: Optional[Dict[str, int]] = None,
+    seed: Optional[int] = None,
+    deferred_columns: Optional[Collection[str]] = None,
+    fan_outs: Optional[Dict[str, FanOut]] = None,
+    unique_filters: Optional[Dict[str, UniqueFilter]] = None,
+) -> ServerPlan:
+    # Same columns and rules as compile_table_plan. Without a seed the values
+    # come from random(), with a seed from a hash of (seed, table, column, row
+    # index), which differs from the values of the Python generators.
+    # Unique constraints that can collide are generated in Python, where they
+    # are checked against unique_filters.
+    deferred_columns = deferred_columns if deferred_columns is not None else []
+    fan_outs = resolve_fan_outs(table, fan_outs)
+
+    parents: Dict[str, _ParentKeys] = {}
+    parent_keys: List[_ParentKeys] = []
+    for relationship in table.parent_relationships:
+        if any(column in deferred_columns for column in relationship.child_columns):
+            continue
+        fan_out = fan_outs.get(relationship.constraint_name)
+        unique_offset = None
+        if (
+            fan_out is not None
+            and fan_out.distribution == "fixed"
+            and unique_offsets is not None
+        ):
+            unique_offset = unique_offsets.get(relationship.constraint_name)
+        keys = _ParentKeys(len(parent_keys), relationship, fan_out, unique_offset)
+        parent_keys.append(keys)
+        for child_column in relationship.child_columns:
+            parents[child_column] = keys
+
+    checked_columns: Set[str] = set()
+    if unique_filters:
+        for constraint in get_checked_constraints(
+            table, unique_offsets, fan_outs, deferred_columns
+        ):
+            if any(column in parents for column in constraint.column_names):
+                logger.warning(
+                    "Unique constraint %s of %s includes foreign keys picked by the database, its values are not checked",
+                    constraint.constraint_name,
+                    table.full_table_name,
+                )
+                continue
+            checked_columns.update(constraint.column_names)
+
+    column_names: List[str] = []
+    expressions: List[sql.Composable] = []
+    fallback_columns: List[str] = []
+
+    for column in table.columns:
+        if column.is_auto_generated:
+            continue  # Serial, identity and generated columns are filled by the database
+
+        column_names.append(column.column_name)
+        cast_type = _cast_type(column)
+
+        if column.column_name in deferred_columns:
+            if column.is_nullable:
+                expressions.append(sql.NULL)
+                continue
+        elif column.column_name in parents:
+            expressions.append(parents[column.column_name].key(column.column_name))
+            continue
+
+        if unique_offsets is not None and column.column_name in unique_offsets:
+            if column.data_type in SEQUENCE_TYPES:
+                expressions.append(
+                    sql.SQL("({} + {} + 1)::{}").format(
+                        sql.Literal(unique_offsets[column.column_name]),
+                        _ROW_INDEX,
+                        cast_type,
+                    )
+                )
+                continue
+
+        if (
+            column.data_type in TEXT_TYPES
+            or column.column_name in checked_columns
+            or not is_server_type(column, type_registry)
+            or get_column_stats(table.full_table_name, column.column_name) is not None
+        ):
+            expressions.append(
+                sql.SQL("r.{}::{}").format(
+                    sql.Identifier(f"values_{len(fallback_columns)}"), cast_type
+                )
+            )
+            fallback_columns.append(column.column_name)
+            continue
+
+        expressions.append(
+            sql.SQL("({})::{}").format(
+                _value_expression(table, column, type_registry, seed), cast_type
+            )
+        )
+
+    # Rows come from generate_series, or from the arrays of the columns made
+    # in Python, which are numbered the same way
+    if fallback_columns:
+        source = sql.SQL("unnest({}) WITH ORDINALITY AS g({}, i)").format(
+            sql.SQL(", ").join(
+                sql.SQL("{}::text[]").format(sql.Placeholder(f"values_{index}"))
+                for index in range(len(fallback_columns))
+            ),
+            sql.SQL(", ").join(
+                sql.Identifier(f"values_{index}") for index in range(len(fallback_columns))
+            ),
+        )
+    else:
+        source = sql.SQL("generate_series(1, {}) AS g(i)").format(
+            sql.Placeholder("num_rows")
+        )
+
+    row_index = sql.SQL("({} + g.i - 1)").format(sql.Placeholder("start_row"))
+    inner_columns = [sql.SQL("{} AS row_index").format(row_index)]
+    inner_columns += [
+        sql.SQL("g.{0} AS {0}").format(sql.Identifier(f"values_{index}"))
+        for index in range(len(fallback_columns))
+    ]
+    inner_columns += [keys.pick(table, seed, row_index) for keys in parent_keys]
+
+    statement = sql.SQL(
+        "INSERT INTO {table} ({columns}) "
+        "SELECT {expressions} FROM (SELECT {inner_columns} FROM {source}) AS r{parents}"
+    ).format(
+        table=table_identifier(table),
+        columns=sql.SQL(", ").join(sql.Identifier(name) for name in column_names),
+        expressions=sql.SQL(", ").join(expressions),
+        inner_columns=sql.SQL(", ").join(inner_columns),
+        source=source,
+        parents=sql.SQL("").join(keys.join() for keys in parent_keys),
+    )
+
+    fallback_plan = None
+    if fallback_columns:
+        logger.debug(
+            "Generating %s of %s in Python", ", ".join(fallback_columns), table.full_table_name
+        )
+        fallback_plan = compile_table_plan(
+            table,
+            key_pool,
+            type_registry,
+            unique_offsets,
+            seed=seed,
+            deferred_columns=deferred_columns,
+            column_names=fallback_columns,
+            fan_outs=fan_outs,
+            unique_filters=unique_filters,
+        )
+
+    return ServerPlan(table, column_names, statement, fallback_plan, parent_keys)
+
+
+def insert_ranges(
+    plan: ServerPlan,
+    db_connection: Connection,
+    rng: np.random.Generator,
+    ranges: List[RowRange],
+    batch_size: int,
+    commit_per_batch: bool = False,
+    before_commit: Optional[Callable[[Connection, int], None]] = None,
+    commit: bool = True,
+) -> int:
+    # Every range is inserted by a single statement, unless the batches are
+    # committed separately or carry values generated in Python, which are
+    # then sent batch_size rows at a time. The transactions work as in
+    # copy_batches.
+    table_name = plan.table.full_table_name
+    metrics = get_metrics()
+    split = commit_per_batch or plan.has_fallback_columns
+    total_rows = 0
+
+    # Tables where every column is generated by the database have nothing
+    # to insert
+    if not plan.column_names:
+        return 0
+
+    try:
+        with metrics.timer(table_name, "load"):
+            plan.load_parent_keys(db_connection)
+
+        for range_start, range_rows in ranges:
+            chunk_size = batch_size if split else max(range_rows, 1)
+            for chunk_start in range(range_start, range_start + range_rows, chunk_size):
+                num_rows = min(chunk_size, range_start + range_rows - chunk_start)
+
+                with metrics.timer(table_name, "load"):
+                    inserted_rows = plan.insert_rows(db_connection, rng, chunk_start, num_rows)
+
+                    if before_commit is not None:
+                        before_commit(db_connection, inserted_rows)
+
+                    if commit and commit_per_batch:
+                        db_connection.commit()
+
+                total_rows += inserted_rows
+                metrics.merge(
+                    table_name, {"rows_loaded": inserted_rows, "statements": 1}
+                )
+                metrics.advance_progress(inserted_rows)
+
+        with metrics.timer(table_name, "load"):
+            plan.drop_parent_keys(db_connection)
+            if commit:
+                db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+
+    return total_rows
@@ -0,0 +1,393 @@
+import logging
+import multiprocessing
+import pathlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import psycopg
+from psycopg import AsyncConnection, Connection, sql
+
+from data_gen.generators import TEXT_TYPES
+from data_gen.journal import Journal, RowRange, subtract_ranges
+from data_gen.key_pool import CompositeKeys, KeyPool, KeyRange, get_key_name
+from data_gen.loader import copy_batches, table_identifier
+from data_gen.metrics import get_metrics
+from data_gen.parameters import BATCH_SIZE_DEFAULT
+from data_gen.plan import SEQUENCE_TYPES, compile_table_plan
+from data_gen.profile import Profile, get_profile, set_profile
+from data_gen.scale import FanOut
+from data_gen.table_node import TableColumn, TableNode
+from data_gen.type_registry import TypeRegistry
+from data_gen.uniqueness import get_unique_foreign_keys
+from data_gen.value_pools import get_pool_file, set_pool_file
+
+# (kind, shared memory name, values or first key, number of keys)
+KeyDescriptor = Tuple[str, Any, int]
+
+logger = logging.getLogger(__name__)
+
+
+class SharedKeySource:
+    # Read-only copy of the parent keys that the shard processes attach to.
+    # Integer keys are placed in shared memory so they are not copied into
+    # every process, other keys (and composite keys) are pickled once per
+    # process. Ranges of keys are passed as their bounds.
+
+    def __init__(self):
+        self._segments: List[SharedMemory] = []
+        self._descriptors: Dict[Tuple[str, str], KeyDescriptor] = {}
+
+    @property
+    def descriptors(self) -> Dict[Tuple[str, str], KeyDescriptor]:
+        return self._descriptors
+
+    def add_keys(self, table_name: str, column_name: str, key_pool: KeyPool):
+        keys = key_pool.get_keys(table_name, column_name)
+
+        if isinstance(keys, KeyRange):
+            self._descriptors[(table_name, column_name)] = ("range", keys.first, len(keys))
+            return
+
+        if isinstance(keys, CompositeKeys):
+            self._descriptors[(table_name, column_name)] = ("composite", keys, len(keys))
+            return
+
+        if isinstance(keys, array) or (
+            isinstance(keys, np.ndarray) and keys.dtype == np.int64
+        ):
+            values = np.frombuffer(keys, dtype=np.int64) if isinstance(keys, array) else keys
+            segment = SharedMemory(create=True, size=max(values.nbytes, 1))
+            self._segments.append(segment)
+            np.ndarray(values.shape, dtype=np.int64, buffer=segment.buf)[:] = values
+            self._descriptors[(table_name, column_name)] = (
+                "shared",
+                segment.name,
+                len(values),
+            )
+            return
+
+        self._descriptors[(table_name, column_name)] = ("values", list(keys), len(keys))
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self._segments = []
+
+
+# State of a shard process, set up once by _init_shard_worker
+_worker_state: Dict[str, Any] = {}
+
+
+def _attach_key_pool(descriptors: Dict[Tuple[str, str], KeyDescriptor]) -> KeyPool:
+    key_pool = KeyPool()
+    segments: List[SharedMemory] = []
+
+    for (table_name, column_name), (kind, source, num_keys) in descriptors.items():
+        if kind == "range":
+            key_pool.set_keys(table_name, column_name, KeyRange(source, num_keys))
+            continue
+
+        if kind == "composite":
+            key_pool.set_keys(table_name, column_name, source)
+            continue
+
+        if kind == "shared":
+            segment = SharedMemory(name=source)
+            segments.append(segment)
+            keys = np.ndarray((num_keys,), dtype=np.int64, buffer=segment.buf)
+            keys.flags.writeable = False
+        else:
+            keys = np.asarray(source, dtype=object)
+
+        key_pool.set_keys(table_name, column_name, keys)
+
+    # The segments have to stay mapped for as long as the keys are used
+    _worker_state["segments"] = segments
+
+    return key_pool
+
+
+def _init_shard_worker(
+    conninfo: str,
+    table: TableNode,
+    type_registry: TypeRegistry,
+    key_descriptors: Dict[Tuple[str, str], KeyDescriptor],
+    unique_offsets: Dict[str, int],
+    batch_size: int,
+    commit_per_batch: bool,
+    seed: Optional[int],
+    value_pool_file: Optional[pathlib.Path],
+    journal: Optional[Journal],
+    fan_outs: Optional[Dict[str, FanOut]],
+    profile: Optional[Profile],
+):
+    # The pools built by the parent process are read from its pool file
+    set_pool_file(value_pool_file)
+    set_profile(profile)
+
+    key_pool = _attach_key_pool(key_descriptors)
+
+    _worker_state["conninfo"] = conninfo
+    _worker_state["table"] = table
+    _worker_state["plan"] = compile_table_plan(
+        table, key_pool, type_registry, unique_offsets, seed=seed, fan_outs=fan_outs
+    )
+    _worker_state["batch_size"] = batch_size
+    _worker_state["commit_per_batch"] = commit_per_batch
+    _worker_state["journal"] = journal
+
+
+def _fill_shard(
+    shard_index: int,
+    ranges: List[RowRange],
+    seed_sequence: np.random.SeedSequence,
+) -> Tuple[int, Dict[str, float]]:
+    # Returns the number of rows loaded and the metrics of the shard, which
+    # the parent process adds to its own. A resumed shard only loads the
+    # ranges of its rows that are not committed yet.
+    table: TableNode = _worker_state["table"]
+    logger.info(
+        "Filling shard %d of %s: rows %s",
+        shard_index,
+        table.full_table_name,
+        ", ".join(f"{start_row} to {start_row + num_rows}" for start_row, num_rows in ranges),
+    )
+
+    metrics = get_metrics()
+    metrics.reset()
+
+    rng = np.random.default_rng(seed_sequence)
+    plan = _worker_state["plan"]
+    batches = metrics.timed_batches(
+        table.full_table_name,
+        (
+            batch
+            for start_row, num_rows in ranges
+            for batch in plan.iter_batches(
+                rng, num_rows, _worker_state["batch_size"], start_row
+            )
+        ),
+    )
+
+    journal: Optional[Journal] = _worker_state["journal"]
+    before_commit = (
+        journal.batch_recorder(table.full_table_name, ranges)
+        if journal is not None
+        else None
+    )
+
+    with psycopg.connect(_worker_state["conninfo"]) as db_connection:
+        loaded_rows = copy_batches(
+            table,
+            batches,
+            db_connection,
+            commit_per_batch=_worker_state["commit_per_batch"],
+            before_commit=before_commit,
+        )
+
+    return loaded_rows, metrics.get(table.full_table_name)
+
+
+def get_unique_columns(table: TableNode) -> List[TableColumn]:
+    # Single column unique keys that are generated by us, which are
+    # partitioned by row index
+    foreign_key_columns = {
+        child_column
+        for relationship in table.parent_relationships
+        for child_column in relationship.child_columns
+    }
+
+    unique_columns: List[TableColumn] = []
+
+    for constraint in table.unique_constraints:
+        if len(constraint.column_names) != 1:
+            continue
+
+        column = table.get_column(constraint.column_names[0])
+        if column.is_auto_generated or column.column_name in foreign_key_columns:
+            continue
+
+        if column.data_type in SEQUENCE_TYPES or column.data_type in TEXT_TYPES:
+            unique_columns.append(column)
+
+    return unique_columns
+
+
+def _max_value_query(table: TableNode, column: TableColumn) -> sql.Composed:
+    return sql.SQL("SELECT COALESCE(max({}), 0) FROM {}").format(
+        sql.Identifier(column.column_name), table_identifier(table)
+    )
+
+
+def _row_count_query(table: TableNode) -> sql.Composed:
+    return sql.SQL("SELECT count(*) FROM {}").format(table_identifier(table))
+
+
+def _sequence_offset(max_value: int, start_row: int) -> int:
+    # Row start_row gets the value just above the largest one, as it would
+    # have if the rows before it had been numbered from the same offset
+    return max_value - min(start_row, max(max_value, 0))
+
+
+def get_unique_offsets(
+    table: TableNode, db_connection: Connection, start_row: int = 0
+) -> Dict[str, int]:
+    # Sequences start above the largest existing value, text is suffixed from
+    # the number of existing rows, counted once for all its columns, and
+    # unique foreign keys (by constraint name) pick the parent keys after as
+    # many as there are existing rows
+    unique_offsets: Dict[str, int] = {}
+    cursor = db_connection.cursor()
+    num_rows: Optional[int] = None
+
+    for column in get_unique_columns(table):
+        if column.data_type in SEQUENCE_TYPES:
+            cursor.execute(_max_value_query(table, column))
+            unique_offsets[column.column_name] = _sequence_offset(
+                int(cursor.fetchone()[0]), start_row
+            )
+        else:
+            if num_rows is None:
+                cursor.execute(_row_count_query(table))
+                num_rows = int(cursor.fetchone()[0])
+            unique_offsets[column.column_name] = _sequence_offset(num_rows, start_row)
+
+    for relationship in get_unique_foreign_keys(table):
+        if num_rows is None:
+            cursor.execute(_row_count_query(table))
+            num_rows = int(cursor.fetchone()[0])
+        unique_offsets[relationship.constraint_name] = _sequence_offset(num_rows, start_row)
+
+    return unique_offsets
+
+
+async def get_unique_offsets_async(
+    table: TableNode, db_connection: AsyncConnection, start_row: int = 0
+) -> Dict[str, int]:
+    unique_offsets: Dict[str, int] = {}
+    cursor = db_connection.cursor()
+    num_rows: Optional[int] = None
+
+    for column in get_unique_columns(table):
+        if column.data_type in SEQUENCE_TYPES:
+            await cursor.execute(_max_value_query(table, column))
+            unique_offsets[column.column_name] = _sequence_offset(
+                int((await cursor.fetchone())[0]), start_row
+            )
+        else:
+            if num_rows is None:
+                await cursor.execute(_row_count_query(table))
+                num_rows = int((await cursor.fetchone())[0])
+            unique_offsets[column.column_name] = _sequence_offset(num_rows, start_row)
+
+    for relationship in get_unique_foreign_keys(table):
+        if num_rows is None:
+            await cursor.execute(_row_count_query(table))
+            num_rows = int((await cursor.fetchone())[0])
+        unique_offsets[relationship.constraint_name] = _sequence_offset(num_rows, start_row)
+
+    return unique_offsets
+
+
+def split_shards(
+    num_rows: int, num_shards: int, first_row: int = 0
+) -> List[Tuple[int, int]]:
+    # (start row, number of rows) of every shard
+    shard_size, remainder = divmod(num_rows, num_shards)
+
+    shards: List[Tuple[int, int]] = []
+    start_row = first_row
+    for shard_index in range(num_shards):
+        shard_rows = shard_size + (1 if shard_index < remainder else 0)
+        if shard_rows > 0:
+            shards.append((start_row, shard_rows))
+        start_row += shard_rows
+
+    return shards
+
+
+def fill_table_sharded(
+    table: TableNode,
+    type_registry: TypeRegistry,
+    db_connection: Connection,
+    conninfo: str,
+    key_pool: KeyPool,
+    rng: np.random.Generator,
+    num_rows: int,
+    num_shards: int,
+    batch_size: int = BATCH_SIZE_DEFAULT,
+    commit_per_batch: bool = False,
+    unique_offsets: Optional[Dict[str, int]] = None,
+    seed: Optional[int] = None,
+    journal: Optional[Journal] = None,
+    committed_ranges: Optional[List[RowRange]] = None,
+    fan_outs: Optional[Dict[str, FanOut]] = None,
+    start_row: int = 0,
+) -> int:
+    if num_shards < 1:
+        raise ValueError(f"Number of shards must be positive, got {num_shards}")
+
+    if unique_offsets is None:
+        unique_offsets = get_unique_offsets(table, db_connection, start_row)
+
+    # The shards of a resumed table keep their rows, minus those already
+    # committed by the previous run
+    shards = [
+        subtract_ranges(shard_start, shard_rows, committed_ranges or [])
+        for shard_start, shard_rows in split_shards(num_rows, num_shards, start_row)
+    ]
+
+    # Every shard gets its own seed, derived from the random stream of the table
+    seed_sequences = np.random.SeedSequence(int(rng.integers(0, 2**63 - 1))).spawn(
+        len(shards)
+    )
+
+    key_source = SharedKeySource()
+    try:
+        for relationship in table.parent_relationships:
+            key_source.add_keys(
+                relationship.parent_table, get_key_name(relationship.parent_columns), key_pool
+            )
+
+        with ProcessPoolExecutor(
+            max_workers=len(shards),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_shard_worker,
+            initargs=(
+                conninfo,
+                table,
+                type_registry,
+                key_source.descriptors,
+                unique_offsets,
+                batch_size,
+                commit_per_batch,
+                seed,
+                get_pool_file(),
+                journal,
+                fan_outs,
+                get_profile(),
+            ),
+        ) as executor:
+            futures = [
+                executor.submit(_fill_shard, shard_index, ranges, seed_sequence)
+                for shard_index, (ranges, seed_sequence) in enumerate(
+                    zip(shards, seed_sequences)
+                )
+                if ranges
+            ]
+
+            loaded_rows = 0
+            metrics = get_metrics()
+            for future in futures:
+                shard_rows, shard_metrics = future.result()
+                loaded_rows += shard_rows
+                metrics.merge(table.full_table_name, shard_metrics)
+                metrics.advance_progress(shard_rows)
+
+            return loaded_rows
+    finally:
+        key_source.close()
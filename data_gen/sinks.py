@@ -0,0 +1,586 @@
+import gzip
+import pathlib
+import struct
+import time
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from psycopg import Connection
+
+from data_gen.loader import ColumnBatch, copy_batches
+from data_gen.metrics import get_metrics
+from data_gen.parameters import COMPRESSIONS, OUTPUT_FORMATS
+from data_gen.table_node import TableNode
+
+_COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_BINARY_TRAILER = struct.pack(">h", -1)
+
+_POSTGRES_EPOCH_DATE = np.datetime64("2000-01-01", "D")
+_POSTGRES_EPOCH_TIMESTAMP = np.datetime64("2000-01-01T00:00:00", "us")
+
+
+class Sink(ABC):
+    # Destination of the generated batches of every table
+
+    @abstractmethod
+    def write_table(self, table: TableNode, batches: Iterable[ColumnBatch]) -> int: ...
+
+    @abstractmethod
+    def write_statements(self, statements: List[str]):
+        # SQL run between the tables, in the same transaction
+        ...
+
+    def close(self):
+        pass
+
+
+class DatabaseSink(Sink):
+
+    def __init__(
+        self,
+        db_connection: Connection,
+        commit_per_batch: bool = False,
+        before_commit: Optional[Callable[[Connection, int], None]] = None,
+        commit: bool = True,
+    ):
+        self._db_connection = db_connection
+        self._commit_per_batch = commit_per_batch
+        self._before_commit = before_commit
+        self._commit = commit
+
+    def write_table(self, table: TableNode, batches: Iterable[ColumnBatch]) -> int:
+        return copy_batches(
+            table,
+            batches,
+            self._db_connection,
+            commit_per_batch=self._commit_per_batch,
+            before_commit=self._before_commit,
+            commit=self._commit,
+        )
+
+    def write_statements(self, statements: List[str]):
+        cursor = self._db_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def _import_zstandard():
+    # Optional dependency, only needed for zstd compression
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ValueError("zstd compression requires the zstandard package") from error
+
+    return zstandard
+
+
+def _check_compression(compression: str):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Compression {compression} not supported")
+
+    if compression == "zstd":
+        _import_zstandard()
+
+
+def _open_output(path: pathlib.Path, compression: str) -> IO[bytes]:
+    if compression == "gzip":
+        return gzip.open(path, "wb")
+
+    if compression == "zstd":
+        return _import_zstandard().ZstdCompressor().stream_writer(open(path, "wb"))
+
+    return open(path, "wb")
+
+
+def _compression_suffix(compression: str) -> str:
+    return {"none": "", "gzip": ".gz", "zstd": ".zst"}[compression]
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quoted_table_name(table: TableNode) -> str:
+    return f"{_quote_identifier(table.schema_name)}.{_quote_identifier(table.table_name)}"
+
+
+def _column_list(column_names: Iterable[str]) -> str:
+    return ", ".join(_quote_identifier(name) for name in column_names)
+
+
+def _sequence_reset_statements(table: TableNode, column_names: List[str]) -> List[str]:
+    # Explicit values were written into serial and identity columns, so their
+    # sequences have to be moved past them once the data is loaded
+    statements = []
+    for column in table.columns:
+        if (column.is_serial or column.is_identity) and column.column_name in column_names:
+            table_literal = _quoted_table_name(table).replace("'", "''")
+            column_literal = column.column_name.replace("'", "''")
+            statements.append(
+                f"SELECT setval(pg_get_serial_sequence('{table_literal}', '{column_literal}'), "
+                f"COALESCE((SELECT max({_quote_identifier(column.column_name)}) FROM {_quoted_table_name(table)}), 1));"
+            )
+    return statements
+
+
+def _escape_copy_text(values: np.ndarray) -> np.ndarray:
+    values = values.astype(str)
+    for character, escaped in (
+        ("\\", "\\\\"),
+        ("\t", "\\t"),
+        ("\n", "\\n"),
+        ("\r", "\\r"),
+    ):
+        values = np.char.replace(values, character, escaped)
+    return values
+
+
+def format_copy_text_column(values: np.ndarray) -> List[str]:
+    # Text representation of a whole column as used by COPY ... FROM STDIN
+    if values.dtype.kind in "iuf":
+        return values.astype(str).tolist()
+
+    if values.dtype.kind == "b":
+        return np.where(values, "t", "f").tolist()
+
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values).tolist()
+
+    if values.dtype.kind == "U":
+        return _escape_copy_text(values).tolist()
+
+    # Object columns may contain NULLs
+    formatted = []
+    for value in values.tolist():
+        if value is None:
+            formatted.append("\\N")
+        elif isinstance(value, bool):
+            formatted.append("t" if value else "f")
+        else:
+            formatted.append(
+                str(value)
+                .replace("\\", "\\\\")
+                .replace("\t", "\\t")
+                .replace("\n", "\\n")
+                .replace("\r", "\\r")
+            )
+    return formatted
+
+
+def encode_copy_text_batch(batch: ColumnBatch) -> bytes:
+    columns = [format_copy_text_column(np.asarray(values)) for values in batch.values()]
+    lines = "".join("\t".join(row) + "\n" for row in zip(*columns))
+    return lines.encode("utf-8")
+
+
+def format_csv_column(values: np.ndarray) -> List[str]:
+    # NULLs are unquoted empty fields, so every text value is quoted
+    if values.dtype.kind in "iuf":
+        return values.astype(str).tolist()
+
+    if values.dtype.kind == "b":
+        return np.where(values, "t", "f").tolist()
+
+    if values.dtype.kind == "M":
+        return np.datetime_as_string(values).tolist()
+
+    if values.dtype.kind == "U":
+        quoted = np.char.add(np.char.add('"', np.char.replace(values, '"', '""')), '"')
+        return quoted.tolist()
+
+    formatted = []
+    for value in values.tolist():
+        if value is None:
+            formatted.append("")
+        elif isinstance(value, bool):
+            formatted.append("t" if value else "f")
+        elif isinstance(value, (int, float, Decimal)):
+            formatted.append(str(value))
+        else:
+            formatted.append('"' + str(value).replace('"', '""') + '"')
+    return formatted
+
+
+def _encode_numeric(value: Any) -> bytes:
+    # Binary representation of numeric: base 10000 digits with a weight
+    number = Decimal(str(value))
+    if number.is_nan():
+        return struct.pack(">hhHH", 0, 0, 0xC000, 0)
+
+    sign, digits, exponent = number.as_tuple()
+    digit_string = "".join(str(digit) for digit in digits)
+
+    if exponent >= 0:
+        integer_part = digit_string + "0" * exponent
+        fraction_part = ""
+    else:
+        fraction_part = digit_string[exponent:].rjust(-exponent, "0")
+        integer_part = digit_string[:exponent] or "0"
+
+    display_scale = max(0, -exponent)
+
+    integer_part = integer_part.rjust((len(integer_part) + 3) // 4 * 4, "0")
+    fraction_part = fraction_part.ljust((len(fraction_part) + 3) // 4 * 4, "0")
+
+    groups = [int(integer_part[i : i + 4]) for i in range(0, len(integer_part), 4)]
+    weight = len(groups) - 1
+    groups += [int(fraction_part[i : i + 4]) for i in range(0, len(fraction_part), 4)]
+
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+
+    return struct.pack(
+        f">hhHH{len(groups)}H",
+        len(groups),
+        weight,
+        0x4000 if sign else 0,
+        display_scale,
+        *groups,
+    )
+
+
+def _encode_text(value: Any) -> bytes:
+    return str(value).encode("utf-8")
+
+
+def _encode_jsonb(value: Any) -> bytes:
+    return b"\x01" + str(value).encode("utf-8")
+
+
+def _encode_uuid(value: Any) -> bytes:
+    return bytes.fromhex(str(value).replace("-", ""))
+
+
+def _encode_bool(value: Any) -> bytes:
+    return b"\x01" if value else b"\x00"
+
+
+def _fixed_width_encoder(
+    dtype: str, convert: Optional[Callable[[np.ndarray], np.ndarray]] = None
+) -> Callable[[np.ndarray], List[Optional[bytes]]]:
+    # Encodes a whole column with numpy when it has no NULLs
+    width = np.dtype(dtype).itemsize
+
+    def encode(values: np.ndarray) -> List[Optional[bytes]]:
+        if values.dtype == object and any(value is None for value in values):
+            return [
+                None if value is None else encode(np.asarray([value]))[0]
+                for value in values
+            ]
+
+        if convert is not None:
+            values = convert(values)
+
+        raw = np.ascontiguousarray(values.astype(dtype)).tobytes()
+        return [raw[i : i + width] for i in range(0, len(raw), width)]
+
+    return encode
+
+
+def _object_encoder(
+    encode_value: Callable[[Any], bytes]
+) -> Callable[[np.ndarray], List[Optional[bytes]]]:
+    def encode(values: np.ndarray) -> List[Optional[bytes]]:
+        return [
+            None if value is None else encode_value(value) for value in values.tolist()
+        ]
+
+    return encode
+
+
+def _days_since_postgres_epoch(values: np.ndarray) -> np.ndarray:
+    return (values.astype("datetime64[D]") - _POSTGRES_EPOCH_DATE).astype(np.int64)
+
+
+def _microseconds_since_postgres_epoch(values: np.ndarray) -> np.ndarray:
+    return (values.astype("datetime64[us]") - _POSTGRES_EPOCH_TIMESTAMP).astype(
+        np.int64
+    )
+
+
+BINARY_ENCODERS: Dict[str, Callable[[np.ndarray], List[Optional[bytes]]]] = {
+    "smallint": _fixed_width_encoder(">i2"),
+    "integer": _fixed_width_encoder(">i4"),
+    "bigint": _fixed_width_encoder(">i8"),
+    "real": _fixed_width_encoder(">f4"),
+    "double precision": _fixed_width_encoder(">f8"),
+    "date": _fixed_width_encoder(">i4", _days_since_postgres_epoch),
+    "timestamp": _fixed_width_encoder(">i8", _microseconds_since_postgres_epoch),
+    "timestamp without time zone": _fixed_width_encoder(
+        ">i8", _microseconds_since_postgres_epoch
+    ),
+    "timestamp with time zone": _fixed_width_encoder(
+        ">i8", _microseconds_since_postgres_epoch
+    ),
+    "boolean": _object_encoder(_encode_bool),
+    "numeric": _object_encoder(_encode_numeric),
+    "uuid": _object_encoder(_encode_uuid),
+    "json": _object_encoder(_encode_text),
+    "jsonb": _object_encoder(_encode_jsonb),
+    "text": _object_encoder(_encode_text),
+    "character varying": _object_encoder(_encode_text),
+    "character": _object_encoder(_encode_text),
+    # Enums are sent as their label
+    "USER-DEFINED": _object_encoder(_encode_text),
+}
+
+
+def encode_copy_binary_column(
+    table: TableNode, column_name: str, values: np.ndarray
+) -> List[Optional[bytes]]:
+    data_type = table.get_column(column_name).data_type
+    if data_type not in BINARY_ENCODERS:
+        raise ValueError(
+            f"Data type {data_type} not supported in binary COPY for column {column_name} in table {table.full_table_name}"
+        )
+
+    # Datetimes are encoded from their numpy representation
+    if data_type in ("date",) or data_type.startswith("timestamp"):
+        if values.dtype.kind != "M" and values.dtype != object:
+            values = values.astype("datetime64[us]")
+        elif values.dtype == object:
+            values = np.asarray(
+                [None if value is None else np.datetime64(value, "us") for value in values],
+                dtype=object,
+            )
+
+    return BINARY_ENCODERS[data_type](values)
+
+
+class FileSink(Sink):
+    # Writes one file per table into a directory, along with a psql script
+    # that loads them in dependency order
+
+    extension = ""
+    copy_options = ""
+
+    def __init__(self, output_dir: pathlib.Path, compression: str = "none"):
+        _check_compression(compression)
+
+        self._output_dir = output_dir
+        self._compression = compression
+        self._load_commands: List[str] = []
+        self._sequence_resets: List[str] = []
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def output_dir(self) -> pathlib.Path:
+        return self._output_dir
+
+    def _get_table_path(self, table: TableNode) -> pathlib.Path:
+        return self._output_dir.joinpath(
+            f"{table.full_table_name}{self.extension}{_compression_suffix(self._compression)}"
+        )
+
+    def write_header(self, output: IO[bytes], table: TableNode, column_names: List[str]):
+        pass
+
+    @abstractmethod
+    def write_batch(self, output: IO[bytes], table: TableNode, batch: ColumnBatch): ...
+
+    def write_footer(self, output: IO[bytes], table: TableNode):
+        pass
+
+    def write_table(self, table: TableNode, batches: Iterable[ColumnBatch]) -> int:
+        path = self._get_table_path(table)
+        column_names: Optional[List[str]] = None
+        num_rows = 0
+        metrics = get_metrics()
+
+        # Batches are written as they are generated, so memory stays bounded
+        with _open_output(path, self._compression) as output:
+            for batch in batches:
+                if column_names is None:
+                    column_names = list(batch.keys())
+                    self.write_header(output, table, column_names)
+
+                batch_rows = len(next(iter(batch.values()))) if batch else 0
+                with metrics.timer(table.full_table_name, "write"):
+                    self.write_batch(output, table, batch)
+
+                num_rows += batch_rows
+                metrics.increment(table.full_table_name, "rows_written", batch_rows)
+
+            if column_names is not None:
+                self.write_footer(output, table)
+
+        if column_names is None:
+            path.unlink()
+            return 0
+
+        self._add_load_command(table, path, column_names)
+        return num_rows
+
+    def write_statements(self, statements: List[str]):
+        self._load_commands += statements
+
+    def _add_load_command(
+        self, table: TableNode, path: pathlib.Path, column_names: List[str]
+    ):
+        if self._compression == "none":
+            source = f"'{path.name}'"
+        else:
+            decompress = "gzip -dc" if self._compression == "gzip" else "zstd -dc"
+            source = f"PROGRAM '{decompress} {path.name}'"
+
+        self._load_commands.append(
+            f"\\copy {_quoted_table_name(table)} ({_column_list(column_names)}) FROM {source}{self.copy_options}"
+        )
+        self._sequence_resets += _sequence_reset_statements(table, column_names)
+
+    def close(self):
+        # Run from the output directory with: psql -f load.sql
+        load_script = self._output_dir.joinpath("load.sql")
+        with open(load_script, "w", encoding="utf-8") as script:
+            script.write("\\set ON_ERROR_STOP on\n")
+            script.write("BEGIN;\n")
+            for command in self._load_commands + self._sequence_resets:
+                script.write(command + "\n")
+            script.write("COMMIT;\n")
+
+
+class CopyTextFileSink(FileSink):
+
+    extension = ".copy"
+
+    def write_batch(self, output: IO[bytes], table: TableNode, batch: ColumnBatch):
+        output.write(encode_copy_text_batch(batch))
+
+
+class CopyBinaryFileSink(FileSink):
+
+    extension = ".bin"
+    copy_options = " WITH (FORMAT binary)"
+
+    def write_header(self, output: IO[bytes], table: TableNode, column_names: List[str]):
+        output.write(_COPY_BINARY_HEADER)
+
+    def write_batch(self, output: IO[bytes], table: TableNode, batch: ColumnBatch):
+        columns = [
+            encode_copy_binary_column(table, column_name, np.asarray(values))
+            for column_name, values in batch.items()
+        ]
+        field_count = struct.pack(">h", len(columns))
+        null_field = struct.pack(">i", -1)
+
+        tuples = []
+        for row in zip(*columns):
+            fields = [field_count]
+            for value in row:
+                if value is None:
+                    fields.append(null_field)
+                else:
+                    fields.append(struct.pack(">i", len(value)))
+                    fields.append(value)
+            tuples.append(b"".join(fields))
+
+        output.write(b"".join(tuples))
+
+    def write_footer(self, output: IO[bytes], table: TableNode):
+        output.write(_COPY_BINARY_TRAILER)
+
+
+class CsvFileSink(FileSink):
+
+    extension = ".csv"
+    copy_options = " WITH (FORMAT csv, HEADER true)"
+
+    def write_header(self, output: IO[bytes], table: TableNode, column_names: List[str]):
+        output.write((",".join(column_names) + "\n").encode("utf-8"))
+
+    def write_batch(self, output: IO[bytes], table: TableNode, batch: ColumnBatch):
+        columns = [format_csv_column(np.asarray(values)) for values in batch.values()]
+        lines = "".join(",".join(row) + "\n" for row in zip(*columns))
+        output.write(lines.encode("utf-8"))
+
+
+class SqlScriptSink(Sink):
+    # A single plain SQL script in the format of pg_dump, with one
+    # COPY ... FROM stdin block per table, loadable with psql -f
+
+    def __init__(self, output_dir: pathlib.Path, compression: str = "none"):
+        _check_compression(compression)
+
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self._path = output_dir.joinpath(f"data.sql{_compression_suffix(compression)}")
+        self._output = _open_output(self._path, compression)
+        self._sequence_resets: List[str] = []
+        self._output.write(b"SET client_encoding = 'UTF8';\nBEGIN;\n\n")
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    def write_table(self, table: TableNode, batches: Iterable[ColumnBatch]) -> int:
+        column_names: Optional[List[str]] = None
+        num_rows = 0
+        metrics = get_metrics()
+
+        for batch in batches:
+            start_time = time.perf_counter()
+
+            if column_names is None:
+                column_names = list(batch.keys())
+                self._output.write(
+                    f"COPY {_quoted_table_name(table)} ({_column_list(column_names)}) FROM stdin;\n".encode(
+                        "utf-8"
+                    )
+                )
+
+            columns = [
+                format_copy_text_column(np.asarray(values)) for values in batch.values()
+            ]
+            lines = "".join("\t".join(row) + "\n" for row in zip(*columns))
+            self._output.write(lines.encode("utf-8"))
+
+            batch_rows = len(columns[0]) if columns else 0
+            num_rows += batch_rows
+            metrics.merge(
+                table.full_table_name,
+                {
+                    "write_seconds": time.perf_counter() - start_time,
+                    "rows_written": batch_rows,
+                },
+            )
+
+        if column_names is None:
+            return 0
+
+        self._output.write(b"\\.\n\n")
+
+        self._sequence_resets += _sequence_reset_statements(table, column_names)
+
+        return num_rows
+
+    def write_statements(self, statements: List[str]):
+        for statement in statements:
+            self._output.write((statement + "\n").encode("utf-8"))
+        self._output.write(b"\n")
+
+    def close(self):
+        for statement in self._sequence_resets:
+            self._output.write((statement + "\n").encode("utf-8"))
+        self._output.write(b"\nCOMMIT;\n")
+        self._output.close()
+
+
+def create_file_sink(
+    output_format: str, output_dir: pathlib.Path, compression: str = "none"
+) -> Sink:
+    if output_format == "copy":
+        return CopyTextFileSink(output_dir, compression)
+    if output_format == "binary":
+        return CopyBinaryFileSink(output_dir, compression)
+    if output_format == "csv":
+        return CsvFileSink(output_dir, compression)
+    if output_format == "sql":
+        return SqlScriptSink(output_dir, compression)
+
+    raise ValueError(f"Output format {output_format} not supported")
@@ -0,0 +1,252 @@
+import gzip
+import json
+import logging
+import pathlib
+from typing import Any, Dict, Optional, Set, Tuple
+
+from psycopg import Connection
+
+from data_gen.depgraph import DepGraph
+from data_gen.inspection import SYSTEM_SCHEMA_FILTER, generate_dependency_graph
+from data_gen.metrics import CATALOG_SCOPE, get_metrics
+from data_gen.subset import TableFilter
+from data_gen.table_node import (
+    CheckConstraint,
+    ForeignKeyConstraint,
+    TableNode,
+    UniqueConstraint,
+)
+from data_gen.type_registry import SqlType, TypeRegistry
+
+SNAPSHOT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def get_schema_fingerprint(db_connection: Connection) -> str:
+    # Any DDL rewrites the catalog rows it touches, which gives them a new
+    # xmin, so hashing (oid, xmin) of the relevant rows detects schema changes
+    # without reading the definitions themselves
+    query = f"""
+        SELECT md5(string_agg(entry, ',' ORDER BY entry))
+        FROM (
+            SELECT 'c' || c.oid || ':' || c.xmin AS entry
+            FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p') AND {SYSTEM_SCHEMA_FILTER}
+            UNION ALL
+            SELECT 'a' || a.attrelid || '.' || a.attnum || ':' || a.xmin
+            FROM pg_catalog.pg_attribute a
+            JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND {SYSTEM_SCHEMA_FILTER}
+            UNION ALL
+            SELECT 'd' || d.oid || ':' || d.xmin
+            FROM pg_catalog.pg_attrdef d
+            UNION ALL
+            SELECT 'k' || con.oid || ':' || con.xmin
+            FROM pg_catalog.pg_constraint con
+            JOIN pg_catalog.pg_namespace n ON n.oid = con.connamespace
+            WHERE {SYSTEM_SCHEMA_FILTER}
+            UNION ALL
+            SELECT 't' || t.oid || ':' || t.xmin
+            FROM pg_catalog.pg_type t
+            JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
+            WHERE t.typtype IN ('e', 'd') AND {SYSTEM_SCHEMA_FILTER}
+            UNION ALL
+            SELECT 'e' || e.oid || ':' || e.xmin
+            FROM pg_catalog.pg_enum e
+        ) AS catalog_entries;
+    """
+
+    metrics = get_metrics()
+    with metrics.timer(CATALOG_SCOPE, "fingerprint"):
+        cursor = db_connection.cursor()
+        cursor.execute(query)
+        row = cursor.fetchone()
+    metrics.increment(CATALOG_SCOPE, "catalog_queries")
+
+    return row[0] if row is not None and row[0] is not None else ""
+
+
+def _type_to_dict(sql_type: SqlType) -> Dict[str, Any]:
+    return {
+        "oid": sql_type.oid,
+        "schema_name": sql_type.schema_name,
+        "type_name": sql_type.type_name,
+        "kind": sql_type.kind,
+        "formatted_name": sql_type.formatted_name,
+        "base_type_oid": sql_type.base_type_oid,
+        "element_type_oid": sql_type.element_type_oid,
+        "not_null": sql_type.not_null,
+        "enum_labels": sql_type.enum_labels,
+        "check_constraints": sql_type.check_constraints,
+    }
+
+
+def _table_to_dict(table: TableNode) -> Dict[str, Any]:
+    return {
+        "full_table_name": table.full_table_name,
+        "columns": [
+            {
+                "column_name": column.column_name,
+                "data_type": column.data_type,
+                "is_nullable": column.is_nullable,
+                "udt_name": column.udt_name,
+                "type_oid": column.sql_type.oid if column.sql_type is not None else None,
+                "default": column.default,
+                "identity": column.identity,
+                "generated": column.generated,
+                "max_length": column.max_length,
+            }
+            for column in table.columns
+        ],
+        "unique_constraints": [
+            {
+                "constraint_name": constraint.constraint_name,
+                "column_names": constraint.column_names,
+                "is_primary_key": constraint.is_primary_key,
+            }
+            for constraint in table.unique_constraints
+        ],
+        "check_constraints": [
+            {
+                "constraint_name": constraint.constraint_name,
+                "definition": constraint.definition,
+            }
+            for constraint in table.check_constraints
+        ],
+    }
+
+
+def _foreign_key_to_dict(relationship: ForeignKeyConstraint) -> Dict[str, Any]:
+    return {
+        "constraint_name": relationship.constraint_name,
+        "parent_table": relationship.parent_table,
+        "parent_columns": relationship.parent_columns,
+        "child_table": relationship.child_table,
+        "child_columns": relationship.child_columns,
+        "is_deferrable": relationship.is_deferrable,
+    }
+
+
+def save_snapshot(dep_graph: DepGraph, path: pathlib.Path, fingerprint: str):
+    type_registry = dep_graph.type_registry
+
+    # Only keep the types used by the columns (and the types they are based on)
+    used_type_oids: Set[int] = set()
+    for table in dep_graph.get_all_tables():
+        for column in table.columns:
+            sql_type = column.sql_type
+            while sql_type is not None and sql_type.oid not in used_type_oids:
+                used_type_oids.add(sql_type.oid)
+                next_oid = sql_type.base_type_oid or sql_type.element_type_oid
+                sql_type = (
+                    type_registry.get_type(next_oid)
+                    if next_oid and type_registry.has_type(next_oid)
+                    else None
+                )
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "fingerprint": fingerprint,
+        "types": [
+            _type_to_dict(type_registry.get_type(oid)) for oid in sorted(used_type_oids)
+        ],
+        "tables": [_table_to_dict(table) for table in dep_graph.get_all_tables()],
+        "foreign_keys": [
+            _foreign_key_to_dict(relationship)
+            for table in dep_graph.get_all_tables()
+            for relationship in table.parent_relationships
+        ],
+    }
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(",", ":"))
+
+
+def load_snapshot(path: pathlib.Path) -> Tuple[DepGraph, str]:
+    with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+        snapshot = json.load(snapshot_file)
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot {path} has version {snapshot.get('version')}, expected {SNAPSHOT_VERSION}"
+        )
+
+    type_registry = TypeRegistry()
+    for type_data in snapshot["types"]:
+        type_registry.add_type(SqlType(**type_data))
+
+    dep_graph = DepGraph()
+    dep_graph.type_registry = type_registry
+
+    for table_data in snapshot["tables"]:
+        table = TableNode(full_table_name=table_data["full_table_name"])
+
+        for column_data in table_data["columns"]:
+            type_oid = column_data.pop("type_oid")
+            table.add_column(
+                sql_type=(
+                    type_registry.get_type(type_oid) if type_oid is not None else None
+                ),
+                **column_data,
+            )
+
+        for constraint_data in table_data["unique_constraints"]:
+            table.add_unique_constraint(UniqueConstraint(**constraint_data))
+
+        for constraint_data in table_data["check_constraints"]:
+            table.add_check_constraint(CheckConstraint(**constraint_data))
+
+        dep_graph.add_table(table)
+
+    for foreign_key_data in snapshot["foreign_keys"]:
+        dep_graph.add_child(
+            child=dep_graph.get_table(foreign_key_data["child_table"]),
+            parent=dep_graph.get_table(foreign_key_data["parent_table"]),
+            constraint_name=foreign_key_data["constraint_name"],
+            parent_columns=foreign_key_data["parent_columns"],
+            child_columns=foreign_key_data["child_columns"],
+            is_deferrable=foreign_key_data["is_deferrable"],
+        )
+
+    return dep_graph, snapshot["fingerprint"]
+
+
+def load_dependency_graph(
+    db_connection: Connection,
+    snapshot_path: Optional[pathlib.Path] = None,
+    table_filter: Optional[TableFilter] = None,
+) -> DepGraph:
+    if snapshot_path is None:
+        dep_graph = DepGraph()
+        generate_dependency_graph(dep_graph, db_connection, table_filter)
+        return dep_graph
+
+    # A snapshot only holds the tables selected when it was taken
+    fingerprint = get_schema_fingerprint(db_connection)
+    if table_filter is not None and not table_filter.is_empty:
+        fingerprint += table_filter.get_key()
+
+    # Reuse the snapshot as long as the schema has not changed since it was taken
+    if snapshot_path.exists():
+        try:
+            with get_metrics().timer(CATALOG_SCOPE, "snapshot_load"):
+                dep_graph, snapshot_fingerprint = load_snapshot(snapshot_path)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.warning("Ignoring unreadable snapshot %s: %s", snapshot_path, error)
+        else:
+            if snapshot_fingerprint == fingerprint:
+                logger.info("Schema unchanged, using snapshot: %s", snapshot_path)
+                return dep_graph
+
+            logger.info("Schema changed since snapshot: %s", snapshot_path)
+
+    dep_graph = DepGraph()
+    generate_dependency_graph(dep_graph, db_connection, table_filter)
+    save_snapshot(dep_graph, snapshot_path, fingerprint)
+    logger.info("Saved schema snapshot: %s", snapshot_path)
+
+    return dep_graph
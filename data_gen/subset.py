@@ -0,0 +1,46 @@
+import fnmatch
+from typing import Iterable, List, Sequence
+
+
+def _normalize_pattern(pattern: str) -> str:
+    # A pattern without a dot names whole schemas
+    if not pattern:
+        raise ValueError("Table patterns can't be empty")
+    return pattern if "." in pattern else f"{pattern}.*"
+
+
+class TableFilter:
+    # Tables to fill, as globs of schema.table names (e.g. app.*, *.audit_*).
+    # A table is selected when it matches an include pattern, or there are
+    # none, and no exclude pattern. The parents of the selected tables are
+    # always filled too, see DepGraph.get_ancestor_closure.
+
+    def __init__(self, include: Sequence[str] = (), exclude: Sequence[str] = ()):
+        self._include = [_normalize_pattern(pattern) for pattern in include]
+        self._exclude = [_normalize_pattern(pattern) for pattern in exclude]
+
+    @property
+    def include(self) -> List[str]:
+        return self._include
+
+    @property
+    def exclude(self) -> List[str]:
+        return self._exclude
+
+    @property
+    def is_empty(self) -> bool:
+        return not self._include and not self._exclude
+
+    def matches(self, table_name: str) -> bool:
+        if self._include and not any(
+            fnmatch.fnmatchcase(table_name, pattern) for pattern in self._include
+        ):
+            return False
+        return not any(fnmatch.fnmatchcase(table_name, pattern) for pattern in self._exclude)
+
+    def select(self, table_names: Iterable[str]) -> List[str]:
+        return [table_name for table_name in table_names if self.matches(table_name)]
+
+    def get_key(self) -> str:
+        # Identifies the selection, e.g. in the fingerprint of a snapshot
+        return "+{}-{}".format(",".join(self._include), ",".join(self._exclude))
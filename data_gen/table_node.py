@@ -1,29 +1,61 @@
-from typing import List
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from data_gen.type_registry import SqlType
+
+logger = logging.getLogger(__name__)
+
+# pg_attribute.attidentity values
+IDENTITY_ALWAYS = "a"
+IDENTITY_BY_DEFAULT = "d"
+
+# The classes of the schema are instantiated for every table, column and
+# constraint of the database, so they keep their attributes in __slots__
 
 
 class ForeignKeyConstraint:
+    __slots__ = (
+        "_constraint_name",
+        "_parent_columns",
+        "_parent_table",
+        "_child_table",
+        "_child_columns",
+        "_is_deferrable",
+    )
 
     def __init__(
         self,
         constraint_name: str,
-        parent_column: str,
+        parent_columns: List[str],
         parent_table: str,
         child_table: str,
-        child_column: str,
+        child_columns: List[str],
+        is_deferrable: bool = False,
     ):
+        if len(parent_columns) != len(child_columns):
+            raise ValueError(
+                f"Foreign key {constraint_name} has {len(child_columns)} columns referencing {len(parent_columns)} columns"
+            )
+
         self._constraint_name = constraint_name
-        self._parent_column = parent_column
+        self._parent_columns = parent_columns
         self._parent_table = parent_table
         self._child_table = child_table
-        self._child_column = child_column
+        self._child_columns = child_columns
+        self._is_deferrable = is_deferrable
 
     @property
     def constraint_name(self) -> str:
         return self._constraint_name
 
+    @property
+    def parent_columns(self) -> List[str]:
+        return self._parent_columns
+
     @property
     def parent_column(self) -> str:
-        return self._parent_column
+        # Only meaningful for single column keys
+        return self._parent_columns[0]
 
     @property
     def parent_table(self) -> str:
@@ -33,15 +65,114 @@ class ForeignKeyConstraint:
     def child_table(self) -> str:
         return self._child_table
 
+    @property
+    def child_columns(self) -> List[str]:
+        return self._child_columns
+
+    @property
+    def child_column(self) -> str:
+        # Only meaningful for single column keys
+        return self._child_columns[0]
+
+    @property
+    def column_pairs(self) -> List[Tuple[str, str]]:
+        # (child column, parent column) pairs
+        return list(zip(self._child_columns, self._parent_columns))
+
+    @property
+    def is_composite(self) -> bool:
+        return len(self._child_columns) > 1
+
+    @property
+    def is_deferrable(self) -> bool:
+        return self._is_deferrable
+
+    def __str__(self):
+        parent_columns = ", ".join(self._parent_columns)
+        child_columns = ", ".join(self._child_columns)
+        return f"{self._constraint_name}: ({self._parent_table}.({parent_columns}) -> {self._child_table}.({child_columns}))"
+
+
+class UniqueConstraint:
+    __slots__ = ("_constraint_name", "_column_names", "_is_primary_key")
+
+    def __init__(
+        self, constraint_name: str, column_names: List[str], is_primary_key: bool = False
+    ):
+        self._constraint_name = constraint_name
+        self._column_names = column_names
+        self._is_primary_key = is_primary_key
+
+    @property
+    def constraint_name(self) -> str:
+        return self._constraint_name
+
+    @property
+    def column_names(self) -> List[str]:
+        return self._column_names
+
+    @property
+    def is_primary_key(self) -> bool:
+        return self._is_primary_key
+
+    def __str__(self):
+        kind = "PRIMARY KEY" if self._is_primary_key else "UNIQUE"
+        return f"{self._constraint_name}: {kind} ({', '.join(self._column_names)})"
+
+
+class CheckConstraint:
+    __slots__ = ("_constraint_name", "_definition")
+
+    def __init__(self, constraint_name: str, definition: str):
+        self._constraint_name = constraint_name
+        self._definition = definition
+
+    @property
+    def constraint_name(self) -> str:
+        return self._constraint_name
+
+    @property
+    def definition(self) -> str:
+        return self._definition
+
     def __str__(self):
-        return f"{self._constraint_name}: ({self._parent_table}.{self._parent_column} -> {self._child_table}.{self._child_column})"
+        return f"{self._constraint_name}: {self._definition}"
 
 
 class TableColumn:
+    __slots__ = (
+        "_column_name",
+        "_data_type",
+        "_is_nullable",
+        "_udt_name",
+        "_sql_type",
+        "_default",
+        "_identity",
+        "_generated",
+        "_max_length",
+    )
 
-    def __init__(self, column_name: str, data_type: str):
+    def __init__(
+        self,
+        column_name: str,
+        data_type: str,
+        is_nullable: bool = True,
+        udt_name: Optional[str] = None,
+        sql_type: Optional[SqlType] = None,
+        default: Optional[str] = None,
+        identity: str = "",
+        generated: str = "",
+        max_length: Optional[int] = None,
+    ):
         self._column_name = column_name
         self._data_type = data_type
+        self._is_nullable = is_nullable
+        self._udt_name = udt_name if udt_name is not None else data_type
+        self._sql_type = sql_type
+        self._default = default
+        self._identity = identity
+        self._generated = generated
+        self._max_length = max_length
 
     @property
     def column_name(self) -> str:
@@ -51,32 +182,91 @@ class TableColumn:
     def data_type(self) -> str:
         return self._data_type
 
+    @property
+    def is_nullable(self) -> bool:
+        return self._is_nullable
+
+    @property
+    def udt_name(self) -> str:
+        return self._udt_name
+
+    @property
+    def sql_type(self) -> Optional[SqlType]:
+        return self._sql_type
+
+    @property
+    def default(self) -> Optional[str]:
+        return self._default
+
+    @property
+    def identity(self) -> str:
+        return self._identity
+
+    @property
+    def generated(self) -> str:
+        return self._generated
+
+    @property
+    def max_length(self) -> Optional[int]:
+        return self._max_length
+
+    @property
+    def is_serial(self) -> bool:
+        return self._default is not None and self._default.startswith("nextval(")
+
+    @property
+    def is_identity(self) -> bool:
+        return self._identity in (IDENTITY_ALWAYS, IDENTITY_BY_DEFAULT)
+
+    @property
+    def is_generated(self) -> bool:
+        return self._generated != ""
+
+    @property
+    def is_auto_generated(self) -> bool:
+        # Values of these columns are produced by the database itself
+        return self.is_serial or self.is_identity or self.is_generated
+
     def __str__(self):
         return f"{self._column_name}: {self._data_type}"
 
 
 class TableNode:
+    __slots__ = (
+        "_full_table_name",
+        "_schema_name",
+        "_table_name",
+        "_columns",
+        "_columns_by_name",
+        "_parent_relationships",
+        "_unique_constraints",
+        "_check_constraints",
+    )
 
     def __init__(
         self,
         full_table_name: str,
     ):
         self._full_table_name = full_table_name
+        self._schema_name, self._table_name = full_table_name.split(".", 1)
         self._columns: List[TableColumn] = []
+        self._columns_by_name: Dict[str, TableColumn] = {}
         self._parent_relationships: List[ForeignKeyConstraint] = []
+        self._unique_constraints: List[UniqueConstraint] = []
+        self._check_constraints: List[CheckConstraint] = []
 
     @property
     def full_table_name(self) -> str:
         return self._full_table_name
-    
+
     @property
     def table_name(self) -> str:
-        return self._full_table_name.split(".")[1]
-    
+        return self._table_name
+
     @property
     def schema_name(self) -> str:
-        return self._full_table_name.split(".")[0]
-    
+        return self._schema_name
+
     @property
     def columns(self) -> List[TableColumn]:
         return self._columns
@@ -85,13 +275,65 @@ class TableNode:
     def parent_relationships(self) -> List[ForeignKeyConstraint]:
         return self._parent_relationships
 
-    def add_column(self, column_name: str, data_type: str):
-        print(f"Adding column: {column_name} to table: {self._full_table_name}")
-        self._columns.append(TableColumn(column_name=column_name, data_type=data_type))
+    @property
+    def unique_constraints(self) -> List[UniqueConstraint]:
+        return self._unique_constraints
+
+    @property
+    def check_constraints(self) -> List[CheckConstraint]:
+        return self._check_constraints
+
+    @property
+    def primary_key(self) -> Optional[UniqueConstraint]:
+        for constraint in self._unique_constraints:
+            if constraint.is_primary_key:
+                return constraint
+
+        return None
+
+    def get_column(self, column_name: str) -> TableColumn:
+        column = self._columns_by_name.get(column_name)
+        if column is not None:
+            return column
+
+        raise ValueError(f"Column {column_name} not found in table {self._full_table_name}")
+
+    def add_column(
+        self,
+        column_name: str,
+        data_type: str,
+        is_nullable: bool = True,
+        udt_name: Optional[str] = None,
+        sql_type: Optional[SqlType] = None,
+        default: Optional[str] = None,
+        identity: str = "",
+        generated: str = "",
+        max_length: Optional[int] = None,
+    ):
+        logger.debug("Adding column: %s to table: %s", column_name, self._full_table_name)
+        column = TableColumn(
+            column_name=column_name,
+            data_type=data_type,
+            is_nullable=is_nullable,
+            udt_name=udt_name,
+            sql_type=sql_type,
+            default=default,
+            identity=identity,
+            generated=generated,
+            max_length=max_length,
+        )
+        self._columns.append(column)
+        self._columns_by_name.setdefault(column_name, column)
 
     def sdd_parent_relationship(self, parent_relationship: ForeignKeyConstraint):
         self._parent_relationships.append(parent_relationship)
 
+    def add_unique_constraint(self, unique_constraint: UniqueConstraint):
+        self._unique_constraints.append(unique_constraint)
+
+    def add_check_constraint(self, check_constraint: CheckConstraint):
+        self._check_constraints.append(check_constraint)
+
     def __str__(self):
         ret = f"Table: {self._full_table_name}\n"
         ret += (
@@ -104,4 +346,12 @@ class TableNode:
             + "\n".join([str(rel) for rel in self._parent_relationships])
             + "\n"
         )
+        ret += (
+            "Constraints: \n"
+            + "\n".join(
+                [str(constraint) for constraint in self._unique_constraints]
+                + [str(constraint) for constraint in self._check_constraints]
+            )
+            + "\n"
+        )
         return ret
@@ -0,0 +1,96 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+from psycopg import AsyncConnection, Connection, sql
+
+from data_gen.depgraph import DepGraph
+from data_gen.key_source import row_estimate_query
+from data_gen.loader import table_identifier
+from data_gen.parameters import TOP_UP_EXACT_COUNT_MAX
+from data_gen.table_node import TableNode
+
+logger = logging.getLogger(__name__)
+
+
+def _count_query(table: TableNode) -> sql.Composed:
+    return sql.SQL("SELECT count(*) FROM {}").format(table_identifier(table))
+
+
+def _get_size(estimate: Optional[float], exact_count_max: int) -> Optional[int]:
+    # The estimate of the statistics is good enough for large tables, small
+    # ones and those never analyzed are counted
+    if estimate is None or estimate < exact_count_max:
+        return None
+    return int(estimate)
+
+
+def _get_top_up(
+    table_name: str, target_rows: int, current_rows: int
+) -> Tuple[int, int]:
+    # (rows to add, index of the first of them), so that the new rows get the
+    # indices they would have had in a single fill to the target
+    if current_rows >= target_rows:
+        logger.info(
+            "Skipping table: %s, %d rows of %d already", table_name, current_rows, target_rows
+        )
+        return 0, current_rows
+
+    logger.info(
+        "Topping up table: %s from %d to %d rows", table_name, current_rows, target_rows
+    )
+    return target_rows - current_rows, current_rows
+
+
+def get_top_up(
+    dep_graph: DepGraph,
+    row_counts: Dict[str, int],
+    db_connection: Connection,
+    exact_count_max: int = TOP_UP_EXACT_COUNT_MAX,
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    # Number of rows each table is missing to reach its row count, and the
+    # row index they start at, from the current sizes of the tables: exact
+    # counts under exact_count_max rows, estimates from pg_class above
+    missing_rows: Dict[str, int] = {}
+    start_rows: Dict[str, int] = {}
+    cursor = db_connection.cursor()
+
+    for table_name in dep_graph.get_fill_order():
+        table = dep_graph.get_table(table_name)
+
+        cursor.execute(row_estimate_query(table_name))
+        current_rows = _get_size(cursor.fetchone()[0], exact_count_max)
+        if current_rows is None:
+            cursor.execute(_count_query(table))
+            current_rows = cursor.fetchone()[0]
+
+        missing_rows[table_name], start_rows[table_name] = _get_top_up(
+            table_name, row_counts[table_name], current_rows
+        )
+
+    return missing_rows, start_rows
+
+
+async def get_top_up_async(
+    dep_graph: DepGraph,
+    row_counts: Dict[str, int],
+    db_connection: AsyncConnection,
+    exact_count_max: int = TOP_UP_EXACT_COUNT_MAX,
+) -> Tuple[Dict[str, int], Dict[str, int]]:
+    missing_rows: Dict[str, int] = {}
+    start_rows: Dict[str, int] = {}
+    cursor = db_connection.cursor()
+
+    for table_name in dep_graph.get_fill_order():
+        table = dep_graph.get_table(table_name)
+
+        await cursor.execute(row_estimate_query(table_name))
+        current_rows = _get_size((await cursor.fetchone())[0], exact_count_max)
+        if current_rows is None:
+            await cursor.execute(_count_query(table))
+            current_rows = (await cursor.fetchone())[0]
+
+        missing_rows[table_name], start_rows[table_name] = _get_top_up(
+            table_name, row_counts[table_name], current_rows
+        )
+
+    return missing_rows, start_rows
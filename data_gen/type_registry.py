@@ -0,0 +1,213 @@
+from typing import Dict, List, Optional
+
+from psycopg import Connection
+
+from data_gen.metrics import CATALOG_SCOPE, get_metrics
+
+# pg_type.typtype values
+TYPE_KIND_BASE = "b"
+TYPE_KIND_COMPOSITE = "c"
+TYPE_KIND_DOMAIN = "d"
+TYPE_KIND_ENUM = "e"
+TYPE_KIND_MULTIRANGE = "m"
+TYPE_KIND_PSEUDO = "p"
+TYPE_KIND_RANGE = "r"
+
+
+class SqlType:
+
+    def __init__(
+        self,
+        oid: int,
+        schema_name: str,
+        type_name: str,
+        kind: str,
+        formatted_name: str,
+        base_type_oid: int = 0,
+        element_type_oid: int = 0,
+        not_null: bool = False,
+        enum_labels: Optional[List[str]] = None,
+        check_constraints: Optional[List[str]] = None,
+    ):
+        self._oid = oid
+        self._schema_name = schema_name
+        self._type_name = type_name
+        self._kind = kind
+        self._formatted_name = formatted_name
+        self._base_type_oid = base_type_oid
+        self._element_type_oid = element_type_oid
+        self._not_null = not_null
+        self._enum_labels: List[str] = enum_labels if enum_labels is not None else []
+        self._check_constraints: List[str] = (
+            check_constraints if check_constraints is not None else []
+        )
+
+    @property
+    def oid(self) -> int:
+        return self._oid
+
+    @property
+    def schema_name(self) -> str:
+        return self._schema_name
+
+    @property
+    def type_name(self) -> str:
+        return self._type_name
+
+    @property
+    def full_type_name(self) -> str:
+        return f"{self._schema_name}.{self._type_name}"
+
+    @property
+    def kind(self) -> str:
+        return self._kind
+
+    @property
+    def formatted_name(self) -> str:
+        return self._formatted_name
+
+    @property
+    def base_type_oid(self) -> int:
+        return self._base_type_oid
+
+    @property
+    def element_type_oid(self) -> int:
+        return self._element_type_oid
+
+    @property
+    def not_null(self) -> bool:
+        return self._not_null
+
+    @property
+    def enum_labels(self) -> List[str]:
+        return self._enum_labels
+
+    @property
+    def check_constraints(self) -> List[str]:
+        return self._check_constraints
+
+    @property
+    def is_enum(self) -> bool:
+        return self._kind == TYPE_KIND_ENUM
+
+    @property
+    def is_domain(self) -> bool:
+        return self._kind == TYPE_KIND_DOMAIN
+
+    @property
+    def is_array(self) -> bool:
+        return self._element_type_oid != 0 and self._kind == TYPE_KIND_BASE
+
+    def add_enum_label(self, label: str):
+        self._enum_labels.append(label)
+
+    def add_check_constraint(self, definition: str):
+        self._check_constraints.append(definition)
+
+    def __str__(self):
+        return f"{self.full_type_name} ({self._kind}): {self._formatted_name}"
+
+
+class TypeRegistry:
+
+    def __init__(self):
+        self._types_by_oid: Dict[int, SqlType] = {}
+
+    def add_type(self, sql_type: SqlType):
+        self._types_by_oid[sql_type.oid] = sql_type
+
+    def get_all_types(self) -> List[SqlType]:
+        return list(self._types_by_oid.values())
+
+    def has_type(self, oid: int) -> bool:
+        return oid in self._types_by_oid
+
+    def get_type(self, oid: int) -> SqlType:
+        if oid not in self._types_by_oid:
+            raise ValueError(f"Type with oid {oid} not found in registry")
+
+        return self._types_by_oid[oid]
+
+    def resolve_base_type(self, sql_type: SqlType) -> SqlType:
+        # Domains are generated as their underlying type
+        while sql_type.is_domain and self.has_type(sql_type.base_type_oid):
+            sql_type = self.get_type(sql_type.base_type_oid)
+
+        return sql_type
+
+    def get_data_type(self, sql_type: SqlType) -> str:
+        # Same naming as information_schema.columns.data_type
+        base_type = self.resolve_base_type(sql_type)
+
+        if base_type.is_array:
+            return "ARRAY"
+
+        if base_type.kind in (TYPE_KIND_ENUM, TYPE_KIND_COMPOSITE):
+            return "USER-DEFINED"
+
+        return base_type.formatted_name
+
+
+def load_type_registry(db_connection: Connection) -> TypeRegistry:
+    registry = TypeRegistry()
+    cursor = db_connection.cursor()
+
+    # Every type with its domain base type and array element type
+    cursor.execute(
+        """
+        SELECT
+            t.oid, n.nspname, t.typname, t.typtype, format_type(t.oid, NULL),
+            t.typbasetype, t.typelem, t.typnotnull
+        FROM pg_catalog.pg_type t
+        JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace;
+        """
+    )
+    for row in cursor.fetchall():
+        (
+            oid,
+            schema_name,
+            type_name,
+            kind,
+            formatted_name,
+            base_type_oid,
+            element_type_oid,
+            not_null,
+        ) = row
+        registry.add_type(
+            SqlType(
+                oid=oid,
+                schema_name=schema_name,
+                type_name=type_name,
+                kind=kind,
+                formatted_name=formatted_name,
+                base_type_oid=base_type_oid,
+                element_type_oid=element_type_oid,
+                not_null=not_null,
+            )
+        )
+
+    # Labels of all the enums
+    cursor.execute(
+        """
+        SELECT enumtypid, enumlabel
+        FROM pg_catalog.pg_enum
+        ORDER BY enumtypid, enumsortorder;
+        """
+    )
+    for enum_type_oid, label in cursor.fetchall():
+        registry.get_type(enum_type_oid).add_enum_label(label)
+
+    # Check constraints of all the domains
+    cursor.execute(
+        """
+        SELECT contypid, pg_get_constraintdef(oid)
+        FROM pg_catalog.pg_constraint
+        WHERE contypid <> 0 AND contype = 'c';
+        """
+    )
+    for domain_type_oid, definition in cursor.fetchall():
+        registry.get_type(domain_type_oid).add_check_constraint(definition)
+
+    get_metrics().increment(CATALOG_SCOPE, "catalog_queries", 3)
+
+    return registry
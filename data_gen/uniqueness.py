@@ -0,0 +1,420 @@
+import datetime
+import logging
+import math
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from psycopg import AsyncConnection, Connection, sql
+
+from data_gen.loader import table_identifier
+from data_gen.metrics import get_metrics
+from data_gen.parameters import BATCH_SIZE_DEFAULT, BLOOM_ERROR_RATE, UNIQUE_SET_MAX_ROWS
+from data_gen.scale import FanOut
+from data_gen.table_node import ForeignKeyConstraint, TableColumn, TableNode, UniqueConstraint
+
+# Data types compared as 64 bit integers and as doubles, everything else is
+# compared as text
+_INTEGER_TYPES = (
+    "bigint",
+    "integer",
+    "smallint",
+    "boolean",
+    "date",
+    "timestamp",
+    "timestamp with time zone",
+    "timestamp without time zone",
+)
+_FLOAT_TYPES = ("numeric", "real", "double precision")
+_DATE_TYPES = ("date",)
+
+_EPOCH_DATE = datetime.date(1970, 1, 1)
+_EPOCH_TIMESTAMP = datetime.datetime(1970, 1, 1)
+
+logger = logging.getLogger(__name__)
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    # Mixes every bit of the input into every bit of the output
+    values = values.astype(np.uint64)
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _to_integer(value: Any, column: TableColumn) -> int:
+    # Days or microseconds since the epoch, as the database computes them
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return (value - _EPOCH_TIMESTAMP) // datetime.timedelta(microseconds=1)
+    if isinstance(value, datetime.date):
+        return (value - _EPOCH_DATE).days
+    if isinstance(value, np.datetime64):
+        unit = "D" if column.data_type in _DATE_TYPES else "us"
+        return int(value.astype(f"datetime64[{unit}]").astype(np.int64))
+    return int(value)
+
+
+def _column_hashes(values: np.ndarray, column: TableColumn) -> Tuple[np.ndarray, np.ndarray]:
+    # 64 bit hash of every value, equal for values the database considers
+    # equal, and the mask of the NULLs
+    if values.dtype == object:
+        nulls = np.array([value is None for value in values.tolist()], dtype=bool)
+        present = [value for value in values.tolist() if value is not None]
+    else:
+        nulls = np.zeros(len(values), dtype=bool)
+        present = None
+
+    if column.data_type in _INTEGER_TYPES:
+        if present is not None:
+            integers = np.array([_to_integer(value, column) for value in present], dtype=np.int64)
+        elif values.dtype.kind == "M":
+            unit = "D" if column.data_type in _DATE_TYPES else "us"
+            integers = values.astype(f"datetime64[{unit}]").astype(np.int64)
+        else:
+            integers = values.astype(np.int64)
+        hashes = _splitmix64(integers.view(np.uint64))
+    elif column.data_type in _FLOAT_TYPES:
+        floats = np.array(present, dtype=np.float64) if present is not None else values
+        # Values are stored as single precision in real columns
+        if column.data_type == "real":
+            floats = floats.astype(np.float32)
+        floats = floats.astype(np.float64) + 0.0
+        hashes = _splitmix64(floats.view(np.uint64))
+    else:
+        texts = present if present is not None else values.tolist()
+        # Padding of character(n) is not significant
+        if column.data_type == "character":
+            texts = [str(text).rstrip(" ") for text in texts]
+        hashes = np.fromiter(
+            (hash(str(text)) for text in texts), dtype=np.int64, count=len(texts)
+        ).view(np.uint64)
+
+    if present is None:
+        return hashes, nulls
+
+    all_hashes = np.zeros(len(values), dtype=np.uint64)
+    all_hashes[~nulls] = hashes
+    return all_hashes, nulls
+
+
+def fingerprint_rows(
+    columns: Sequence[Tuple[np.ndarray, TableColumn]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    # 64 bit fingerprint of the values of every row in the columns, and the
+    # mask of the rows with a NULL, which never conflict
+    num_rows = len(columns[0][0])
+    fingerprints = np.zeros(num_rows, dtype=np.uint64)
+    nulls = np.zeros(num_rows, dtype=bool)
+
+    for values, column in columns:
+        hashes, column_nulls = _column_hashes(values, column)
+        fingerprints = _splitmix64(fingerprints ^ hashes)
+        nulls |= column_nulls
+
+    return fingerprints, nulls
+
+
+class UniqueFilter(ABC):
+    # Fingerprints of the values a unique constraint already holds. Two
+    # different values may share a fingerprint, which only makes the second
+    # one be generated again, but a value is never taken for a new one.
+
+    @abstractmethod
+    def contains(self, fingerprints: np.ndarray) -> np.ndarray: ...
+
+    @abstractmethod
+    def add(self, fingerprints: np.ndarray): ...
+
+    def find_duplicates(self, fingerprints: np.ndarray) -> np.ndarray:
+        # Marks the fingerprints seen before or earlier in the same array, and
+        # remembers the others
+        duplicates = np.ones(len(fingerprints), dtype=bool)
+        _, first_indices = np.unique(fingerprints, return_index=True)
+        duplicates[first_indices] = False
+        duplicates |= self.contains(fingerprints)
+
+        self.add(fingerprints[~duplicates])
+        return duplicates
+
+
+class HashSetFilter(UniqueFilter):
+    # Exact set of the fingerprints
+
+    def __init__(self):
+        self._fingerprints: set = set()
+
+    def contains(self, fingerprints: np.ndarray) -> np.ndarray:
+        seen = self._fingerprints
+        return np.fromiter(
+            (fingerprint in seen for fingerprint in fingerprints.tolist()),
+            dtype=bool,
+            count=len(fingerprints),
+        )
+
+    def add(self, fingerprints: np.ndarray):
+        self._fingerprints.update(fingerprints.tolist())
+
+
+class BloomFilter(UniqueFilter):
+    # Bit array sized for capacity fingerprints and the error rate, set and
+    # tested with numpy. A false positive only costs a retry.
+
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self._num_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._num_hashes = max(1, round(self._num_bits / capacity * math.log(2)))
+        self._words = np.zeros((self._num_bits + 63) // 64, dtype=np.uint64)
+
+    def _positions(self, fingerprints: np.ndarray) -> np.ndarray:
+        # Double hashing, num_hashes positions per fingerprint
+        step = _splitmix64(fingerprints) | np.uint64(1)
+        hashes = np.arange(self._num_hashes, dtype=np.uint64)
+        return (fingerprints[:, None] + hashes[None, :] * step[:, None]) % np.uint64(
+            self._num_bits
+        )
+
+    def contains(self, fingerprints: np.ndarray) -> np.ndarray:
+        positions = self._positions(fingerprints)
+        bits = (self._words[positions >> np.uint64(6)] >> (positions & np.uint64(63))) & np.uint64(1)
+        return bits.astype(bool).all(axis=1)
+
+    def add(self, fingerprints: np.ndarray):
+        positions = self._positions(fingerprints).ravel()
+        np.bitwise_or.at(
+            self._words, positions >> np.uint64(6), np.uint64(1) << (positions & np.uint64(63))
+        )
+
+
+def create_unique_filter(capacity: int) -> UniqueFilter:
+    # Exact up to UNIQUE_SET_MAX_ROWS values, a Bloom filter of a few bits
+    # per value past that
+    if capacity <= UNIQUE_SET_MAX_ROWS:
+        return HashSetFilter()
+    return BloomFilter(capacity)
+
+
+def get_unique_foreign_keys(table: TableNode) -> List[ForeignKeyConstraint]:
+    # Foreign keys whose columns are unique (one to one)
+    return [
+        relationship
+        for relationship in table.parent_relationships
+        if any(
+            set(constraint.column_names) <= set(relationship.child_columns)
+            for constraint in table.unique_constraints
+        )
+    ]
+
+
+def resolve_fan_outs(table: TableNode, fan_outs: Optional[Dict[str, FanOut]]) -> Dict[str, FanOut]:
+    # A unique foreign key gives every child row its own parent key, unless
+    # the scale spec says otherwise
+    resolved = dict(fan_outs) if fan_outs is not None else {}
+
+    for relationship in get_unique_foreign_keys(table):
+        if relationship.constraint_name not in resolved:
+            resolved[relationship.constraint_name] = FanOut("fixed", children=1)
+
+    return resolved
+
+
+def check_unique_keys(parent_table: str, fan_out: FanOut, num_rows: int, num_keys: int):
+    # The rows of a unique foreign key, numbered from 0, each need a parent
+    # key of their own rather than wrapping around to the first ones
+    if num_rows > num_keys * fan_out.children:
+        raise ValueError(
+            f"Not enough keys in {parent_table} for a unique foreign key: {num_rows} rows need as many keys, only {num_keys} are available"
+        )
+
+
+def get_checked_constraints(
+    table: TableNode,
+    unique_offsets: Optional[Dict[str, int]],
+    fan_outs: Optional[Dict[str, FanOut]] = None,
+    deferred_columns: Optional[Iterable[str]] = None,
+) -> List[UniqueConstraint]:
+    # Unique constraints that the generated values have to be checked
+    # against. The others hold by construction: one of their columns is
+    # numbered by the database or from the row index, is a random UUID, or is
+    # a foreign key giving every row its own parent key. The latter starts
+    # after the keys of the rows already in the table (its offset in
+    # unique_offsets, by constraint name), which may have referenced any key,
+    # so it is checked when there were such rows.
+    unique_offsets = unique_offsets if unique_offsets is not None else {}
+    fan_outs = resolve_fan_outs(table, fan_outs)
+    deferred_columns = set(deferred_columns) if deferred_columns is not None else set()
+
+    foreign_key_columns = {
+        child_column
+        for relationship in table.parent_relationships
+        for child_column in relationship.child_columns
+    }
+    row_unique_columns = {
+        child_column
+        for relationship in table.parent_relationships
+        if fan_outs.get(relationship.constraint_name) is not None
+        and fan_outs[relationship.constraint_name].distribution == "fixed"
+        and fan_outs[relationship.constraint_name].children == 1
+        and unique_offsets.get(relationship.constraint_name, 0) == 0
+        for child_column in relationship.child_columns
+    }
+
+    checked: List[UniqueConstraint] = []
+    for constraint in table.unique_constraints:
+        columns = [table.get_column(name) for name in constraint.column_names]
+
+        # Patched after the load, they can't be checked while generating
+        if any(column.column_name in deferred_columns for column in columns):
+            continue
+
+        if any(
+            column.is_auto_generated
+            or column.column_name in unique_offsets
+            or column.column_name in row_unique_columns
+            or (column.data_type == "uuid" and column.column_name not in foreign_key_columns)
+            for column in columns
+        ):
+            continue
+
+        checked.append(constraint)
+
+    return checked
+
+
+def _canonical_expression(column: TableColumn) -> sql.Composed:
+    # The value of the column as _column_hashes sees the generated values
+    identifier = sql.Identifier(column.column_name)
+
+    if column.data_type in _DATE_TYPES:
+        return sql.SQL("({} - DATE '1970-01-01')::int8").format(identifier)
+    if column.data_type.startswith("timestamp"):
+        return sql.SQL("(extract(epoch FROM {}) * 1000000)::int8").format(identifier)
+    if column.data_type == "boolean":
+        return sql.SQL("{}::int::int8").format(identifier)
+    if column.data_type in _INTEGER_TYPES:
+        return sql.SQL("{}::int8").format(identifier)
+    if column.data_type in _FLOAT_TYPES:
+        return sql.SQL("{}::float8").format(identifier)
+    return sql.SQL("{}::text").format(identifier)
+
+
+def _existing_values_query(table: TableNode, columns: List[TableColumn]) -> sql.Composed:
+    return sql.SQL("SELECT {} FROM {} WHERE {}").format(
+        sql.SQL(", ").join(_canonical_expression(column) for column in columns),
+        table_identifier(table),
+        sql.SQL(" AND ").join(
+            sql.SQL("{} IS NOT NULL").format(sql.Identifier(column.column_name))
+            for column in columns
+        ),
+    )
+
+
+def _add_existing_rows(unique_filter: UniqueFilter, columns: List[TableColumn], rows: List[Tuple]):
+    if not rows:
+        return
+
+    arrays: List[Tuple[np.ndarray, TableColumn]] = []
+    for position, column in enumerate(columns):
+        values = [row[position] for row in rows]
+        if column.data_type in _INTEGER_TYPES:
+            arrays.append((np.array(values, dtype=np.int64), column))
+        elif column.data_type in _FLOAT_TYPES:
+            arrays.append((np.array(values, dtype=np.float64), column))
+        else:
+            arrays.append((np.asarray(values + [None], dtype=object)[:-1], column))
+
+    # The canonical values already went through the casts of the database
+    fingerprints, _ = fingerprint_rows(
+        [(values, _canonical_column(column)) for values, column in arrays]
+    )
+    unique_filter.add(fingerprints)
+
+
+def _canonical_column(column: TableColumn) -> TableColumn:
+    # Dates and timestamps come back as integers, which must not be converted
+    # again
+    if column.data_type in _DATE_TYPES or column.data_type.startswith("timestamp"):
+        return TableColumn(column_name=column.column_name, data_type="bigint", is_nullable=True)
+    return column
+
+
+def create_unique_filters(
+    constraints: List[UniqueConstraint], num_rows: int
+) -> Dict[str, UniqueFilter]:
+    # Empty filters, for tables that start out empty
+    return {
+        constraint.constraint_name: create_unique_filter(num_rows) for constraint in constraints
+    }
+
+
+def load_unique_filters(
+    table: TableNode,
+    constraints: List[UniqueConstraint],
+    num_rows: int,
+    db_connection: Connection,
+) -> Dict[str, UniqueFilter]:
+    # Filters holding the values already in the table, e.g. from a previous
+    # run, read in batches through a server side cursor. The table is counted
+    # once for all of them.
+    unique_filters: Dict[str, UniqueFilter] = {}
+    metrics = get_metrics()
+
+    with metrics.timer(table.full_table_name, "unique_load"):
+        cursor = db_connection.cursor()
+        cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(table_identifier(table)))
+        num_existing = cursor.fetchone()[0]
+
+    for constraint in constraints:
+        columns = [table.get_column(name) for name in constraint.column_names]
+
+        with metrics.timer(table.full_table_name, "unique_load"):
+            unique_filter = create_unique_filter(num_existing + num_rows)
+            if num_existing > 0:
+                with db_connection.cursor(name="data_gen_unique_values") as values_cursor:
+                    values_cursor.execute(_existing_values_query(table, columns))
+                    while True:
+                        rows = values_cursor.fetchmany(BATCH_SIZE_DEFAULT)
+                        if not rows:
+                            break
+                        _add_existing_rows(unique_filter, columns, rows)
+
+        unique_filters[constraint.constraint_name] = unique_filter
+
+    return unique_filters
+
+
+async def load_unique_filters_async(
+    table: TableNode,
+    constraints: List[UniqueConstraint],
+    num_rows: int,
+    db_connection: AsyncConnection,
+) -> Dict[str, UniqueFilter]:
+    unique_filters: Dict[str, UniqueFilter] = {}
+    metrics = get_metrics()
+
+    with metrics.timer(table.full_table_name, "unique_load"):
+        cursor = db_connection.cursor()
+        await cursor.execute(
+            sql.SQL("SELECT count(*) FROM {}").format(table_identifier(table))
+        )
+        num_existing = (await cursor.fetchone())[0]
+
+    for constraint in constraints:
+        columns = [table.get_column(name) for name in constraint.column_names]
+
+        with metrics.timer(table.full_table_name, "unique_load"):
+            unique_filter = create_unique_filter(num_existing + num_rows)
+            if num_existing > 0:
+                async with db_connection.cursor(name="data_gen_unique_values") as values_cursor:
+                    await values_cursor.execute(_existing_values_query(table, columns))
+                    while True:
+                        rows = await values_cursor.fetchmany(BATCH_SIZE_DEFAULT)
+                        if not rows:
+                            break
+                        _add_existing_rows(unique_filter, columns, rows)
+
+        unique_filters[constraint.constraint_name] = unique_filter
+
+    return unique_filters
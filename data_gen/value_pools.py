@@ -0,0 +1,104 @@
+import logging
+import pathlib
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from data_gen.parameters import VALUE_POOL_SEED, VALUE_POOL_SIZE
+
+# Providers only know so many distinct values (e.g. Faker has a few hundred
+# first names), so building stops once they keep repeating themselves
+_MAX_ATTEMPTS_FACTOR = 3
+_MAX_CONSECUTIVE_DUPLICATES = 1000
+
+logger = logging.getLogger(__name__)
+
+# Faker provider -> distinct values, built once per process
+_pools: Dict[str, np.ndarray] = {}
+_pool_file: Optional[pathlib.Path] = None
+_lock = threading.Lock()
+
+
+def set_pool_file(path: Optional[pathlib.Path]):
+    # Pools are read from this file when it has them and saved to it when they
+    # have to be built, so Faker only runs on the first use
+    global _pool_file
+    with _lock:
+        _pool_file = path
+
+
+def get_pool_file() -> Optional[pathlib.Path]:
+    return _pool_file
+
+
+def _load_pool_file(path: pathlib.Path):
+    try:
+        with np.load(path, allow_pickle=False) as saved_pools:
+            for provider in saved_pools.files:
+                _pools.setdefault(provider, saved_pools[provider])
+    except (OSError, ValueError) as error:
+        logger.warning("Ignoring unreadable value pool file %s: %s", path, error)
+
+
+def _save_pool_file(path: pathlib.Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Written to a temporary file first, so concurrent processes never read a
+    # partial file
+    temporary_path = path.with_name(path.name + ".tmp")
+    with open(temporary_path, "wb") as pool_file:
+        np.savez(pool_file, **_pools)
+    temporary_path.replace(path)
+
+
+def build_pool(provider: str, size: int = VALUE_POOL_SIZE) -> np.ndarray:
+    # The Faker instance has a fixed seed so that every process (and every
+    # run) builds the same pool. Faker is slow to import and only needed
+    # when the pool file lacks the pool.
+    from faker import Faker
+
+    fake = Faker()
+    fake.seed_instance(VALUE_POOL_SEED)
+    generate_value = getattr(fake, provider)
+
+    values: Dict[str, None] = {}
+    consecutive_duplicates = 0
+    for _ in range(size * _MAX_ATTEMPTS_FACTOR):
+        value = generate_value()
+        if value in values:
+            consecutive_duplicates += 1
+            if consecutive_duplicates >= _MAX_CONSECUTIVE_DUPLICATES:
+                break
+            continue
+
+        values[value] = None
+        consecutive_duplicates = 0
+        if len(values) >= size:
+            break
+
+    return np.asarray(list(values), dtype=str)
+
+
+def get_pool(provider: str) -> np.ndarray:
+    pool = _pools.get(provider)
+    if pool is not None:
+        return pool
+
+    with _lock:
+        if provider not in _pools and _pool_file is not None and _pool_file.exists():
+            _load_pool_file(_pool_file)
+
+        if provider not in _pools:
+            logger.info("Building the value pool of %s", provider)
+            _pools[provider] = build_pool(provider)
+
+            if _pool_file is not None:
+                _save_pool_file(_pool_file)
+
+        return _pools[provider]
+
+
+def sample_pool(provider: str, rng: np.random.Generator, num_rows: int) -> np.ndarray:
+    pool = get_pool(provider)
+    return pool[rng.integers(0, len(pool), size=num_rows)]
@@ -0,0 +1,135 @@
+import pytest
+
+from data_gen.depgraph import DepGraph
+from data_gen.table_node import TableNode
+
+
+def _graph(*table_names):
+    dep_graph = DepGraph()
+    for table_name in table_names:
+        dep_graph.add_table(TableNode(table_name))
+    return dep_graph
+
+
+def test_fill_order_follows_the_edges_added_in_bulk():
+    dep_graph = _graph("app.b", "app.a")
+    assert set(dep_graph.get_fill_order()) == {"app.a", "app.b"}
+
+    dep_graph.add_edges_from([("app.b", "app.a")])
+    assert dep_graph.get_fill_order() == ["app.b", "app.a"]
+
+    dep_graph.remove_edge("app.b", "app.a")
+    dep_graph.add_edges_from([("app.a", "app.b")])
+    assert dep_graph.get_fill_order() == ["app.a", "app.b"]
+
+
+def test_fill_order_forgets_removed_tables():
+    dep_graph = _graph("app.a", "app.b", "app.c")
+    dep_graph.get_fill_order()
+
+    dep_graph.remove_node("app.b")
+    assert set(dep_graph.get_fill_order()) == {"app.a", "app.c"}
+
+    dep_graph.remove_nodes_from(["app.c"])
+    assert dep_graph.get_fill_order() == ["app.a"]
+
+
+def _cycle_graph(foreign_keys):
+    # foreign_keys: (child, parent, nullable, deferrable), columns named
+    # after the parent
+    dep_graph = DepGraph()
+    tables = {}
+    for child, parent, _, _ in foreign_keys:
+        for table_name in (child, parent):
+            if table_name not in tables:
+                tables[table_name] = TableNode(table_name)
+                tables[table_name].add_column("id", "integer", is_nullable=False)
+                dep_graph.add_table(tables[table_name])
+
+    for child, parent, nullable, deferrable in foreign_keys:
+        column = f"{parent.split('.')[1]}_id"
+        tables[child].add_column(column, "integer", is_nullable=nullable)
+        dep_graph.add_child(
+            tables[child],
+            tables[parent],
+            f"{child.split('.')[1]}_{column}_fkey",
+            ["id"],
+            [column],
+            is_deferrable=deferrable,
+        )
+    return dep_graph
+
+
+def _deferred(dep_graph):
+    return [
+        relationship.constraint_name
+        for relationship in dep_graph.get_deferred_relationships()
+    ]
+
+
+def test_nullable_self_reference_is_deferred():
+    dep_graph = _cycle_graph([("app.employees", "app.employees", True, False)])
+
+    assert dep_graph.get_components() == [["app.employees"]]
+    assert _deferred(dep_graph) == ["employees_employees_id_fkey"]
+
+
+def test_deferrable_foreign_keys_are_only_deferred_when_needed():
+    # The nullable foreign key is enough to break the cycle
+    dep_graph = _cycle_graph(
+        [
+            ("app.depts", "app.employees", True, False),
+            ("app.employees", "app.depts", False, True),
+        ]
+    )
+    assert _deferred(dep_graph) == ["depts_employees_id_fkey"]
+    assert dep_graph.get_components() == [["app.depts", "app.employees"]]
+
+    # Without it, the NOT NULL deferrable one is deferred
+    dep_graph = _cycle_graph(
+        [
+            ("app.depts", "app.employees", False, False),
+            ("app.employees", "app.depts", False, True),
+        ]
+    )
+    assert _deferred(dep_graph) == ["employees_depts_id_fkey"]
+    assert dep_graph.get_components() == [["app.employees", "app.depts"]]
+
+
+def test_not_null_cycle_that_is_not_deferrable_can_not_be_filled():
+    dep_graph = _cycle_graph(
+        [
+            ("app.depts", "app.employees", False, False),
+            ("app.employees", "app.depts", False, False),
+        ]
+    )
+
+    with pytest.raises(ValueError, match="depts_employees_id_fkey"):
+        dep_graph.get_components()
+
+
+def test_components_in_fill_order():
+    # app.orgs <- (app.depts <-> app.employees) <- app.badges, and a
+    # self-referencing app.orgs
+    dep_graph = _cycle_graph(
+        [
+            ("app.badges", "app.employees", False, False),
+            ("app.depts", "app.orgs", False, False),
+            ("app.depts", "app.employees", True, False),
+            ("app.employees", "app.depts", False, False),
+            ("app.orgs", "app.orgs", True, False),
+        ]
+    )
+
+    assert dep_graph.get_components() == [
+        ["app.orgs"],
+        ["app.depts", "app.employees"],
+        ["app.badges"],
+    ]
+    assert dep_graph.get_fill_order() == [
+        "app.orgs",
+        "app.depts",
+        "app.employees",
+        "app.badges",
+    ]
+    assert _deferred(dep_graph) == ["orgs_orgs_id_fkey", "depts_employees_id_fkey"]
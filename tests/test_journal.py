@@ -0,0 +1,78 @@
+import pytest
+
+from data_gen.journal import Journal, TableProgress, subtract_ranges
+
+
+class RecordingJournal(Journal):
+
+    def __init__(self):
+        super().__init__()
+        self.ranges = []
+
+    def open(self, db_connection, resume):
+        pass
+
+    def start_table(self, table_name, unique_offsets, db_connection):
+        pass
+
+    def record_range(self, table_name, start_row, num_rows, db_connection):
+        self.ranges.append((table_name, start_row, num_rows))
+
+
+def test_subtract_nothing_committed():
+    assert subtract_ranges(0, 100, []) == [(0, 100)]
+
+
+def test_subtract_everything_committed():
+    assert subtract_ranges(0, 100, [(0, 60), (60, 40)]) == []
+
+
+def test_subtract_gaps_between_ranges():
+    assert subtract_ranges(0, 100, [(10, 20), (50, 10)]) == [(0, 10), (30, 20), (60, 40)]
+
+
+def test_subtract_unsorted_and_overlapping_ranges():
+    assert subtract_ranges(0, 100, [(40, 30), (0, 20), (10, 20)]) == [(30, 10), (70, 30)]
+
+
+def test_subtract_ranges_outside_the_rows():
+    assert subtract_ranges(100, 50, [(0, 100), (150, 10), (120, 0)]) == [(100, 50)]
+
+
+def test_subtract_ranges_straddling_the_rows():
+    assert subtract_ranges(100, 50, [(90, 20), (140, 30)]) == [(110, 30)]
+
+
+def test_table_progress_missing_ranges():
+    progress = TableProgress({"id": 5}, [(0, 200), (500, 50)])
+
+    assert progress.unique_offsets == {"id": 5}
+    assert progress.get_missing_ranges(0, 1000) == [(200, 300), (550, 450)]
+
+
+def test_batch_recorder_fills_the_ranges_in_order():
+    journal = RecordingJournal()
+    recorder = journal.batch_recorder("app.users", [(0, 20), (100, 10)])
+
+    for num_rows in (10, 10, 5, 5):
+        recorder(None, num_rows)
+
+    assert journal.ranges == [
+        ("app.users", 0, 10),
+        ("app.users", 0, 20),
+        ("app.users", 100, 5),
+        ("app.users", 100, 10),
+    ]
+
+
+def test_incomplete_journal_can_not_be_instantiated():
+    class NoRecordJournal(Journal):
+
+        def open(self, db_connection, resume):
+            pass
+
+        def start_table(self, table_name, unique_offsets, db_connection):
+            pass
+
+    with pytest.raises(TypeError):
+        NoRecordJournal()
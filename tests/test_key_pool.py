@@ -0,0 +1,26 @@
+import pytest
+
+from data_gen.key_pool import _is_key_range, _may_be_key_range
+
+
+@pytest.mark.parametrize(
+    "minimum, maximum, estimated_rows, expected",
+    [
+        (1, 1000, None, True),
+        (1, 1000, 990.0, True),
+        (1, 1000, 500.0, False),
+        ("a", "z", None, False),
+        (True, True, None, False),
+        (None, None, 0.0, False),
+    ],
+)
+def test_keys_are_counted_only_when_they_may_be_a_range(
+    minimum, maximum, estimated_rows, expected
+):
+    assert _may_be_key_range(minimum, maximum, estimated_rows) is expected
+
+
+def test_key_range_has_as_many_keys_as_values():
+    assert _is_key_range(5, 14, 10)
+    assert not _is_key_range(5, 14, 9)
+    assert not _is_key_range(None, None, 0)
@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+import pytest
+
+from data_gen.key_source import KeySource, Reservoir, _range_starts, _sample_percent
+from data_gen.parameters import KEY_RANGE_ROWS, KEY_SAMPLE_OVERSAMPLING
+
+
+def _stream(num_rows):
+    return [(index,) for index in range(num_rows)]
+
+
+def _fill(reservoir, rows, chunk_sizes):
+    start = 0
+    for chunk_size in chunk_sizes:
+        reservoir.add(rows[start : start + chunk_size])
+        start += chunk_size
+    assert start == len(rows)
+
+
+def test_reservoir_keeps_the_first_rows_until_it_is_full():
+    reservoir = Reservoir(10, np.random.default_rng(0))
+    rows = _stream(8)
+    _fill(reservoir, rows, [3, 5])
+
+    assert reservoir.num_seen == 8
+    assert reservoir.get_rows() == rows
+
+
+def test_reservoir_replaces_rows_once_full():
+    reservoir = Reservoir(10, np.random.default_rng(0))
+    rows = _stream(108)
+    # The second chunk fills the reservoir part way through
+    _fill(reservoir, rows, [4, 8, 96])
+
+    sample = reservoir.get_rows()
+    assert reservoir.num_seen == 108
+    assert len(sample) == 10
+    assert len(set(sample)) == 10
+    assert set(sample) <= set(rows)
+    assert sample == sorted(sample)
+    assert sample != rows[:10]
+
+
+def test_reservoir_sample_is_uniform():
+    # Every row of the stream is kept with probability capacity / rows,
+    # however the stream is chunked
+    rows = _stream(20)
+    counts = np.zeros(len(rows))
+    num_samples = 4000
+    for seed in range(num_samples):
+        reservoir = Reservoir(5, np.random.default_rng(seed))
+        _fill(reservoir, rows, [3, 4, 13])
+        for (index,) in reservoir.get_rows():
+            counts[index] += 1
+
+    expected = num_samples * 5 / 20
+    assert np.all(np.abs(counts - expected) < 0.15 * expected)
+
+
+def test_same_seed_gives_the_same_sample():
+    def sample(key_source):
+        reservoir = Reservoir(10, key_source.get_rng("app.users", "id", 0))
+        _fill(reservoir, _stream(1000), [100] * 10)
+        return reservoir.get_rows()
+
+    assert sample(KeySource(seed=7)) == sample(KeySource(seed=7))
+    assert sample(KeySource(seed=7)) != sample(KeySource(seed=8))
+    assert KeySource(seed=7).get_repeatable("app.users", "id", 0) == KeySource(
+        seed=7
+    ).get_repeatable("app.users", "id", 0)
+
+    # A refreshed sample differs
+    key_source = KeySource(seed=7)
+    assert key_source.get_repeatable("app.users", "id", 0) != key_source.get_repeatable(
+        "app.users", "id", 1
+    )
+    assert KeySource().get_repeatable("app.users", "id", 0) is None
+
+
+def test_sample_percent():
+    assert _sample_percent(1000, None) == 100.0
+    assert _sample_percent(1000, 0.0) == 100.0
+    # Tables about as small as the sample are read whole
+    assert _sample_percent(1000, 1000.0) == 100.0
+    assert _sample_percent(1000, 10**8) == pytest.approx(
+        100.0 * 1000 * KEY_SAMPLE_OVERSAMPLING / 10**8
+    )
+
+
+def test_range_starts():
+    max_keys = 3 * KEY_RANGE_ROWS + 1
+    starts = _range_starts(np.random.default_rng(0), 10, 20, max_keys)
+
+    assert len(starts) == math.ceil(max_keys / KEY_RANGE_ROWS)
+    assert starts == sorted(starts)
+    assert all(10 <= start <= 20 for start in starts)
+    assert _range_starts(np.random.default_rng(0), 10, 20, max_keys) == starts
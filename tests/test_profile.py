@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from data_gen.profile import _parse_timestamp
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2020-01-01 00:00:00", "2020-01-01T00:00:00"),
+        ("2020-01-01 00:00:00.5+00", "2020-01-01T00:00:00.500000"),
+        ("2020-01-01 12:30:00.123+02", "2020-01-01T10:30:00.123000"),
+        ("2020-01-01 00:00:00-05:30", "2020-01-01T05:30:00"),
+        ("1890-03-01 00:00:00+00:09:21", "1890-02-28T23:50:39"),
+    ],
+)
+def test_timestamps_as_printed_by_postgres(value, expected):
+    assert _parse_timestamp(value) == np.datetime64(expected, "us")
+
+
+@pytest.mark.parametrize("value", ["infinity", "0044-03-15 00:00:00 BC", "2020-13-01 00:00:00"])
+def test_unreadable_timestamps(value):
+    with pytest.raises(ValueError):
+        _parse_timestamp(value)
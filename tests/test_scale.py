@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from data_gen.depgraph import DepGraph
+from data_gen.scale import FanOut, ScaleSpec, get_row_counts
+from data_gen.table_node import TableNode
+
+
+def _graph():
+    # app.users <- app.sessions, app.users <- app.memberships -> app.orgs
+    dep_graph = DepGraph()
+    tables = {}
+    for table_name in ("users", "orgs", "sessions", "memberships"):
+        table = TableNode(f"app.{table_name}")
+        table.add_column("id", "integer", is_nullable=False)
+        dep_graph.add_table(table)
+        tables[table_name] = table
+
+    for child, parent, column in (
+        ("sessions", "users", "user_id"),
+        ("memberships", "users", "user_id"),
+        ("memberships", "orgs", "org_id"),
+    ):
+        tables[child].add_column(column, "integer")
+        dep_graph.add_child(
+            tables[child], tables[parent], f"{child}_{column}_fkey", ["id"], [column]
+        )
+
+    return dep_graph
+
+
+def test_fixed_fan_out_gives_every_key_its_children_in_turn():
+    fan_out = FanOut("fixed", children=3)
+    indices = fan_out.sample_indices(np.random.default_rng(0), 0, 12, 4)
+
+    assert indices.tolist() == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3]
+
+
+def test_fixed_fan_out_depends_on_the_row_index_only():
+    fan_out = FanOut("fixed", children=2)
+    whole = fan_out.sample_indices(np.random.default_rng(0), 0, 10, 5)
+    second_half = fan_out.sample_indices(np.random.default_rng(1), 5, 5, 5)
+
+    assert second_half.tolist() == whole[5:].tolist()
+
+
+@pytest.mark.parametrize("distribution", ["uniform", "zipf"])
+def test_random_fan_outs_stay_within_the_keys(distribution):
+    fan_out = FanOut(distribution, exponent=1.2)
+    indices = fan_out.sample_indices(np.random.default_rng(0), 0, 10000, 50)
+
+    assert indices.min() >= 0
+    assert indices.max() < 50
+
+
+def test_zipf_favours_the_first_keys():
+    fan_out = FanOut("zipf", exponent=1.5)
+    counts = np.bincount(fan_out.sample_indices(np.random.default_rng(0), 0, 10000, 100))
+
+    assert counts[0] > counts[10] > counts[90]
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"distribution": "pareto"},
+        {"distribution": "zipf", "exponent": 0},
+        {"distribution": "fixed", "children": 0},
+    ],
+)
+def test_invalid_fan_outs(settings):
+    with pytest.raises(ValueError):
+        FanOut(**settings)
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"scale": 0},
+        {"scale": 2, "rows": 10},
+        {"tables": {"app.users": "many"}},
+        {"tables": {"app.users": -1}},
+        {"foreign_keys": {"app.sessions.user_id": {"distribution": "zipf", "skew": 2}}},
+        {"foreign_keys": {"app.sessions.user_id": 3}},
+    ],
+)
+def test_invalid_scale_specs(spec):
+    with pytest.raises(ValueError):
+        ScaleSpec.from_dict(spec)
+
+
+def test_row_counts_without_a_spec():
+    assert set(get_row_counts(_graph(), 7, None).values()) == {7}
+
+
+def test_row_counts_are_scaled_and_relative_to_parents():
+    spec = ScaleSpec.from_dict(
+        {
+            "scale": 10,
+            "tables": {
+                "app.users": 100,
+                "app.orgs": {"rows": 5},
+                "app.sessions": {"per_parent": 2.5},
+            },
+            "foreign_keys": {"app.memberships.org_id": {"distribution": "fixed", "children": 3}},
+        }
+    )
+
+    assert spec.get_row_counts(_graph(), 1) == {
+        "app.users": 1000,
+        "app.orgs": 50,
+        "app.sessions": 2500,
+        "app.memberships": 150,
+    }
+
+
+def test_relative_table_with_several_parents_needs_a_parent():
+    spec = ScaleSpec.from_dict({"tables": {"app.memberships": {"per_parent": 2}}})
+
+    with pytest.raises(ValueError):
+        spec.get_row_counts(_graph(), 10)
+
+
+def test_fan_out_found_by_constraint_or_column():
+    spec = ScaleSpec.from_dict(
+        {
+            "foreign_keys": {
+                "app.sessions.user_id": "zipf",
+                "app.memberships.memberships_org_id_fkey": {"distribution": "fixed"},
+            }
+        }
+    )
+    graph = _graph()
+
+    assert {
+        name: str(fan_out)
+        for name, fan_out in spec.get_fan_outs(graph.get_table("app.sessions")).items()
+    } == {"sessions_user_id_fkey": "zipf(1.1)"}
+    assert {
+        name: str(fan_out)
+        for name, fan_out in spec.get_fan_outs(graph.get_table("app.memberships")).items()
+    } == {"memberships_org_id_fkey": "fixed(1)"}
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from data_gen.depgraph import DepGraph
+from data_gen.key_pool import KeyPool
+from data_gen.parameters import SEED_BLOCK_SIZE
+from data_gen.plan import compile_table_plan
+from data_gen.table_node import TableNode
+
+# Rows on both sides of the first block boundary
+_FIRST_ROW = SEED_BLOCK_SIZE - 20
+_NUM_ROWS = 45
+
+
+def _plan(seed):
+    dep_graph = DepGraph()
+    users = TableNode("app.users")
+    users.add_column("id", "integer", is_nullable=False)
+    events = TableNode("app.events")
+    for column_name, data_type in (
+        ("score", "integer"),
+        ("amount", "numeric"),
+        ("day", "date"),
+        ("flag", "boolean"),
+        ("word", "text"),
+        ("user_id", "integer"),
+    ):
+        events.add_column(column_name, data_type)
+    dep_graph.add_table(users)
+    dep_graph.add_table(events)
+    dep_graph.add_child(events, users, "events_user_id_fkey", ["id"], ["user_id"])
+
+    key_pool = KeyPool()
+    key_pool.add_keys("app.users", "id", range(1, 101))
+    return compile_table_plan(events, key_pool, dep_graph.type_registry, seed=seed)
+
+
+def _rows(batches):
+    batches = list(batches)
+    return {
+        column_name: np.concatenate([batch[column_name] for batch in batches]).tolist()
+        for column_name in batches[0]
+    }
+
+
+@pytest.mark.parametrize("batch_size", [7, 1000])
+def test_rows_do_not_depend_on_the_batch_size(batch_size):
+    plan = _plan(seed=42)
+    whole = _rows(
+        plan.iter_batches(np.random.default_rng(0), _NUM_ROWS, _NUM_ROWS, _FIRST_ROW)
+    )
+
+    # The random generator of the caller is not used either
+    split = _rows(
+        plan.iter_batches(np.random.default_rng(1), _NUM_ROWS, batch_size, _FIRST_ROW)
+    )
+
+    assert split == whole
+
+
+def test_any_row_can_be_generated_by_itself():
+    plan = _plan(seed=42)
+    whole = _rows(
+        plan.iter_batches(np.random.default_rng(0), _NUM_ROWS, _NUM_ROWS, _FIRST_ROW)
+    )
+
+    # A range starting past the first row, still across the block boundary
+    offset = 13
+    later = _rows(
+        plan.iter_batches(
+            np.random.default_rng(0), _NUM_ROWS - offset, 7, _FIRST_ROW + offset
+        )
+    )
+    assert later == {
+        column_name: values[offset:] for column_name, values in whole.items()
+    }
+
+    for row in (0, 19, 20, 44):
+        single = _rows(
+            plan.iter_batches(np.random.default_rng(0), 1, 1, _FIRST_ROW + row)
+        )
+        assert single == {
+            column_name: [values[row]] for column_name, values in whole.items()
+        }
+
+
+def test_seeds_give_different_rows():
+    rows = [
+        _rows(
+            plan.iter_batches(
+                np.random.default_rng(0), _NUM_ROWS, _NUM_ROWS, _FIRST_ROW
+            )
+        )
+        for plan in (_plan(seed=1), _plan(seed=2))
+    ]
+
+    assert rows[0]["score"] != rows[1]["score"]
@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+
+from data_gen.depgraph import DepGraph
+from data_gen.key_pool import KeyPool
+from data_gen.server_plan import (
+    _ROW_INDEX,
+    _uniform,
+    compile_server_plan,
+    insert_ranges,
+)
+from data_gen.table_node import TableNode
+
+
+def _events(*columns):
+    dep_graph = DepGraph()
+    users = TableNode("app.users")
+    users.add_column("id", "integer", is_nullable=False)
+    events = TableNode("app.events")
+    for column_name, data_type in columns:
+        events.add_column(column_name, data_type)
+    events.add_column("user_id", "integer")
+    dep_graph.add_table(users)
+    dep_graph.add_table(events)
+    dep_graph.add_child(events, users, "events_user_id_fkey", ["id"], ["user_id"])
+    return dep_graph, events
+
+
+def _compile(columns, seed=None):
+    dep_graph, events = _events(*columns)
+    return compile_server_plan(events, KeyPool(), dep_graph.type_registry, seed=seed)
+
+
+def test_database_types_are_generated_by_generate_series():
+    plan = _compile([("score", "integer"), ("day", "date"), ("flag", "boolean")])
+    statement = plan.statement.as_string(None)
+
+    assert not plan.has_fallback_columns
+    assert plan.column_names == ["score", "day", "flag", "user_id"]
+    assert statement.startswith(
+        'INSERT INTO "app"."events" ("score", "day", "flag", "user_id") SELECT '
+    )
+    assert "FROM generate_series(1, %(num_rows)s) AS g(i)" in statement
+    assert "(%(start_row)s + g.i - 1) AS row_index" in statement
+    # The foreign key is looked up in the copy of the parent keys
+    assert 'LEFT JOIN "pg_temp"."data_gen_parent_0" AS "parent_0"' in statement
+    assert '"parent_0"."key_0"' in statement
+    assert "random()" in statement
+
+
+def test_columns_generated_in_python_are_sent_as_arrays():
+    plan = _compile([("score", "integer"), ("word", "text")])
+    statement = plan.statement.as_string(None)
+
+    assert plan.has_fallback_columns
+    assert "generate_series" not in statement
+    assert (
+        'unnest(%(values_0)s::text[]) WITH ORDINALITY AS g("values_0", i)' in statement
+    )
+    assert 'r."values_0"::text' in statement
+
+
+def test_seeded_plan_hashes_the_row_index():
+    plan = _compile([("score", "integer")], seed=42)
+    statement = plan.statement.as_string(None)
+
+    assert "random()" not in statement
+    assert "hashint8extended(r.row_index, " in statement
+    # The foreign key picks are hashed as well
+    assert "hashint8extended((%(start_row)s + g.i - 1), " in statement
+
+
+def test_uniform_expression():
+    assert (
+        _uniform(None, ("app.events", "score"), _ROW_INDEX).as_string(None)
+        == "random()"
+    )
+
+    seeded = _uniform(42, ("app.events", "score"), _ROW_INDEX).as_string(None)
+    assert seeded.startswith("(((hashint8extended(r.row_index, ")
+    assert seeded.endswith(") >> 11) & 9007199254740991)::float8 / 9007199254740992)")
+    # Same seed and column, same expression, any other column hashes differently
+    assert _uniform(42, ("app.events", "score"), _ROW_INDEX).as_string(None) == seeded
+    assert _uniform(42, ("app.events", "day"), _ROW_INDEX).as_string(None) != seeded
+    assert _uniform(43, ("app.events", "score"), _ROW_INDEX).as_string(None) != seeded
+
+
+class _FakePlan:
+    def __init__(self, has_fallback_columns):
+        self.table = TableNode("app.events")
+        self.column_names = ["score"]
+        self.has_fallback_columns = has_fallback_columns
+        self.calls = []
+
+    def load_parent_keys(self, db_connection):
+        self.calls.append("load")
+
+    def drop_parent_keys(self, db_connection):
+        self.calls.append("drop")
+
+    def insert_rows(self, db_connection, rng, start_row, num_rows):
+        self.calls.append((start_row, num_rows))
+        return num_rows
+
+
+class _FakeConnection:
+    def __init__(self):
+        self.calls = []
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+@pytest.mark.parametrize(
+    "has_fallback_columns, commit_per_batch, expected_calls, expected_commits",
+    [
+        # One statement per range
+        (False, False, [(0, 25), (100, 3)], 1),
+        # Values sent from Python, batch_size rows at a time
+        (True, False, [(0, 10), (10, 10), (20, 5), (100, 3)], 1),
+        # Every batch in its own transaction
+        (False, True, [(0, 10), (10, 10), (20, 5), (100, 3)], 5),
+    ],
+)
+def test_insert_ranges_splits_the_ranges(
+    has_fallback_columns, commit_per_batch, expected_calls, expected_commits
+):
+    plan = _FakePlan(has_fallback_columns)
+    db_connection = _FakeConnection()
+
+    total_rows = insert_ranges(
+        plan,
+        db_connection,
+        np.random.default_rng(0),
+        [(0, 25), (100, 3)],
+        batch_size=10,
+        commit_per_batch=commit_per_batch,
+    )
+
+    assert total_rows == 28
+    assert plan.calls == ["load"] + expected_calls + ["drop"]
+    assert db_connection.calls == ["commit"] * expected_commits
+
+
+def test_insert_ranges_rolls_back_on_failure():
+    plan = _FakePlan(False)
+    db_connection = _FakeConnection()
+
+    def before_commit(db_connection, num_rows):
+        raise RuntimeError("failed")
+
+    with pytest.raises(RuntimeError):
+        insert_ranges(
+            plan,
+            db_connection,
+            np.random.default_rng(0),
+            [(0, 25)],
+            batch_size=10,
+            before_commit=before_commit,
+        )
+
+    assert plan.calls == ["load", (0, 25)]
+    assert db_connection.calls == ["rollback"]
@@ -0,0 +1,93 @@
+import struct
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from data_gen.sinks import (
+    _encode_numeric,
+    encode_copy_binary_column,
+    encode_copy_text_batch,
+    format_copy_text_column,
+    format_csv_column,
+)
+from data_gen.table_node import TableNode
+
+
+def test_copy_text_escapes_special_characters():
+    values = np.array(["a\tb", "c\nd", "back\\slash", "plain"])
+
+    assert format_copy_text_column(values) == ["a\\tb", "c\\nd", "back\\\\slash", "plain"]
+
+
+def test_copy_text_of_object_columns():
+    values = np.array([None, True, 3, "x\ry"], dtype=object)
+
+    assert format_copy_text_column(values) == ["\\N", "t", "3", "x\\ry"]
+
+
+def test_copy_text_of_typed_columns():
+    assert format_copy_text_column(np.array([1, -2])) == ["1", "-2"]
+    assert format_copy_text_column(np.array([True, False])) == ["t", "f"]
+    assert format_copy_text_column(np.array(["2024-01-02"], dtype="datetime64[D]")) == [
+        "2024-01-02"
+    ]
+
+
+def test_copy_text_batch():
+    batch = {"id": np.array([1, 2]), "name": np.array(["a", None], dtype=object)}
+
+    assert encode_copy_text_batch(batch) == b"1\ta\n2\t\\N\n"
+
+
+def test_csv_quotes_text_and_leaves_nulls_empty():
+    assert format_csv_column(np.array(['say "hi"', "x"])) == ['"say ""hi"""', '"x"']
+    assert format_csv_column(np.array([None, 1.5, Decimal("2"), "a,b"], dtype=object)) == [
+        "",
+        "1.5",
+        "2",
+        '"a,b"',
+    ]
+
+
+@pytest.mark.parametrize(
+    "value, encoded",
+    [
+        # As returned by numeric_send
+        ("0", "0000000000000000"),
+        ("1", "00010000000000000001"),
+        ("-12.5", "0002000040000001000c1388"),
+        ("10000", "00010001000000000001"),
+        ("0.0001", "0001ffff000000040001"),
+        ("123456.789", "0003000100000003000c0d801ed2"),
+    ],
+)
+def test_binary_numeric(value, encoded):
+    assert _encode_numeric(value).hex() == encoded
+
+
+def test_binary_columns():
+    table = TableNode("app.events")
+    table.add_column("id", "integer")
+    table.add_column("day", "date")
+    table.add_column("name", "text")
+
+    assert encode_copy_binary_column(table, "id", np.array([1, None], dtype=object)) == [
+        struct.pack(">i", 1),
+        None,
+    ]
+    # Days since 2000-01-01
+    assert encode_copy_binary_column(
+        table, "day", np.array(["2000-01-02"], dtype="datetime64[D]")
+    ) == [struct.pack(">i", 1)]
+    assert encode_copy_binary_column(table, "name", np.array(["é"], dtype=object)) == [
+        "é".encode("utf-8")
+    ]
+
+
+def test_binary_unsupported_type():
+    table = TableNode("app.events")
+    table.add_column("shape", "point")
+
+    with pytest.raises(ValueError):
+        encode_copy_binary_column(table, "shape", np.array([None], dtype=object))
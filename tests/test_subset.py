@@ -0,0 +1,84 @@
+import pytest
+
+from data_gen.depgraph import DepGraph
+from data_gen.subset import TableFilter
+from data_gen.table_node import TableNode
+
+
+def _graph():
+    # audit.accounts <- app.users <- app.orders, app.orgs <- app.users, and
+    # app.tags on its own
+    dep_graph = DepGraph()
+    tables = {}
+    for table_name in (
+        "app.orders",
+        "app.orgs",
+        "app.tags",
+        "app.users",
+        "audit.accounts",
+    ):
+        tables[table_name] = TableNode(table_name)
+        tables[table_name].add_column("id", "integer", is_nullable=False)
+        dep_graph.add_table(tables[table_name])
+
+    for child, parent, column in (
+        ("app.orders", "app.users", "user_id"),
+        ("app.users", "app.orgs", "org_id"),
+        ("app.users", "audit.accounts", "account_id"),
+    ):
+        tables[child].add_column(column, "integer", is_nullable=False)
+        dep_graph.add_child(
+            tables[child], tables[parent], f"{column}_fkey", ["id"], [column]
+        )
+    return dep_graph
+
+
+def test_schema_pattern_selects_the_whole_schema():
+    table_filter = TableFilter(include=["audit"])
+
+    assert table_filter.include == ["audit.*"]
+    assert table_filter.select(_graph().nodes) == ["audit.accounts"]
+
+
+def test_exclude_wins_over_include():
+    table_filter = TableFilter(include=["app.*"], exclude=["app.users", "*.tags"])
+
+    assert sorted(table_filter.select(_graph().nodes)) == ["app.orders", "app.orgs"]
+    assert not table_filter.matches("app.users")
+
+
+def test_no_patterns_select_every_table():
+    table_filter = TableFilter()
+
+    assert table_filter.is_empty
+    assert table_filter.matches("app.users")
+
+
+@pytest.mark.parametrize("include, exclude", [([""], []), ([], [""])])
+def test_empty_pattern_raises(include, exclude):
+    with pytest.raises(ValueError):
+        TableFilter(include=include, exclude=exclude)
+
+
+def test_subset_keeps_the_ancestors_of_excluded_parents():
+    dep_graph = _graph()
+    table_filter = TableFilter(include=["app"], exclude=["app.users", "app.tags"])
+    subset = dep_graph.subset(table_filter.select(dep_graph.nodes))
+
+    # app.users is excluded, but app.orders needs its keys and so their
+    # parents
+    assert sorted(subset.nodes) == [
+        "app.orders",
+        "app.orgs",
+        "app.users",
+        "audit.accounts",
+    ]
+    assert sorted(subset.edges) == [
+        ("app.orgs", "app.users"),
+        ("app.users", "app.orders"),
+        ("audit.accounts", "app.users"),
+    ]
+    assert subset.get_table("app.users") is dep_graph.get_table("app.users")
+    assert subset.get_fill_order().index("app.users") < subset.get_fill_order().index(
+        "app.orders"
+    )
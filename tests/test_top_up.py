@@ -0,0 +1,23 @@
+from data_gen.top_up import _get_size, _get_top_up
+
+
+def test_small_or_unanalyzed_tables_are_counted():
+    assert _get_size(None, 1000) is None
+    assert _get_size(0.0, 1000) is None
+    assert _get_size(999.9, 1000) is None
+
+
+def test_large_tables_use_the_estimate():
+    assert _get_size(1000.0, 1000) == 1000
+    assert _get_size(123456.7, 1000) == 123456
+
+
+def test_top_up_starts_after_the_current_rows():
+    # The new rows get the indices of the end of a single fill to the target
+    assert _get_top_up("app.users", 100, 0) == (100, 0)
+    assert _get_top_up("app.users", 100, 40) == (60, 40)
+
+
+def test_full_tables_are_skipped():
+    assert _get_top_up("app.users", 100, 100) == (0, 100)
+    assert _get_top_up("app.users", 100, 150) == (0, 150)
@@ -0,0 +1,157 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from data_gen.depgraph import DepGraph
+from data_gen.key_pool import KeyPool
+from data_gen.parameters import UNIQUE_SET_MAX_ROWS
+from data_gen.plan import compile_table_plan
+from data_gen.table_node import TableColumn, TableNode, UniqueConstraint
+from data_gen.uniqueness import (
+    BloomFilter,
+    HashSetFilter,
+    create_unique_filter,
+    fingerprint_rows,
+    get_checked_constraints,
+)
+
+
+def _profiles(num_authors):
+    # app.profiles.author_id is a unique foreign key to app.authors
+    dep_graph = DepGraph()
+    authors = TableNode("app.authors")
+    authors.add_column("id", "integer", is_nullable=False)
+    profiles = TableNode("app.profiles")
+    profiles.add_column("author_id", "integer", is_nullable=False)
+    profiles.add_unique_constraint(UniqueConstraint("profiles_author_id_key", ["author_id"]))
+    dep_graph.add_table(authors)
+    dep_graph.add_table(profiles)
+    dep_graph.add_child(profiles, authors, "profiles_author_id_fkey", ["id"], ["author_id"])
+
+    key_pool = KeyPool()
+    key_pool.add_keys("app.authors", "id", range(1, num_authors + 1))
+    return profiles, key_pool, dep_graph.type_registry
+
+
+def _fingerprints(values, data_type):
+    fingerprints, _ = fingerprint_rows([(values, TableColumn("value", data_type))])
+    return fingerprints
+
+
+@pytest.mark.parametrize("unique_filter", [HashSetFilter(), BloomFilter(10000)])
+def test_filter_finds_the_values_seen_before(unique_filter):
+    first = np.arange(1000, dtype=np.uint64)
+    assert not unique_filter.find_duplicates(first).any()
+
+    second = np.arange(500, 1500, dtype=np.uint64)
+    duplicates = unique_filter.find_duplicates(second)
+
+    assert duplicates[:500].all()
+    if isinstance(unique_filter, HashSetFilter):
+        assert not duplicates[500:].any()
+
+
+def test_filter_finds_duplicates_within_an_array():
+    duplicates = HashSetFilter().find_duplicates(np.array([7, 3, 7, 7, 3], dtype=np.uint64))
+
+    assert duplicates.tolist() == [False, False, True, True, True]
+
+
+def test_bloom_filter_error_rate():
+    # Fingerprints are spread over the 64 bits like random numbers
+    rng = np.random.default_rng(0)
+    bloom_filter = BloomFilter(100000, error_rate=0.01)
+    bloom_filter.add(rng.integers(0, 2**63, size=100000, dtype=np.uint64))
+
+    unseen = rng.integers(0, 2**63, size=100000, dtype=np.uint64)
+    assert bloom_filter.contains(unseen).mean() < 0.015
+
+
+def test_unique_filter_switches_to_bloom_past_the_set_size():
+    assert isinstance(create_unique_filter(UNIQUE_SET_MAX_ROWS), HashSetFilter)
+    assert isinstance(create_unique_filter(UNIQUE_SET_MAX_ROWS + 1), BloomFilter)
+
+
+def test_fingerprints_ignore_the_representation_of_values():
+    # Values the database considers equal have the same fingerprint
+    assert (
+        _fingerprints(np.array([1, 2], dtype=np.int16), "integer").tolist()
+        == _fingerprints(np.array([1, 2], dtype=object), "integer").tolist()
+    )
+    assert (
+        _fingerprints(np.array(["2024-01-02"], dtype="datetime64[D]"), "date").tolist()
+        == _fingerprints(np.array([datetime.date(2024, 1, 2)], dtype=object), "date").tolist()
+    )
+    assert (
+        _fingerprints(np.array(["ab  "], dtype=object), "character").tolist()
+        == _fingerprints(np.array(["ab"]), "character").tolist()
+    )
+
+
+def test_rows_with_nulls_are_flagged():
+    _, nulls = fingerprint_rows(
+        [
+            (np.array([1, 2, 3]), TableColumn("a", "integer")),
+            (np.array(["x", None, "z"], dtype=object), TableColumn("b", "text")),
+        ]
+    )
+
+    assert nulls.tolist() == [False, True, False]
+
+
+def test_composite_fingerprints_depend_on_the_column_order():
+    a = (np.array([1, 2]), TableColumn("a", "integer"))
+    b = (np.array([2, 1]), TableColumn("b", "integer"))
+    fingerprints, _ = fingerprint_rows([a, b])
+
+    assert fingerprints[0] != fingerprints[1]
+
+
+def test_unique_foreign_key_picks_every_key_once():
+    profiles, key_pool, type_registry = _profiles(10)
+    plan = compile_table_plan(
+        profiles, key_pool, type_registry, {"profiles_author_id_fkey": 0}, seed=1
+    )
+
+    assert plan.generate_batch(np.random.default_rng(0), 0, 10)["author_id"].tolist() == list(
+        range(1, 11)
+    )
+
+
+def test_unique_foreign_key_does_not_wrap_around():
+    profiles, key_pool, type_registry = _profiles(10)
+    plan = compile_table_plan(profiles, key_pool, type_registry, {"profiles_author_id_fkey": 0})
+
+    plan.generate_batch(np.random.default_rng(0), 0, 6)
+    with pytest.raises(ValueError, match="Not enough keys in app.authors"):
+        plan.generate_batch(np.random.default_rng(0), 6, 6)
+
+
+def test_unique_foreign_key_of_pre_existing_rows():
+    # Four profiles already reference authors 1, 2, 5 and 9: the new rows
+    # start after four keys, and those landing on a referenced key pick
+    # another one
+    profiles, key_pool, type_registry = _profiles(100)
+    unique_offsets = {"profiles_author_id_fkey": 4}
+    assert [
+        constraint.constraint_name
+        for constraint in get_checked_constraints(profiles, unique_offsets)
+    ] == ["profiles_author_id_key"]
+    assert get_checked_constraints(profiles, {"profiles_author_id_fkey": 0}) == []
+
+    unique_filter = HashSetFilter()
+    unique_filter.add(_fingerprints(np.array([1, 2, 5, 9]), "integer"))
+    plan = compile_table_plan(
+        profiles,
+        key_pool,
+        type_registry,
+        unique_offsets,
+        seed=1,
+        unique_filters={"profiles_author_id_key": unique_filter},
+    )
+    author_ids = plan.generate_batch(np.random.default_rng(0), 0, 6)["author_id"].tolist()
+
+    assert [author_ids[row] for row in (1, 2, 3, 5)] == [6, 7, 8, 10]
+    assert len(set(author_ids)) == 6
+    assert not set(author_ids) & {1, 2, 5, 9}